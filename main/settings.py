@@ -49,9 +49,10 @@ else:
 
 DATABASE_APPS = (
     "tridentstream.dbs.leveldb",
-    # "tridentstream.dbs.lmdb", # TODO: make auto growing before re-enabling
+    "tridentstream.dbs.lmdb",
     "tridentstream.dbs.memory",
     "tridentstream.dbs.shelve",
+    "tridentstream.dbs.sqlite",
 )
 
 METADATA_APPS = (
@@ -75,6 +75,16 @@ setup(
         'leveldb': [
             'leveldb>=0.193',
         ],
+        'inotify': [
+            'inotify_simple>=1.3.5',
+        ],
+        'msgpack': [
+            'msgpack>=1.0.0',
+        ],
+        'zstd': [
+            'msgpack>=1.0.0',
+            'zstandard>=0.13.0',
+        ],
         'test': [
             'pytest',
             'pytest-django',
@@ -9,6 +9,7 @@ from unplugged.models import Schedule
 
 from .listingbuilder import ListingBuilder
 from .models import ListingItem
+from .scheduler import BUILD_PRIORITY_TIMER, BUILD_WORKERS, BuildScheduler
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +22,10 @@ class BaseListingService(ServicePlugin):
     def __init__(self, config):
         self.config = config
         self.listing_builder = ListingBuilder(self)
+        self.build_scheduler = BuildScheduler(
+            partial(self.listing_builder.get_listing, use_background_recheck=False),
+            workers=config.get("build_workers", BUILD_WORKERS),
+        )
         self.automatic_rebuild_lock = threading.Lock()
 
         if self.can_automatically_rebuild:
@@ -96,16 +101,18 @@ class BaseListingService(ServicePlugin):
                 )
                 self.rebuild_listing(config, section["name"])
 
-    # TODO:
-    # if queued, do not build
-    # if queued the last 10 seconds, do not build
-    def rebuild_listing(self, config, path, delay=False):
-        threadify(self.listing_builder.get_listing, delay=delay and 3.0 or 0)(
-            config, path, use_background_recheck=False
+    def rebuild_listing(self, config, path, delay=False, priority=BUILD_PRIORITY_TIMER):
+        self.build_scheduler.schedule(
+            config, path, priority=priority, delay=delay and 3.0 or 0
         )
 
+    def build_stats(self):
+        """Queued and running listing builds and how long builds of each path took"""
+        return self.build_scheduler.stats()
+
     def unload(self):
         self._do_unload = True
+        self.build_scheduler.close()
 
         super().unload()
 
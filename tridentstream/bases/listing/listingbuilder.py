@@ -1,18 +1,41 @@
+import heapq
 import logging
+from collections import defaultdict
 from datetime import datetime, timedelta
+from itertools import groupby
 
 import pytz
 from django.conf import settings
 from django.db import transaction
+from django.db.models import Q
 from django.utils.timezone import now
 from thomas import Item, router
 
 from ...exceptions import NotModifiedException, PathNotFoundException
 from ...locktracker import LockTracker
+from ...plugins import InputPluginManager
 from .models import ListingItem
+from .scheduler import BUILD_PRIORITY_INTERACTIVE
 
 logger = logging.getLogger(__name__)
 
+LISTINGITEM_BATCH_SIZE = 500  # listingitems created or updated per query
+
+
+def group_duplicates(fingerprints):
+    """
+    Turns fingerprint -> paths into path -> the other paths with the same fingerprint
+    """
+    duplicates = {}
+    for paths in fingerprints.values():
+        if len(paths) < 2:
+            continue
+
+        for path in paths:
+            duplicates[path] = sorted(p for p in paths if p != path)
+
+    return duplicates
+
 
 class ListingBuild:
     config = None
@@ -23,6 +46,21 @@ class ListingBuild:
     listingitem_mapping = None
     linkable_metadata = None
     listing_last_update = None
+    chunk_listingitem_ids = None
+
+    def listingitem_q(self, prefix=""):
+        """
+        Matches the listingitems linked with metadata by this build, the root and
+        its children or only the listingitems of the current chunk of a chunked build.
+
+        :param prefix: Lookup path to the listingitem, e.g. listingitem__
+        """
+        if self.chunk_listingitem_ids is not None:
+            return Q(**{f"{prefix}pk__in": self.chunk_listingitem_ids})
+
+        return Q(**{f"{prefix}parent": self.listing_item_root.pk}) | Q(
+            **{f"{prefix}pk": self.listing_item_root.pk}
+        )
 
 
 class ListingBuilder:
@@ -77,7 +115,9 @@ class ListingBuilder:
                 "We run updates to this listing in the background and it is sufficiently recent to be used"
             )
             if not do_not_rebuild:
-                self.service.rebuild_listing(config, path, delay=True)
+                self.service.rebuild_listing(
+                    config, path, delay=True, priority=BUILD_PRIORITY_INTERACTIVE
+                )
             return listing_item_root
 
         if listing_item_root:
@@ -89,7 +129,11 @@ class ListingBuilder:
             if not item:
                 raise PathNotFoundException()
 
-            item.list(depth=config["level"]["listing_depth"])
+            if self.can_page_listing(item, config):
+                # the build lists the items a page at a time, only the listing itself is needed
+                item.list(limit=0)
+            else:
+                item.list(depth=config["level"]["listing_depth"])
             if last_modified and item.modified and item.modified <= last_modified:
                 raise NotModifiedException()
         except NotModifiedException:
@@ -139,42 +183,17 @@ class ListingBuilder:
 
         :param path: Root of listing view.
         """
-        listing_build = ListingBuild()
-        listing_build.config = config
-
-        try:
-            listing_item_root = ListingItem.objects.get(
-                app=self.service.name, path=path
+        if config.get("build_chunk_size"):
+            return self.build_listing_chunked(
+                listing, config, path, config["build_chunk_size"]
             )
-        except:
-            listing_item_root = ListingItem(app=self.service.name, path=path)
 
-        listing_build.listing_item_root = listing_item_root
-        listing_build.listing_last_update = listing_item_root.last_updated
-
-        # figure out the actual config for this depth
-        item_creation_mapping = {}
-
-        def do_list(listing, depth):
-            for item in listing.list():
-                if depth == 0:
-                    yield item
-                elif item.is_listable:
-                    for sub_item in do_list(item, depth=depth - 1):
-                        yield sub_item
-
-        for item in do_list(listing, config["level"]["listing_depth"]):
-            if not item.is_listable and config["edge_type"] == "folder":
-                continue
-
-            if config["edge_type"] == "file" and not item.is_streamable:
-                continue
-
-            item_path = item.path[len(listing.id) :]
-            item_path = "%s/%s" % (path.strip("/"), item_path.strip("/"))
-            item_creation_mapping[item_path] = item
+        listing_build = self.create_listing_build(config, path)
+        listing_item_root = listing_build.listing_item_root
 
+        item_creation_mapping = dict(self.iter_listing(listing, config, path))
         listing_build.item_creation_mapping = item_creation_mapping
+        self.mark_duplicates(item_creation_mapping)
 
         # find already existing entries
         existing_listing_items = {}
@@ -200,33 +219,320 @@ class ListingBuilder:
                         indexer_delete_paths.append(listingitem.path)
                         listingitem.delete()
 
-            listing_item_root.datetime = listing_item_root.datetime or now()
-            listing_item_root.is_root = True
-            listing_item_root.last_checked = now()
-            listing_item_root.save()
+            self.save_listing_item_root(listing_item_root)
 
             item_creation_mapping[listing_item_root.path] = listing
             existing_listing_items[listing_item_root.path] = listing_item_root
 
-        # prepare the text search indexer
-        indexer = config["level"].get("indexer")
-        if indexer:
-            if not is_update:
-                indexer.clear(path)
-            index_writer = indexer.get_writer(path)
-            listing_build.index_writer = index_writer
-
+        index_writer = self.prepare_index_writer(listing_build, path, is_update)
+        if index_writer:
             for indexer_delete_path in indexer_delete_paths:
                 index_writer.delete(indexer_delete_path)
-        else:
-            index_writer = None
 
         del indexer_delete_paths
 
-        # find listingitems to create and modify existing
+        self.write_listingitems(listing_build)
+
+        logger.info("Done creating listingitems, linking with metadata")
+
+        self.link_with_metadata(listing_build)
+
+        if index_writer:
+            index_writer.commit()
+
+        return listing_item_root
+
+    def build_listing_chunked(self, listing, config, path, chunk_size):
+        """
+        Builds a listing view chunk_size items at a time, each chunk is written,
+        indexed and linked with metadata before the next one is listed.
+
+        Every listingitem seen by the build is marked with the generation of the build,
+        those left with an older generation no longer exist at source and are deleted at the end.
+        """
+        listing_build = self.create_listing_build(config, path)
+        listing_item_root = listing_build.listing_item_root
+
+        is_update = listing_item_root.is_root
+        generation = listing_item_root.generation + 1
+        listing_item_root.generation = generation
+        self.save_listing_item_root(listing_item_root)
+
+        index_writer = self.prepare_index_writer(listing_build, path, is_update)
+
+        # duplicates can be in different chunks, they are written when all items are seen
+        fingerprints = defaultdict(list)
+        previous_duplicates = set()
+
+        def iter_chunks():
+            chunk = []
+            for item_path, item in self.iter_listing(
+                listing, config, path, release_listed=True, page_size=chunk_size
+            ):
+                chunk.append((item_path, item))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+
+            if chunk:
+                yield chunk
+
+            yield [(listing_item_root.path, listing)]
+
+        chunk_count = 0
+        for chunk in iter_chunks():
+            chunk_count += 1
+            listing_build.item_creation_mapping = dict(chunk)
+            listing_build.existing_listing_items = {
+                listingitem.path: listingitem
+                for listingitem in ListingItem.objects.filter(
+                    app=self.service.name,
+                    path__in=listing_build.item_creation_mapping.keys(),
+                )
+            }
+            if listing_item_root.path in listing_build.item_creation_mapping:
+                # the returned root must be the one that is updated
+                listing_build.existing_listing_items[
+                    listing_item_root.path
+                ] = listing_item_root
+
+            for item_path, item in chunk:
+                if item_path == listing_item_root.path or not item.get("fingerprint"):
+                    continue
+
+                fingerprints[item["fingerprint"]].append(item_path)
+                listingitem = listing_build.existing_listing_items.get(item_path)
+                if listingitem:
+                    duplicates = listingitem.config["original_item"]["attributes"].get(
+                        "metadata:duplicates"
+                    )
+                    if duplicates:
+                        # corrected after the last chunk, unchanged rows are not written
+                        item["metadata:duplicates"] = duplicates
+                        previous_duplicates.add(item_path)
+
+            self.write_listingitems(listing_build, generation=generation)
+
+            listing_build.chunk_listingitem_ids = list(
+                ListingItem.objects.filter(
+                    app=self.service.name,
+                    path__in=listing_build.item_creation_mapping.keys(),
+                ).values_list("pk", flat=True)
+            )
+            self.link_with_metadata(listing_build)
+
+        self.write_duplicates(
+            group_duplicates(fingerprints), previous_duplicates, listing_item_root
+        )
+        del fingerprints, previous_duplicates
+
+        logger.info(
+            f"Done building {chunk_count} chunks, deleting listingitems that no longer exist at source"
+        )
+        stale_listingitems = ListingItem.objects.filter(
+            app=self.service.name, parent=listing_item_root
+        ).exclude(generation=generation)
+        if index_writer:
+            for stale_path in stale_listingitems.values_list(
+                "path", flat=True
+            ).iterator():
+                index_writer.delete(stale_path)
+        stale_listingitems.delete()
+
+        if index_writer:
+            index_writer.commit()
+
+        return listing_item_root
+
+    def mark_duplicates(self, item_creation_mapping):
+        """
+        Sets metadata:duplicates on items with the same fingerprint as other items of the build,
+        the listing merges all inputs of a section so copies on different inputs are found.
+        """
+        fingerprints = defaultdict(list)
+        for item_path, item in item_creation_mapping.items():
+            if item.get("fingerprint"):
+                fingerprints[item["fingerprint"]].append(item_path)
+
+        for item_path, duplicates in group_duplicates(fingerprints).items():
+            item_creation_mapping[item_path]["metadata:duplicates"] = duplicates
+
+    def write_duplicates(self, duplicates, previous_duplicates, listing_item_root):
+        """
+        Updates metadata:duplicates of listingitems written by a chunked build,
+        only the rows with new or previous duplicates are loaded.
+        """
+        paths = sorted(set(duplicates) | previous_duplicates)
+        listingitems = []
+        for i in range(0, len(paths), LISTINGITEM_BATCH_SIZE):
+            listingitems.extend(
+                ListingItem.objects.filter(
+                    app=self.service.name,
+                    parent=listing_item_root,
+                    path__in=paths[i : i + LISTINGITEM_BATCH_SIZE],
+                )
+            )
+
+        changed_listingitems = []
+        for listingitem in listingitems:
+            attributes = listingitem.config["original_item"]["attributes"]
+            if attributes.get("metadata:duplicates") == duplicates.get(
+                listingitem.path
+            ):
+                continue
+
+            if listingitem.path in duplicates:
+                attributes["metadata:duplicates"] = duplicates[listingitem.path]
+            else:
+                del attributes["metadata:duplicates"]
+            listingitem.content_hash = listingitem.get_content_hash()
+            changed_listingitems.append(listingitem)
+
+        logger.info(f"Updating duplicates of {len(changed_listingitems)} listingitems")
+        ListingItem.objects.bulk_update(
+            changed_listingitems,
+            ["config", "content_hash"],
+            batch_size=LISTINGITEM_BATCH_SIZE,
+        )
+
+    def create_listing_build(self, config, path):
+        listing_build = ListingBuild()
+        listing_build.config = config
+
+        try:
+            listing_item_root = ListingItem.objects.get(
+                app=self.service.name, path=path
+            )
+        except:
+            listing_item_root = ListingItem(app=self.service.name, path=path)
+
+        listing_build.listing_item_root = listing_item_root
+        listing_build.listing_last_update = listing_item_root.last_updated
+
+        return listing_build
+
+    def save_listing_item_root(self, listing_item_root):
+        listing_item_root.datetime = listing_item_root.datetime or now()
+        listing_item_root.is_root = True
+        listing_item_root.last_checked = now()
+        listing_item_root.save()
+
+    def prepare_index_writer(self, listing_build, path, is_update):
+        """Prepares the text search indexer if the level has one"""
+        indexer = listing_build.config["level"].get("indexer")
+        if not indexer:
+            return None
+
+        if not is_update:
+            indexer.clear(path)
+        listing_build.index_writer = indexer.get_writer(path)
+        return listing_build.index_writer
+
+    def get_list_routes(self, listing):
+        return [
+            route
+            for route in listing.routes or []
+            if router.registry.get(route["handler"], {}).get("can_list")
+        ]
+
+    def can_page_listing(self, listing, config):
+        """
+        Checks if a chunked build can list the items of listing a page at a time,
+        the listing depth must be 0 and all the inputs must support paged listing.
+        """
+        if not config.get("build_chunk_size") or config["level"]["listing_depth"]:
+            return False
+
+        list_routes = self.get_list_routes(listing)
+        return bool(list_routes) and all(
+            route["handler"] in InputPluginManager.paged_list_routes
+            for route in list_routes
+        )
+
+    def iter_listing_pages(self, listing, page_size):
+        """
+        Yields the items directly below listing, each input is listed page_size items at a time.
+        The pages are ordered by name and merged so an item found in several inputs is yielded once.
+        """
+
+        def iter_route(route):
+            after = None
+            while True:
+                page_listing = listing.duplicate(clear_routes=False, clear_nested=True)
+                page_listing.routes = [route]
+                page = page_listing.list(after=after, limit=page_size) or []
+                yield from page
+
+                if len(page) < page_size:
+                    break
+                after = page[-1].id
+
+        def name_key(item):
+            return item.id.encode("utf-8", "surrogateescape")
+
+        items = heapq.merge(
+            *[iter_route(route) for route in self.get_list_routes(listing)],
+            key=name_key,
+        )
+        for _, same_items in groupby(items, key=name_key):
+            item = next(same_items)
+            for other_item in same_items:
+                item.merge(other_item)
+            yield item
+
+    def iter_listing(self, listing, config, path, release_listed=False, page_size=None):
+        """
+        Yields path and item of everything at the listing depth of the listing
+        that fits the edge type.
+
+        With release_listed the nested items of a listed item are let go when all of them are yielded.
+        With page_size the items are listed a page at a time when can_page_listing allows it,
+        so the whole listing is never in memory.
+        """
+
+        def do_list(listing, depth):
+            for item in listing.list():
+                if depth == 0:
+                    yield item
+                elif item.is_listable:
+                    for sub_item in do_list(item, depth=depth - 1):
+                        yield sub_item
+
+                    if release_listed:
+                        item.nested_items = None
+
+        if page_size and self.can_page_listing(listing, config):
+            logger.info(f"Listing {path} {page_size} items at a time")
+            items = self.iter_listing_pages(listing, page_size)
+        else:
+            items = do_list(listing, config["level"]["listing_depth"])
+
+        for item in items:
+            if not item.is_listable and config["edge_type"] == "folder":
+                continue
+
+            if config["edge_type"] == "file" and not item.is_streamable:
+                continue
+
+            item_path = item.path[len(listing.id) :]
+            item_path = "%s/%s" % (path.strip("/"), item_path.strip("/"))
+            yield item_path, item
+
+    def write_listingitems(self, listing_build, generation=None):
+        """
+        Creates and modifies the listingitems of the item_creation_mapping,
+        only changed rows are written.
+        """
+        config = listing_build.config
+        listing_item_root = listing_build.listing_item_root
+        existing_listing_items = listing_build.existing_listing_items
+        index_writer = listing_build.index_writer
+
         listingitem_children_purges = []
         listingitems = []
-        for item_path, item in item_creation_mapping.items():
+        updated_listingitems = []
+        unchanged_listingitem_ids = []
+        for item_path, item in listing_build.item_creation_mapping.items():
             if item_path in existing_listing_items:
                 listingitem = existing_listing_items[item_path]
                 should_create = False
@@ -274,34 +580,59 @@ class ListingBuilder:
             if "size" in item:
                 listingitem.attributes["size"] = item["size"]
 
+            if generation is not None:
+                listingitem.generation = generation
+
+            content_hash = listingitem.get_content_hash()
             if should_create:
+                listingitem.content_hash = content_hash
                 listingitems.append(listingitem)
+            elif listingitem.content_hash != content_hash:
+                listingitem.content_hash = content_hash
+                updated_listingitems.append(listingitem)
+            elif listingitem != listing_item_root:
+                unchanged_listingitem_ids.append(listingitem.pk)
 
             logger.trace(
                 "Creating:%s listingitem with path:%s and parent path:%s"
                 % (should_create, listingitem.path, listing_item_root.path)
             )
 
-        # save the newly created listingitems
+        logger.info(
+            f"Creating {len(listingitems)} and updating {len(updated_listingitems)} "
+            f"of {len(existing_listing_items)} existing listingitems"
+        )
+
+        update_fields = [
+            "parent",
+            "datetime",
+            "last_updated",
+            "item_type",
+            "is_root",
+            "attributes",
+            "config",
+            "content_hash",
+        ]
+        if generation is not None:
+            update_fields.append("generation")
+
+        # save the changed and newly created listingitems
         with transaction.atomic():
-            for listingitem in existing_listing_items.values():
-                listingitem.save()
+            ListingItem.objects.bulk_update(
+                updated_listingitems, update_fields, batch_size=LISTINGITEM_BATCH_SIZE,
+            )
+
+            if generation is not None and unchanged_listingitem_ids:
+                ListingItem.objects.filter(pk__in=unchanged_listingitem_ids).update(
+                    generation=generation
+                )
 
             for listingitem in listingitem_children_purges:
                 ListingItem.objects.filter(
                     app=self.service.name, parent=listingitem
                 ).delete()
 
-        ListingItem.objects.bulk_create(listingitems)
-
-        logger.info("Done creating listingitems, linking with metadata")
-
-        self.link_with_metadata(listing_build)
-
-        if index_writer:
-            index_writer.commit()
-
-        return listing_item_root
+        ListingItem.objects.bulk_create(listingitems, batch_size=LISTINGITEM_BATCH_SIZE)
 
     def link_with_metadata(self, listing_build):
         """
@@ -314,7 +645,9 @@ class ListingBuilder:
         listing_build.listingitem_mapping = {
             li.path: li
             for li in ListingItem.objects.filter(
-                app=self.service.name, parent=listing_build.listing_item_root
+                listing_build.listingitem_q(),
+                app=self.service.name,
+                parent=listing_build.listing_item_root,
             )
         }
         metadata_handlers = sorted(
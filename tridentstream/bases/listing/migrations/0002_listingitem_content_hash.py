@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("services_listing", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="listingitem",
+            name="content_hash",
+            field=models.CharField(default="", max_length=40),
+        ),
+    ]
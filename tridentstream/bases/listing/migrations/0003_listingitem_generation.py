@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("services_listing", "0002_listingitem_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="listingitem",
+            name="generation",
+            field=models.IntegerField(default=0),
+        ),
+    ]
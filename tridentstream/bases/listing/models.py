@@ -1,3 +1,5 @@
+import hashlib
+import json
 from urllib.parse import quote
 
 from django.db import models
@@ -28,6 +30,8 @@ class ListingItem(models.Model):
     is_root = models.BooleanField(default=False)
     last_updated = models.DateTimeField(null=True)
     last_checked = models.DateTimeField(null=True)
+    content_hash = models.CharField(max_length=40, default="")
+    generation = models.IntegerField(default=0)  # last chunked build that saw it
 
     class Meta:
         ordering = ("datetime",)
@@ -73,5 +77,21 @@ class ListingItem(models.Model):
 
         return metadatas
 
+    def get_content_hash(self):
+        """Hash of the fields written by a listing build, used to skip unchanged rows"""
+        content = json.dumps(
+            [
+                self.datetime and self.datetime.isoformat(),
+                self.attributes,
+                self.config,
+                self.item_type,
+                self.is_root,
+                self.parent_id,
+            ],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
     def get_original_item(self):
         return Item.unserialize(self.config["original_item"], router=router)
@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+
+from unplugged import threadify
+
+BUILD_WORKERS = 2  # listings built at the same time per service
+BUILD_PRIORITY_INTERACTIVE = 0  # rechecks of listings someone is looking at
+BUILD_PRIORITY_TIMER = 10  # automatic rebuilds
+
+logger = logging.getLogger(__name__)
+
+
+class BuildRequest:
+    def __init__(self, path, config, priority, not_before):
+        self.path = path
+        self.config = config
+        self.priority = priority
+        self.not_before = not_before
+        self.queued = time.monotonic()
+
+
+class BuildScheduler:
+    """
+    Builds listings of a service in the background with a bounded number of workers.
+
+    Requests are keyed by path, a path already waiting is not queued again but
+    keeps the highest priority and earliest start it was requested with. A path
+    requested while it is being built is queued again when the build is done,
+    the running build may have listed the source before the change.
+    Lower priority numbers are built first.
+    """
+
+    def __init__(self, build, workers=BUILD_WORKERS):
+        self.build = build
+        self.workers = workers
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.running = {}
+        self.rerun = {}
+        self.closed = False
+
+        self.requested = 0
+        self.coalesced = 0
+        self.builds = 0
+        self.failures = 0
+        self.path_stats = {}
+
+        for _ in range(workers):
+            threadify(self._work)()
+
+    def schedule(self, config, path, priority=BUILD_PRIORITY_TIMER, delay=0):
+        not_before = time.monotonic() + delay
+        with self.condition:
+            self.requested += 1
+            if path in self.running:
+                logger.debug(f"Path:{path} is being built, building again when done")
+                queue = self.rerun
+            else:
+                queue = self.pending
+
+            request = queue.get(path)
+            if request:
+                logger.debug(f"Path:{path} is already queued, coalescing")
+                self.coalesced += 1
+                request.config = config
+                request.priority = min(request.priority, priority)
+                request.not_before = min(request.not_before, not_before)
+            else:
+                queue[path] = BuildRequest(path, config, priority, not_before)
+
+            self.condition.notify()
+
+    def _next_request(self):
+        """Waits for the most important request that may run and removes it from the queue"""
+        with self.condition:
+            while not self.closed:
+                now = time.monotonic()
+                ready = [r for r in self.pending.values() if r.not_before <= now]
+                if ready:
+                    request = min(ready, key=lambda r: (r.priority, r.queued))
+                    del self.pending[request.path]
+                    self.running[request.path] = time.monotonic()
+                    return request
+
+                timeout = None
+                if self.pending:
+                    timeout = min(r.not_before for r in self.pending.values()) - now
+                self.condition.wait(timeout)
+
+    def _work(self):
+        while True:
+            request = self._next_request()
+            if request is None:
+                return
+
+            started = self.running[request.path]
+            failed = False
+            try:
+                self.build(request.config, request.path)
+            except Exception:
+                logger.exception(f"Failed to build listing for path:{request.path}")
+                failed = True
+            finally:
+                with self.condition:
+                    del self.running[request.path]
+                    self._record_build(request, started, failed)
+
+                    rerun_request = self.rerun.pop(request.path, None)
+                    if rerun_request and not self.closed:
+                        self.pending[request.path] = rerun_request
+                        self.condition.notify()
+
+    def _record_build(self, request, started, failed):
+        build_seconds = time.monotonic() - started
+        stats = self.path_stats.setdefault(
+            request.path, {"builds": 0, "failures": 0, "total_build_seconds": 0.0}
+        )
+        stats["builds"] += 1
+        stats["total_build_seconds"] += build_seconds
+        stats["last_build_seconds"] = build_seconds
+        stats["last_wait_seconds"] = started - max(request.queued, request.not_before)
+
+        self.builds += 1
+        if failed:
+            stats["failures"] += 1
+            self.failures += 1
+
+    def stats(self):
+        with self.condition:
+            now = time.monotonic()
+            return {
+                "workers": self.workers,
+                "queue_depth": len(self.pending),
+                "queued": {
+                    path: max(0.0, now - max(request.queued, request.not_before))
+                    for path, request in self.pending.items()
+                },
+                "running": {
+                    path: now - started for path, started in self.running.items()
+                },
+                "rerun": sorted(self.rerun),
+                "requested": self.requested,
+                "coalesced": self.coalesced,
+                "builds": self.builds,
+                "failures": self.failures,
+                "paths": {path: dict(stats) for path, stats in self.path_stats.items()},
+            }
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            self.rerun.clear()
+            self.condition.notify_all()
@@ -31,6 +31,8 @@ class ListingSchema(Schema):
         RelatedPluginField(plugin_type=HistoryPlugin), many=True, default=list
     )
     rebuild_automatically = fields.Boolean(default=True)
+    # build the listing this many items at a time to bound memory, 0 builds it at once
+    build_chunk_size = fields.Integer(default=0)
 
 
 class BaseSchema(Schema):
@@ -38,3 +40,5 @@ class BaseSchema(Schema):
         default="", description="Display Name", ui_schema={"ui:title": "Name"}
     )
     player_service = RelatedPluginField(plugin_type=ServicePlugin, traits=["player"])
+    # listings rebuilt in the background at the same time
+    build_workers = fields.Integer(default=2)
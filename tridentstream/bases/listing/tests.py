@@ -0,0 +1,225 @@
+import logging
+import threading
+import unittest
+from unittest import mock
+
+from django.test import TestCase
+from thomas import Item
+
+from .listingbuilder import ListingBuilder
+from .models import ListingItem
+from .scheduler import BUILD_PRIORITY_INTERACTIVE, BuildScheduler
+
+
+def create_listing(dates, fingerprints=None):
+    listing = Item(id="section")
+    listing.initiate_nested_items()
+    for name, date in dates.items():
+        item = Item(id=name, attributes={"date": date})
+        if fingerprints and name in fingerprints:
+            item["fingerprint"] = fingerprints[name]
+        item.expandable = True
+        listing.add_item(item)
+    return listing
+
+
+class ListingBuilderTestCase(TestCase):
+    def setUp(self):
+        # the trace log level is added when the server starts
+        patcher = mock.patch.object(logging.Logger, "trace", create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        service = mock.Mock()
+        service.name = "movies"
+        self.listing_builder = ListingBuilder(service)
+        self.config = {
+            "edge_type": "folder",
+            "level": {"listing_depth": 0, "metadata_handlers": []},
+        }
+
+    def build_listing(self, dates, fingerprints=None):
+        with mock.patch.object(
+            ListingItem.objects, "bulk_update", wraps=ListingItem.objects.bulk_update,
+        ) as bulk_update:
+            self.listing_item_root = self.listing_builder.build_listing(
+                create_listing(dates, fingerprints), self.config, "section"
+            )
+        return sorted(
+            listingitem.path
+            for call in bulk_update.call_args_list
+            for listingitem in call[0][0]
+        )
+
+    def test_only_changed_rows_updated(self):
+        self.assertEqual(
+            self.build_listing({"a": 1000, "b": 2000, "c": 3000}), ["section"]
+        )
+        self.assertEqual(ListingItem.objects.filter(is_root=False).count(), 3)
+
+        self.assertEqual(
+            self.build_listing({"a": 1000, "b": 2000, "c": 3000}), [],
+        )
+
+        self.assertEqual(
+            self.build_listing({"a": 1000, "b": 2500, "c": 3000, "d": 4000}),
+            ["section/b"],
+        )
+        listingitem = ListingItem.objects.get(app="movies", path="section/b")
+        self.assertEqual(listingitem.datetime.timestamp(), 2500)
+        self.assertEqual(listingitem.attributes, {"name": "b"})
+        self.assertEqual(listingitem.content_hash, listingitem.get_content_hash())
+        self.assertEqual(
+            sorted(
+                ListingItem.objects.filter(
+                    parent__path="section", app="movies"
+                ).values_list("path", flat=True)
+            ),
+            ["section/a", "section/b", "section/c", "section/d"],
+        )
+
+    def get_duplicates(self):
+        return {
+            listingitem.path: listingitem.config["original_item"]["attributes"].get(
+                "metadata:duplicates"
+            )
+            for listingitem in ListingItem.objects.filter(app="movies", is_root=False)
+        }
+
+    def test_duplicates(self):
+        dates = {"a": 1000, "b": 2000, "c": 3000}
+        fingerprints = {"a": "10-x", "b": "20-y", "c": "10-x"}
+        self.build_listing(dates, fingerprints)
+        self.assertEqual(
+            self.get_duplicates(),
+            {
+                "section/a": ["section/c"],
+                "section/b": None,
+                "section/c": ["section/a"],
+            },
+        )
+        for listingitem in ListingItem.objects.filter(app="movies"):
+            self.assertEqual(listingitem.content_hash, listingitem.get_content_hash())
+
+        self.assertEqual(self.build_listing(dates, fingerprints), [])
+
+        fingerprints["c"] = "30-z"
+        # a chunked build writes a changed row again when its duplicates change
+        self.assertEqual(
+            sorted(set(self.build_listing(dates, fingerprints))),
+            ["section/a", "section/c"],
+        )
+        self.assertEqual(
+            self.get_duplicates(),
+            {"section/a": None, "section/b": None, "section/c": None},
+        )
+
+    def test_chunked_duplicates(self):
+        self.config["build_chunk_size"] = 2
+        self.test_duplicates()
+
+    def test_chunked_build(self):
+        chunks = []
+
+        def link_metadata_listingitems(listing_build, fetch_metadata):
+            chunks.append(
+                (
+                    sorted(listing_build.item_creation_mapping),
+                    sorted(listing_build.listingitem_mapping),
+                )
+            )
+
+        metadata_handler = mock.Mock(linkable=False, priority=0)
+        metadata_handler.link_metadata_listingitems.side_effect = (
+            link_metadata_listingitems
+        )
+        indexer = mock.Mock()
+        self.config["build_chunk_size"] = 2
+        self.config["level"]["metadata_handlers"] = [metadata_handler]
+        self.config["level"]["indexer"] = indexer
+
+        self.build_listing({"a": 1000, "b": 2000, "c": 3000})
+        self.assertEqual(
+            chunks,
+            [
+                (["section/a", "section/b"], ["section/a", "section/b"]),
+                (["section/c"], ["section/c"]),
+                (["section"], []),
+            ],
+        )
+        indexer.clear.assert_called_once_with("section")
+
+        root = ListingItem.objects.get(app="movies", path="section")
+        self.assertEqual(self.listing_item_root.attributes, {"name": "section"})
+        self.assertEqual(self.listing_item_root.attributes, root.attributes)
+        self.assertEqual(self.listing_item_root.config, root.config)
+        self.assertEqual(
+            self.listing_item_root.config["original_item"]["id"], "section"
+        )
+        self.assertEqual(self.listing_item_root.last_updated, root.last_updated)
+
+        chunks.clear()
+        self.assertEqual(
+            self.build_listing({"a": 1000, "b": 2500, "d": 4000}), ["section/b"]
+        )
+        self.assertEqual(len(chunks), 3)
+        index_writer = indexer.get_writer.return_value
+        index_writer.delete.assert_called_once_with("section/c")
+        self.assertEqual(index_writer.commit.call_count, 2)
+
+        root = ListingItem.objects.get(app="movies", path="section")
+        self.assertEqual(root.generation, 2)
+        self.assertEqual(
+            sorted(
+                root.listingitem_set.filter(generation=2).values_list("path", flat=True)
+            ),
+            ["section/a", "section/b", "section/d"],
+        )
+        self.assertEqual(root.listingitem_set.count(), 3)
+
+
+class BuildSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.done = threading.Event()
+        self.built = []
+
+        def build(config, path):
+            self.release.wait(5)
+            self.built.append(path)
+            if path == "done":
+                self.done.set()
+
+        self.scheduler = BuildScheduler(build, workers=1)
+        self.addCleanup(self.scheduler.close)
+
+    def test_coalesce_and_prioritize(self):
+        self.scheduler.schedule({}, "blocking")
+        while not self.scheduler.stats()["running"]:
+            self.release.wait(0.01)
+
+        self.scheduler.schedule({}, "blocking")
+        self.scheduler.schedule({}, "movies")
+        self.scheduler.schedule({}, "tv")
+        self.scheduler.schedule({}, "tv", priority=BUILD_PRIORITY_INTERACTIVE)
+        self.scheduler.schedule({}, "movies")
+
+        stats = self.scheduler.stats()
+        self.assertEqual(stats["queue_depth"], 2)
+        self.assertEqual((stats["requested"], stats["coalesced"]), (6, 2))
+        self.assertEqual(list(stats["running"]), ["blocking"])
+        self.assertEqual(stats["rerun"], ["blocking"])
+
+        self.scheduler.schedule({}, "done", delay=0.05)
+        self.release.set()
+        self.assertTrue(self.done.wait(5))
+
+        self.assertEqual(self.built, ["blocking", "tv", "blocking", "movies", "done"])
+        while self.scheduler.stats()["running"]:
+            self.release.wait(0.01)
+
+        stats = self.scheduler.stats()
+        self.assertEqual((stats["builds"], stats["queue_depth"]), (5, 0))
+        self.assertEqual(stats["paths"]["blocking"]["builds"], 2)
+        self.assertEqual(stats["paths"]["tv"]["builds"], 1)
+        self.assertGreaterEqual(stats["paths"]["tv"]["last_wait_seconds"], 0)
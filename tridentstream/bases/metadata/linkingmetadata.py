@@ -2,7 +2,6 @@ import logging
 from collections import defaultdict
 
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
 from unplugged import Schema
 
 from ...plugins import MetadataHandlerPlugin
@@ -30,14 +29,12 @@ class LinkingMetadataHandlerPlugin(
     config_schema = Schema
 
     def link_metadata_listingitems(self, listing_build, fetch_metadata=True):
-        listing_item_root = listing_build.listing_item_root
         linkable_metadata = listing_build.linkable_metadata
 
         metadata_mapping = defaultdict(set)
         for p in linkable_metadata:
             base_qs = p.listing_item_relation_model.objects.filter(
-                Q(listingitem__parent=listing_item_root)
-                | Q(listingitem=listing_item_root)
+                listing_build.listingitem_q("listingitem__")
             )
             items_to_link = self.metadata_link_model.objects.filter(
                 content_type=ContentType.objects.get_for_model(p.model),
@@ -60,7 +57,7 @@ class LinkingMetadataHandlerPlugin(
                 for item in local_metadata_mapping[metadata_id]:
                     metadata_mapping[listingitem_id].add(item)
 
-        self.listingitem_relinking(listing_item_root, metadata_mapping)
+        self.listingitem_relinking(listing_build, metadata_mapping)
 
     def schedule_update(self):
         pass
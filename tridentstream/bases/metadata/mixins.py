@@ -19,7 +19,7 @@ class ListingItemRelinkingMixin:
 
     listing_item_relation_model = None
 
-    def listingitem_relinking(self, listing_item_root, metadata_mapping):
+    def listingitem_relinking(self, listing_build, metadata_mapping):
         logger.debug("Figuring out what we can delete or just update")
         existing_listingitem_relations = defaultdict(set)
         actual_existing_listingitem_relations = {}
@@ -29,7 +29,7 @@ class ListingItemRelinkingMixin:
             metadata_id,
             user_id,
         ) in self.listing_item_relation_model.objects.filter(
-            Q(listingitem__parent=listing_item_root) | Q(listingitem=listing_item_root)
+            listing_build.listingitem_q("listingitem__")
         ).values_list(
             "pk", "listingitem_id", "metadata_id", "user_id"
         ):
@@ -45,10 +45,8 @@ class ListingItemRelinkingMixin:
         remove_relations = []
         create_relations = []
 
-        listing_item_model = type(listing_item_root)
-        listingitems = listing_item_model.objects.filter(
-            Q(pk=listing_item_root.pk) | Q(parent=listing_item_root)
-        )
+        listing_item_model = type(listing_build.listing_item_root)
+        listingitems = listing_item_model.objects.filter(listing_build.listingitem_q())
         for listingitem_id in listingitems.values_list("pk", flat=True):
             metadata_ids = metadata_mapping.get(listingitem_id, set())
             existing_metadata_ids = existing_listingitem_relations.get(
@@ -154,12 +152,9 @@ class PopulateMetadataJSONAPIMixin:
         if not self.has_prefetch_related_denormalized():
             prefetch_related += [f"metadata__{x}" for x in self.prefetch_related]
         select_related = [f"metadata__{x}" for x in self.select_related]
-        relations = (
-            self.listing_item_relation_model.objects.filter(
-                listingitem__in=listingitem_ids
-            )
-            .filter(Q(user__isnull=True) | Q(user=user))
-        )
+        relations = self.listing_item_relation_model.objects.filter(
+            listingitem__in=listingitem_ids
+        ).filter(Q(user__isnull=True) | Q(user=user))
         if select_related:
             relations = relations.select_related(*select_related)
         if prefetch_related:
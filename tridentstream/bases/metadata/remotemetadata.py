@@ -274,12 +274,12 @@ class RemoteMetadataHandlerPlugin(
 
         listingitem_metadata_mapping = defaultdict(set)
         for path, pk in listing_item_model.objects.filter(
-            Q(pk=listing_item_root.pk) | Q(parent=listing_item_root)
+            listing_build.listingitem_q()
         ).values_list("path", "pk"):
             for identifier in metadata_mapping[path]:
                 listingitem_metadata_mapping[pk].add((metadata[identifier], None))
 
-        self.listingitem_relinking(listing_item_root, listingitem_metadata_mapping)
+        self.listingitem_relinking(listing_build, listingitem_metadata_mapping)
 
         if index_writer and self.fulltext_fields:
             logger.debug(f"Creating search index for metadata {self.name}")
@@ -0,0 +1,102 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Scalable bloom filter of string keys.
+
+    When the newest filter is full a filter twice the size with half the
+    error rate is added, so the total false positive rate stays below
+    twice error_rate no matter how many keys are added.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.01, filters=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filters = filters or []  # [capacity, num_bits, num_hashes, count, bits]
+        if not self.filters:
+            self._add_filter(capacity)
+
+    def _add_filter(self, capacity):
+        error_rate = self.error_rate * (0.5 ** len(self.filters))
+        num_bits = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        self.filters.append(
+            [capacity, num_bits, num_hashes, 0, bytearray((num_bits + 7) // 8)]
+        )
+
+    @staticmethod
+    def _hashes(key):
+        digest = hashlib.blake2b(key.encode("latin-1"), digest_size=16).digest()
+        return (
+            int.from_bytes(digest[:8], "little"),
+            int.from_bytes(digest[8:], "little"),
+        )
+
+    @staticmethod
+    def _positions(hashes, num_bits, num_hashes):
+        h1, h2 = hashes
+        return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+    def _contains(self, hashes):
+        for _, num_bits, num_hashes, _, bits in self.filters:
+            for position in self._positions(hashes, num_bits, num_hashes):
+                if not bits[position >> 3] & (1 << (position & 7)):
+                    break
+            else:
+                return True
+        return False
+
+    def __contains__(self, key):
+        return self._contains(self._hashes(key))
+
+    def __len__(self):
+        """Keys added, keys that were false positives when added are not counted"""
+        return sum(f[3] for f in self.filters)
+
+    def add(self, key):
+        hashes = self._hashes(key)
+        if self._contains(hashes):
+            return
+
+        if self.filters[-1][3] >= self.filters[-1][0]:
+            self._add_filter(self.filters[-1][0] * 2)
+
+        f = self.filters[-1]
+        _, num_bits, num_hashes, _, bits = f
+        for position in self._positions(hashes, num_bits, num_hashes):
+            bits[position >> 3] |= 1 << (position & 7)
+        f[3] += 1
+
+    @property
+    def size(self):
+        """Size of the bit arrays in bytes"""
+        return sum(len(f[4]) for f in self.filters)
+
+    def expected_false_positive_rate(self):
+        rate = 1.0
+        for _, num_bits, num_hashes, count, _ in self.filters:
+            rate *= 1 - (1 - math.exp(-num_hashes * count / num_bits)) ** num_hashes
+        return 1 - rate
+
+    def serialize(self):
+        return {
+            "capacity": self.capacity,
+            "error_rate": self.error_rate,
+            "filters": [
+                [capacity, num_bits, num_hashes, count, bytes(bits)]
+                for capacity, num_bits, num_hashes, count, bits in self.filters
+            ],
+        }
+
+    @classmethod
+    def deserialize(cls, data):
+        return cls(
+            data["capacity"],
+            data["error_rate"],
+            [
+                [capacity, num_bits, num_hashes, count, bytearray(bits)]
+                for capacity, num_bits, num_hashes, count, bits in data["filters"]
+            ],
+        )
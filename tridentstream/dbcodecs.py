@@ -0,0 +1,172 @@
+import logging
+import os
+import pickle
+import threading
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Every value starts with a marker telling how it was encoded.
+# Pickled values start with the protocol opcode and are used as-is, that
+# way values written before codecs existed are still readable.
+MARKER_PICKLE = b"\x80"
+MARKER_MSGPACK = b"\x01"
+MARKER_MSGPACK_ZLIB = b"\x02"
+MARKER_MSGPACK_ZSTD = b"\x03"
+
+EXT_SET = 1
+EXT_PICKLE = 2  # anything msgpack cannot store as-is, e.g. tuples and datetimes
+
+MIN_COMPRESS_SIZE = 64  # bytes, smaller values are not worth compressing
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+ZSTD_DICTIONARY_SIZE = 16 * 1024  # bytes
+ZSTD_TRAINING_SAMPLES = 2000  # values encoded before a dictionary is trained
+
+CODECS = ["pickle", "msgpack", "msgpack-zlib", "msgpack-zstd"]
+
+
+class CodecNotAvailableException(Exception):
+    """The library needed for a codec is not installed"""
+
+
+def _msgpack_default(obj):
+    if type(obj) is set:
+        return msgpack.ExtType(EXT_SET, _msgpack_pack(list(obj)))
+    return msgpack.ExtType(EXT_PICKLE, pickle.dumps(obj))
+
+
+def _msgpack_ext_hook(code, data):
+    if code == EXT_SET:
+        return set(_msgpack_unpack(data))
+    elif code == EXT_PICKLE:
+        return pickle.loads(data)
+    return msgpack.ExtType(code, data)
+
+
+def _msgpack_pack(value):
+    return msgpack.packb(
+        value, default=_msgpack_default, use_bin_type=True, strict_types=True
+    )
+
+
+def _msgpack_unpack(data):
+    return msgpack.unpackb(
+        data, raw=False, ext_hook=_msgpack_ext_hook, strict_map_key=False
+    )
+
+
+class ValueCodec:
+    """
+    Encodes values with the chosen codec and decodes values written with any codec.
+
+    The zstd codec trains a dictionary from the first values it encodes and
+    saves it to dictionary_path, values are stored as plain msgpack until then.
+    """
+
+    def __init__(self, name="pickle", dictionary_path=None):
+        if name not in CODECS:
+            raise ValueError(f"Unknown codec {name!r}, must be one of {CODECS}")
+
+        if name != "pickle" and msgpack is None:
+            raise CodecNotAvailableException(f"Codec {name} requires msgpack")
+
+        if name == "msgpack-zstd" and zstandard is None:
+            raise CodecNotAvailableException(f"Codec {name} requires zstandard")
+
+        self.name = name
+        self.dictionary_path = dictionary_path
+        self.dictionary = None
+        self._samples = []
+        self._samples_lock = threading.Lock()
+        self._local = threading.local()
+
+        if zstandard and dictionary_path and os.path.isfile(dictionary_path):
+            with open(dictionary_path, "rb") as f:
+                self.dictionary = zstandard.ZstdCompressionDict(f.read())
+
+    def _get_zstd(self, name, cls, **kwargs):
+        """Zstd (de)compressors are not thread safe, each thread gets its own"""
+        instance = getattr(self._local, name, None)
+        if instance is None or instance[0] is not self.dictionary:
+            instance = (self.dictionary, cls(dict_data=self.dictionary, **kwargs))
+            setattr(self._local, name, instance)
+        return instance[1]
+
+    def _add_sample(self, data):
+        with self._samples_lock:
+            if self.dictionary is not None:
+                return
+
+            self._samples.append(data)
+            if len(self._samples) < ZSTD_TRAINING_SAMPLES:
+                return
+
+            samples, self._samples = self._samples, []
+            try:
+                dictionary = zstandard.train_dictionary(ZSTD_DICTIONARY_SIZE, samples)
+            except zstandard.ZstdError:
+                logger.warning("Unable to train a zstd dictionary, trying again later")
+                return
+
+            if self.dictionary_path:
+                tmp_path = f"{self.dictionary_path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(dictionary.as_bytes())
+                os.replace(tmp_path, self.dictionary_path)
+
+            logger.info(f"Trained a zstd dictionary from {len(samples)} values")
+            self.dictionary = dictionary
+
+    def encode(self, value):
+        if self.name == "pickle":
+            return pickle.dumps(value)
+
+        data = _msgpack_pack(value)
+        if self.name == "msgpack" or len(data) < MIN_COMPRESS_SIZE:
+            return MARKER_MSGPACK + data
+
+        if self.name == "msgpack-zlib":
+            compressed = MARKER_MSGPACK_ZLIB + zlib.compress(data, ZLIB_LEVEL)
+        elif self.dictionary is None:
+            self._add_sample(data)
+            return MARKER_MSGPACK + data
+        else:
+            compressor = self._get_zstd(
+                "compressor", zstandard.ZstdCompressor, level=ZSTD_LEVEL
+            )
+            compressed = MARKER_MSGPACK_ZSTD + compressor.compress(data)
+
+        if len(compressed) < len(data) + 1:
+            return compressed
+        return MARKER_MSGPACK + data
+
+    def decode(self, data):
+        marker = bytes(data[:1])
+        msgpack_markers = (MARKER_MSGPACK, MARKER_MSGPACK_ZLIB, MARKER_MSGPACK_ZSTD)
+        if marker in msgpack_markers and msgpack is None:
+            raise CodecNotAvailableException("Value is encoded with msgpack")
+
+        if marker == MARKER_MSGPACK:
+            return _msgpack_unpack(data[1:])
+        elif marker == MARKER_MSGPACK_ZLIB:
+            return _msgpack_unpack(zlib.decompress(data[1:]))
+        elif marker == MARKER_MSGPACK_ZSTD:
+            if self.dictionary is None:
+                raise CodecNotAvailableException(
+                    "Value is compressed with a zstd dictionary that is missing"
+                )
+            decompressor = self._get_zstd("decompressor", zstandard.ZstdDecompressor)
+            return _msgpack_unpack(decompressor.decompress(data[1:]))
+
+        return pickle.loads(data)
@@ -1,13 +1,12 @@
-import pickle
-
-from unplugged import Schema, fields
+from unplugged import fields
 
 import leveldb
 
-from ...plugins import DatabasePlugin
+from ...plugins import DatabasePlugin, DatabaseSchema
+from ...plugins.db import in_scan_range, scan_start
 
 
-class LevelDBDatabaseSchema(Schema):
+class LevelDBDatabaseSchema(DatabaseSchema):
     path = fields.String()
 
 
@@ -18,30 +17,73 @@ class LevelDBDatabasePlugin(DatabasePlugin):
     loaded = False
 
     def __init__(self, config):
-        self.db = leveldb.LevelDB(self.get_database_path(config["path"]))
+        path = self.get_database_path(config["path"])
+        self.setup_codec(config, path)
+        self.db = leveldb.LevelDB(path)
         self.loaded = True
 
     def unload(self):
         self.close()
 
     def __getitem__(self, key):
-        return pickle.loads(self.db.Get(key.encode("utf-8")))
+        return self.codec.decode(self.db.Get(key.encode(self.key_encoding)))
 
     def __setitem__(self, key, value):
-        self.db.Put(key.encode("utf-8"), pickle.dumps(value))
+        self.db.Put(key.encode(self.key_encoding), self.codec.encode(value))
 
     def __delitem__(self, key):
-        self.db.Delete(key.encode("utf-8"))
+        self.db.Delete(key.encode(self.key_encoding))
+
+    def get_many(self, keys):
+        result = {}
+        for key in keys:
+            try:
+                result[key] = self.codec.decode(
+                    self.db.Get(key.encode(self.key_encoding))
+                )
+            except KeyError:
+                pass
+
+        return result
+
+    def put_many(self, items):
+        self.write_many(items, [])
+
+    def delete_many(self, keys):
+        self.write_many({}, keys)
+
+    def write_many(self, items, delete_keys):
+        batch = leveldb.WriteBatch()
+        for key, value in items.items():
+            batch.Put(key.encode(self.key_encoding), self.codec.encode(value))
+
+        for key in delete_keys:
+            batch.Delete(key.encode(self.key_encoding))
+
+        self.db.Write(batch)
+
+    def scan(self, prefix="", start=None, end=None):
+        if not self.loaded:
+            return
+
+        key_from = scan_start(prefix, start).encode(self.key_encoding)
+        for key, value in self.db.RangeIter(key_from=key_from, include_value=True):
+            key = bytes(key).decode(self.key_encoding)
+            if not in_scan_range(key, prefix, end):
+                break
+            yield key, self.codec.decode(value)
 
     def keys(self):
-        return list(self.db.RangeIter(include_value=False))
+        return [key for key in self]
 
     def __len__(self):
-        return len(self.keys())
+        if not self.loaded:
+            return 0
+        return sum(1 for _ in self.db.RangeIter(include_value=False))
 
     def __contains__(self, key):
         try:
-            self.db.Get(key.encode("utf-8"))
+            self.db.Get(key.encode(self.key_encoding))
             return True
         except KeyError:
             return False
@@ -57,7 +99,8 @@ class LevelDBDatabasePlugin(DatabasePlugin):
             self.db.Delete(b"__donotuse")
 
     def __iter__(self):
-        if self.loaded:
-            return self.db.RangeIter(include_value=False)
-        else:
-            return []
+        if not self.loaded:
+            return
+
+        for key in self.db.RangeIter(include_value=False):
+            yield bytes(key).decode(self.key_encoding)
@@ -1,61 +1,187 @@
-import pickle
+import logging
+import threading
+from contextlib import contextmanager
 
-from unplugged import Schema, fields
+from unplugged import fields
 
 import lmdb
 
-from ...plugins import DatabasePlugin
+from ...plugins import DatabasePlugin, DatabaseSchema
+from ...plugins.db import in_scan_range, scan_start
 
+logger = logging.getLogger(__name__)
 
-class LMDBDatabaseSchema(Schema):
+ITER_CHUNK_SIZE = 1000  # items read per transaction when iterating
+
+
+class LMDBDatabaseSchema(DatabaseSchema):
     path = fields.String()
+    map_size = fields.Integer(default=64)  # initial size in MB, grows when full
 
 
 class LMDBDatabasePlugin(DatabasePlugin):
     plugin_name = "lmdb"
 
     config_schema = LMDBDatabaseSchema
+    loaded = False
 
     def __init__(self, config):
+        path = self.get_database_path(config["path"])
+        self.setup_codec(config, path)
         self.db = lmdb.open(
-            self.get_database_path(config["path"]),
-            map_size=500 * 1024 * 1024,  # TODO: autoscale
+            path,
+            map_size=config.get("map_size", 64) * 1024 * 1024,
             map_async=True,
             writemap=True,
             metasync=False,
         )
+        self.loaded = True
+        self._txn_condition = threading.Condition()
+        self._active_txns = 0
 
     def unload(self):
         self.close()
 
+    @contextmanager
+    def _begin(self, write=False, buffers=False):
+        """
+        Starts a transaction, the map cannot be resized while any transaction is active.
+        """
+        with self._txn_condition:
+            self._active_txns += 1
+
+        try:
+            with self.db.begin(write=write, buffers=buffers) as txn:
+                yield txn
+        finally:
+            with self._txn_condition:
+                self._active_txns -= 1
+                self._txn_condition.notify_all()
+
+    def _grow(self):
+        with self._txn_condition:
+            while self._active_txns:
+                self._txn_condition.wait()
+
+            map_size = self.db.info()["map_size"] * 2
+            logger.info(f"LMDB map is full, growing it to {map_size} bytes")
+            self.db.set_mapsize(map_size)
+
+    def _write(self, f):
+        """
+        Runs f with a write transaction, growing the map and retrying when it is full.
+        """
+        while True:
+            try:
+                with self._begin(write=True) as txn:
+                    return f(txn)
+            except lmdb.MapFullError:
+                self._grow()
+
     def __getitem__(self, key):
-        with self.db.begin() as txn:
-            value = txn.get(key.encode("utf-8"))
-            if value:
-                return pickle.loads(value)
+        with self._begin(buffers=True) as txn:
+            value = txn.get(key.encode(self.key_encoding))
+            if value is None:
+                raise KeyError(key)
+            return self.codec.decode(value)
 
     def __setitem__(self, key, value):
-        with self.db.begin(write=True) as txn:
-            txn.put(key.encode("utf-8"), pickle.dumps(value))
+        value = self.codec.encode(value)
+        self._write(lambda txn: txn.put(key.encode(self.key_encoding), value))
 
     def __delitem__(self, key):
-        with self.db.begin(write=True) as txn:
-            txn.delete(key.encode("utf-8"))
+        if not self._write(lambda txn: txn.delete(key.encode(self.key_encoding))):
+            raise KeyError(key)
+
+    def get_many(self, keys):
+        result = {}
+        with self._begin(buffers=True) as txn:
+            for key in keys:
+                value = txn.get(key.encode(self.key_encoding))
+                if value is not None:
+                    result[key] = self.codec.decode(value)
+
+        return result
+
+    def put_many(self, items):
+        self.write_many(items, [])
+
+    def delete_many(self, keys):
+        self.write_many({}, keys)
+
+    def write_many(self, items, delete_keys):
+        encoded_items = [
+            (key.encode(self.key_encoding), self.codec.encode(value))
+            for key, value in items.items()
+        ]
+        encoded_delete_keys = [key.encode(self.key_encoding) for key in delete_keys]
+
+        def write(txn):
+            for key, value in encoded_items:
+                txn.put(key, value)
+
+            for key in encoded_delete_keys:
+                txn.delete(key)
+
+        self._write(write)
 
     def keys(self):
-        return [k for k, v in self.db.cursor()]
+        return list(self)
 
     def __len__(self):
         return int(self.db.stat()["entries"])
 
     def __contains__(self, key):
-        return self[key] is not None
+        with self._begin(buffers=True) as txn:
+            return txn.get(key.encode(self.key_encoding)) is not None
 
     def close(self):
-        self.db.close()
+        if self.loaded:
+            self.loaded = False
+            self.db.close()
 
     def sync(self):
-        self.db.sync()
+        if self.loaded:
+            self.db.sync(True)
+
+    def _iterate(self, start=b"", include_values=False):
+        """
+        Iterates (key, value) with a cursor in chunks, no transaction is held open
+        between chunks so writes and map growth are not blocked.
+        """
+        last_key = None
+        while self.loaded:
+            with self._begin() as txn:
+                cursor = txn.cursor()
+                if last_key is None:
+                    found = cursor.set_range(start)
+                else:
+                    found = cursor.set_range(last_key)
+                    if found and cursor.key() == last_key:
+                        found = cursor.next()
+
+                items = []
+                while found and len(items) < ITER_CHUNK_SIZE:
+                    items.append(
+                        (cursor.key(), cursor.value() if include_values else None)
+                    )
+                    found = cursor.next()
+
+            if not items:
+                break
+
+            yield from items
+
+            last_key = items[-1][0]
+
+    def scan(self, prefix="", start=None, end=None):
+        key_from = scan_start(prefix, start).encode(self.key_encoding)
+        for key, value in self._iterate(key_from, include_values=True):
+            key = key.decode(self.key_encoding)
+            if not in_scan_range(key, prefix, end):
+                break
+            yield key, self.codec.decode(value)
 
     def __iter__(self):
-        return self.db.cursor()
+        for key, _ in self._iterate():
+            yield key.decode(self.key_encoding)
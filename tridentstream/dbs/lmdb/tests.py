@@ -5,3 +5,24 @@ from .handler import LMDBDatabasePlugin
 class LMDBDatabaseTest(ShelfDatabaseTest):
     def open_database(self):
         return LMDBDatabasePlugin({"path": self.db_path})
+
+    def test_map_grows_when_full(self):
+        self.db.close()
+        self.db = LMDBDatabasePlugin({"path": self.db_path, "map_size": 1})
+
+        value = "x" * 1024
+        self.db.put_many({f"key{i}": value for i in range(2000)})
+        for i in range(2000, 3000):
+            self.db[f"key{i}"] = value
+
+        self.assertEqual(len(self.db), 3000)
+        self.assertGreater(self.db.db.info()["map_size"], 1024 * 1024)
+        self.assertEqual(self.db["key2999"], value)
+
+    def test_iterate_keys(self):
+        keys = set(f"key{i}" for i in range(2500))
+        self.db.put_many({key: key for key in keys})
+
+        self.assertEqual(set(self.db), keys)
+        self.assertEqual(set(self.db.keys()), keys)
+        self.assertRaises(KeyError, lambda: self.db["missing"])
@@ -1,6 +1,7 @@
 from unplugged import Schema
 
 from ...plugins import DatabasePlugin
+from ...plugins.db import SortedKeyIndex
 
 
 class MemoryDatabasePlugin(dict, DatabasePlugin):
@@ -9,11 +10,28 @@ class MemoryDatabasePlugin(dict, DatabasePlugin):
     config_schema = Schema
 
     def __init__(self, config):
-        pass
+        self.key_index = SortedKeyIndex()
 
     def unload(self):
         self.clear()
 
+    def __setitem__(self, key, value):
+        self.key_index.add(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.key_index.discard(key)
+
+    def put_many(self, items):
+        for key in items:
+            self.key_index.add(key)
+        self.update(items)
+
+    def clear(self):
+        dict.clear(self)
+        self.key_index.clear()
+
     def sync(self):
         pass
 
@@ -2,14 +2,15 @@ import logging
 import os
 from shelve import DbfilenameShelf
 
-from unplugged import Schema, fields
+from unplugged import fields
 
-from ...plugins import DatabasePlugin
+from ...plugins import DatabasePlugin, DatabaseSchema
+from ...plugins.db import SortedKeyIndex
 
 logger = logging.getLogger(__name__)
 
 
-class ShelfDatabaseSchema(Schema):
+class ShelfDatabaseSchema(DatabaseSchema):
     path = fields.String()
 
 
@@ -22,13 +23,19 @@ class ShelfDatabasePlugin(DbfilenameShelf, DatabasePlugin):
 
     def __init__(self, config):
         self.config = config
+        self.setup_codec(config, self.get_database_path(config["path"]))
         self._open()
+        # dbm iterates keys in hash order, the sorted keys are kept for scans
+        self.key_index = SortedKeyIndex(
+            key.decode(self.keyencoding) for key in self.dict.keys()
+        )
 
     def _open(self):
         DbfilenameShelf.__init__(
             self,
             os.path.join(self.get_database_path(self.config["path"]), "shelfdb.db"),
         )
+        self.keyencoding = self.key_encoding
 
     def unload(self):
         self.close()
@@ -36,6 +43,25 @@ class ShelfDatabasePlugin(DbfilenameShelf, DatabasePlugin):
     def __repr__(self):
         return DatabasePlugin.__repr__(self)
 
+    def __getitem__(self, key):
+        try:
+            value = self.cache[key]
+        except KeyError:
+            value = self.codec.decode(self.dict[key.encode(self.keyencoding)])
+            if self.writeback:
+                self.cache[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if self.writeback:
+            self.cache[key] = value
+        self.dict[key.encode(self.keyencoding)] = self.codec.encode(value)
+        self.key_index.add(key)
+
+    def __delitem__(self, key):
+        DbfilenameShelf.__delitem__(self, key)
+        self.key_index.discard(key)
+
     def sync(self):
         if self._doing_sync:
             return
@@ -68,6 +68,18 @@ class ShelfDatabaseTest(TestCase):
         self.assertNotIn("test", self.db)
         self.assertIn("\x01\x03", self.db)
         self.assertIn("test2", self.db)
+        self.assertEqual(
+            list(self.db.scan()), [("\x01\x03", "\x01\x03"), ("test2", "abc")]
+        )
+
+    def test_binary_keys(self):
+        key = "\x00" + bytes(range(236, 256)).decode("latin-1")
+        self.db[key] = b"\x00\xff"
+
+        self.db.sync()
+
+        self.assertEqual(self.db[key], b"\x00\xff")
+        self.assertEqual(list(self.db.keys()), [key])
 
     def test_complex_types(self):
         self.db["set"] = set([1, 2, 3])
@@ -76,7 +88,122 @@ class ShelfDatabaseTest(TestCase):
         self.db["dict"] = dict(a=1, b=2)
         self.assertEqual(self.db["dict"], dict(a=1, b=2))
 
+    def test_bulk_operations(self):
+        self.db.put_many({"\x01\x03": "\x01\x03", "test": "test", "set": set([1])})
+        self.db.sync()
+
+        self.assertEqual(
+            self.db.get_many(["test", "set", "missing"]),
+            {"test": "test", "set": set([1])},
+        )
+        self.assertEqual(len(self.db), 3)
+
+        self.db.delete_many(["test", "set", "missing"])
+        self.db.sync()
+
+        self.assertEqual(len(self.db), 1)
+        self.assertNotIn("test", self.db)
+        self.assertEqual(self.db.get_many(["\x01\x03"]), {"\x01\x03": "\x01\x03"})
+
+    def test_scan(self):
+        self.db.put_many({"\x01a": 1, "\x01b": 2, "\x01c": 3, "\x02a": 4, "\x00a": 5})
+        self.db.sync()
+
+        self.assertEqual(
+            list(self.db.scan("\x01")), [("\x01a", 1), ("\x01b", 2), ("\x01c", 3)]
+        )
+        self.assertEqual(
+            list(self.db.scan("\x01", start="\x01b")), [("\x01b", 2), ("\x01c", 3)]
+        )
+        self.assertEqual(
+            list(self.db.scan(start="\x01a", end="\x02a")),
+            [("\x01a", 1), ("\x01b", 2), ("\x01c", 3)],
+        )
+        self.assertEqual(list(self.db.scan("\x03")), [])
+        self.assertEqual(len(list(self.db.scan())), 5)
+
+    def test_sync_during_scan(self):
+        self.db.put_many({f"\x01{i:03}": i for i in range(25)})
+        self.db.sync()
+
+        scanned = []
+        for key, value in self.db.scan("\x01"):
+            scanned.append(value)
+            self.db.put_many({"\x02" + key[1:]: value})
+            self.db.sync()
+
+        self.assertEqual(scanned, list(range(25)))
+        self.assertEqual(len(list(self.db.scan("\x02"))), 25)
+
+    def test_scan_after_delete(self):
+        self.db.put_many({"\x01a": 1, "\x01b": 2, "\x01c": 3})
+        self.db["\x01d"] = 4
+        del self.db["\x01b"]
+        self.db.delete_many(["\x01c"])
+        self.db.sync()
+
+        self.assertEqual(list(self.db.scan("\x01")), [("\x01a", 1), ("\x01d", 4)])
+
 
 class ShelfDatabaseCacheTest(ShelfDatabaseTest):
     def open_database(self):
         return DatabaseCacheLayer(super(ShelfDatabaseCacheTest, self).open_database())
+
+    def test_scan_uncommitted(self):
+        self.db.put_many({"\x01a": 1, "\x01b": 2, "\x01c": 3})
+        self.db.sync()
+
+        self.db["\x01b"] = 20
+        self.db["\x01d"] = 4
+        self.db["\x01"] = 0
+        del self.db["\x01c"]
+
+        self.assertEqual(
+            list(self.db.scan("\x01")),
+            [("\x01", 0), ("\x01a", 1), ("\x01b", 20), ("\x01d", 4)],
+        )
+        self.assertEqual(sorted(self.db.keys()), ["\x01", "\x01a", "\x01b", "\x01d"])
+
+    def test_dirty_bytes(self):
+        self.db["a"] = b"x" * 1000
+        dirty_bytes = self.db.stats()["dirty_bytes"]
+        self.assertGreater(dirty_bytes, 1000)
+
+        self.db["a"] = b"x" * 10
+        self.assertLess(self.db.stats()["dirty_bytes"], dirty_bytes - 900)
+
+        del self.db["a"]
+        del self.db["b"]
+        self.assertGreater(self.db.stats()["dirty_bytes"], 0)
+
+        self.db.sync()
+        self.assertEqual(self.db.stats()["dirty_bytes"], 0)
+
+
+class ShelfDatabaseLRUCacheTest(ShelfDatabaseTest):
+    def open_database(self):
+        return DatabaseCacheLayer(
+            super(ShelfDatabaseLRUCacheTest, self).open_database(), max_size=2
+        )
+
+    def test_lru_eviction(self):
+        self.db.put_many({"a": 1, "b": 2, "c": 3})
+        self.assertEqual(self.db.stats()["dirty"], 3)
+        self.assertEqual(self.db.stats()["evictions"], 0)
+
+        self.db.sync()
+        self.assertEqual(self.db.stats()["dirty"], 0)
+        self.assertEqual(self.db.stats()["cached"], 2)
+        self.assertEqual(self.db.stats()["evictions"], 1)
+
+        self.assertEqual(self.db["b"], 2)
+        self.assertEqual(self.db["a"], 1)
+        self.assertEqual(self.db["b"], 2)
+        self.db["d"] = 4
+        self.assertEqual(self.db["c"], 3)
+
+        stats = self.db.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 2))
+        self.assertEqual(stats["evictions"], 3)
+        self.assertEqual(stats["cached"], 2)
+        self.assertEqual(self.db["d"], 4)
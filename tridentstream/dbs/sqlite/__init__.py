@@ -0,0 +1 @@
+default_app_config = "tridentstream.dbs.sqlite.apps.AppConfig"
@@ -0,0 +1,14 @@
+import logging
+
+from django.apps import AppConfig as DjangoAppConfig
+
+logger = logging.getLogger(__name__)
+
+
+class AppConfig(DjangoAppConfig):
+    name = "tridentstream.dbs.sqlite"
+    verbose_name = "SQLite Database Plugin"
+    label = "db_sqlite"
+
+    def ready(self):
+        from .handler import SQLiteDatabasePlugin  # NOQA
@@ -0,0 +1,239 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from unplugged import fields
+
+from ...plugins import DatabasePlugin, DatabaseSchema
+from ...plugins.db import scan_start
+
+logger = logging.getLogger(__name__)
+
+SQL_CREATE_TABLE = "CREATE TABLE IF NOT EXISTS kv (key BLOB PRIMARY KEY, value BLOB NOT NULL) WITHOUT ROWID"
+SQL_GET = "SELECT value FROM kv WHERE key = ?"
+SQL_CONTAINS = "SELECT 1 FROM kv WHERE key = ?"
+SQL_PUT = "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)"
+SQL_DELETE = "DELETE FROM kv WHERE key = ?"
+SQL_COUNT = "SELECT COUNT(*) FROM kv"
+SQL_KEYS = "SELECT key FROM kv WHERE key >= ? ORDER BY key LIMIT ?"
+SQL_SCAN = "SELECT key, value FROM kv WHERE key >= ? ORDER BY key LIMIT ?"
+SQL_SCAN_RANGE = (
+    "SELECT key, value FROM kv WHERE key >= ? AND key < ? ORDER BY key LIMIT ?"
+)
+
+SCAN_BATCH_SIZE = 1000  # rows read per query when scanning
+
+
+def prefix_end(prefix):
+    """
+    Returns the smallest key larger than every key starting with prefix,
+    or None if there is no such key.
+    """
+    prefix = bytearray(prefix)
+    while prefix:
+        if prefix[-1] < 0xFF:
+            prefix[-1] += 1
+            return bytes(prefix)
+        prefix.pop()
+
+    return None
+
+
+class SQLiteDatabaseSchema(DatabaseSchema):
+    path = fields.String()
+    cache_size = fields.Integer(default=32)  # page cache per connection in MB
+    max_connections = fields.Integer(default=4)
+
+
+class SQLiteDatabasePlugin(DatabasePlugin):
+    """
+    Stores everything in one WAL-mode table. Connections are borrowed from a pool
+    of at most max_connections for each operation, so readers are not blocked
+    by a rescan writing and short-lived threads do not leave connections behind.
+    """
+
+    plugin_name = "sqlite"
+
+    config_schema = SQLiteDatabaseSchema
+    loaded = False
+
+    def __init__(self, config):
+        path = self.get_database_path(config["path"])
+        self.setup_codec(config, path)
+        self.db_path = os.path.join(path, "sqlite.db")
+        self.cache_size = config.get("cache_size", 32)
+        self.max_connections = config.get("max_connections", 4)
+        self._pool = queue.LifoQueue()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.loaded = True
+
+        with self._connection() as connection:
+            connection.execute(SQL_CREATE_TABLE)
+
+    def unload(self):
+        self.close()
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.db_path,
+            timeout=120,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=32,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA cache_size=-{self.cache_size * 1024}")
+        return connection
+
+    @contextmanager
+    def _connection(self):
+        """Borrows a connection from the pool, waits for one if they are all in use"""
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            with self._connections_lock:
+                if len(self._connections) < self.max_connections:
+                    connection = self._connect()
+                    self._connections.append(connection)
+                else:
+                    connection = None
+
+            if connection is None:
+                connection = self._pool.get()
+
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    def _fetch_ordered(self, sql, lower, upper=None):
+        """
+        Yields the rows of a query ordered by key in batches, every batch is read
+        to the end so no statement stays open on the connection between them.
+        """
+        while True:
+            params = (lower,) if upper is None else (lower, upper)
+            with self._connection() as connection:
+                rows = connection.execute(sql, params + (SCAN_BATCH_SIZE,)).fetchall()
+
+            yield from rows
+            if len(rows) < SCAN_BATCH_SIZE:
+                return
+
+            lower = rows[-1][0] + b"\x00"
+
+    def __getitem__(self, key):
+        with self._connection() as connection:
+            row = connection.execute(
+                SQL_GET, (key.encode(self.key_encoding),)
+            ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.codec.decode(row[0])
+
+    def __setitem__(self, key, value):
+        with self._write_lock, self._connection() as connection:
+            connection.execute(
+                SQL_PUT, (key.encode(self.key_encoding), self.codec.encode(value))
+            )
+
+    def __delitem__(self, key):
+        with self._write_lock, self._connection() as connection:
+            cursor = connection.execute(SQL_DELETE, (key.encode(self.key_encoding),))
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def get_many(self, keys):
+        result = {}
+        with self._connection() as connection:
+            for key in keys:
+                row = connection.execute(
+                    SQL_GET, (key.encode(self.key_encoding),)
+                ).fetchone()
+                if row is not None:
+                    result[key] = self.codec.decode(row[0])
+
+        return result
+
+    def put_many(self, items):
+        self.write_many(items, [])
+
+    def delete_many(self, keys):
+        self.write_many({}, keys)
+
+    def write_many(self, items, delete_keys):
+        encoded_items = [
+            (key.encode(self.key_encoding), self.codec.encode(value))
+            for key, value in items.items()
+        ]
+        encoded_delete_keys = [(key.encode(self.key_encoding),) for key in delete_keys]
+
+        with self._write_lock, self._connection() as connection:
+            connection.execute("BEGIN")
+            try:
+                connection.executemany(SQL_PUT, encoded_items)
+                connection.executemany(SQL_DELETE, encoded_delete_keys)
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            else:
+                connection.execute("COMMIT")
+
+    def scan(self, prefix="", start=None, end=None):
+        lower = scan_start(prefix, start).encode(self.key_encoding)
+        upper = prefix_end(prefix.encode(self.key_encoding))
+        if end is not None:
+            end = end.encode(self.key_encoding)
+            if upper is None or end < upper:
+                upper = end
+
+        if upper is None:
+            rows = self._fetch_ordered(SQL_SCAN, lower)
+        else:
+            rows = self._fetch_ordered(SQL_SCAN_RANGE, lower, upper)
+
+        for key, value in rows:
+            yield key.decode(self.key_encoding), self.codec.decode(value)
+
+    def keys(self):
+        return list(self)
+
+    def __len__(self):
+        with self._connection() as connection:
+            return connection.execute(SQL_COUNT).fetchone()[0]
+
+    def __contains__(self, key):
+        with self._connection() as connection:
+            return (
+                connection.execute(
+                    SQL_CONTAINS, (key.encode(self.key_encoding),)
+                ).fetchone()
+                is not None
+            )
+
+    def close(self):
+        if self.loaded:
+            self.loaded = False
+            with self._connections_lock:
+                for connection in self._connections:
+                    connection.close()
+                self._connections = []
+            self._pool = queue.LifoQueue()
+
+    def sync(self):
+        if self.loaded:
+            with self._connection() as connection:
+                connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def __iter__(self):
+        if not self.loaded:
+            return
+
+        for (key,) in self._fetch_ordered(SQL_KEYS, b""):
+            yield key.decode(self.key_encoding)
@@ -0,0 +1,48 @@
+import threading
+import unittest
+from unittest import mock
+
+from ...dbcodecs import msgpack
+from ..shelve.tests import ShelfDatabaseTest
+from . import handler
+from .handler import SQLiteDatabasePlugin
+
+
+class SQLiteDatabaseTest(ShelfDatabaseTest):
+    def open_database(self):
+        return SQLiteDatabasePlugin({"path": self.db_path})
+
+    def test_scan_prefix(self):
+        self.db.put_many({"\x01a": 1, "\x01b": 2, "\x02a": 3, "\x01\xff": 4})
+
+        self.assertEqual(
+            list(self.db.scan("\x01")), [("\x01a", 1), ("\x01b", 2), ("\x01\xff", 4)]
+        )
+        self.assertEqual(list(self.db.scan("\x02")), [("\x02a", 3)])
+        self.assertEqual(len(list(self.db.scan())), 4)
+
+    def test_sync_during_batched_scan(self):
+        with mock.patch.object(handler, "SCAN_BATCH_SIZE", 10):
+            self.test_sync_during_scan()
+            self.assertEqual(len(self.db.keys()), 50)
+
+    def test_bounded_connections(self):
+        self.db["a"] = 1
+
+        def read():
+            self.assertEqual(self.db["a"], 1)
+
+        for _ in range(50):
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join()
+
+        self.assertLessEqual(len(self.db._connections), self.db.max_connections)
+
+
+class SQLiteMsgpackDatabaseTest(SQLiteDatabaseTest):
+    def open_database(self):
+        if msgpack is None:
+            raise unittest.SkipTest("msgpack not installed")
+
+        return SQLiteDatabasePlugin({"path": self.db_path, "codec": "msgpack-zlib"})
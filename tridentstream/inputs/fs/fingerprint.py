@@ -0,0 +1,32 @@
+import hashlib
+import mmap
+import os
+
+FINGERPRINT_CHUNK_SIZE = 64 * 1024  # bytes hashed from the start and the end
+FINGERPRINT_SIZE_LENGTH = 16
+
+
+def fingerprint_file(path):
+    """
+    Fingerprints a file from its size and a hash of the first and last 64 KiB,
+    like the OpenSubtitles hash, so big files are as fast to fingerprint as small ones.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                h.update(m[:FINGERPRINT_CHUNK_SIZE])
+                h.update(m[max(0, size - FINGERPRINT_CHUNK_SIZE) :])
+
+    return "%0*x%s" % (FINGERPRINT_SIZE_LENGTH, size, h.hexdigest())
+
+
+def fingerprint_size(fingerprint):
+    return int(fingerprint[:FINGERPRINT_SIZE_LENGTH], 16)
+
+
+def needs_fingerprint(metadata):
+    """Files without a fingerprint or with one from before their size changed"""
+    fingerprint = metadata.get("fingerprint")
+    return not fingerprint or fingerprint_size(fingerprint) != metadata.get("size")
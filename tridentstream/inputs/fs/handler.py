@@ -1,15 +1,25 @@
 import glob
+import heapq
 import logging
 import os
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
-from queue import Queue
+from itertools import islice
 from urllib.parse import urljoin
 
 import pytz
 from django.conf import settings
 from thomas import router
-from unplugged import RelatedPluginField, Schema, command, fields, threadify
+from unplugged import (
+    RelatedPluginField,
+    Schema,
+    ServicePlugin,
+    command,
+    fields,
+    threadify,
+)
 from unplugged.models import Log
 
 from twisted.internet import defer, reactor
@@ -18,13 +28,22 @@ from ...exceptions import NotModifiedException, PathNotFoundException
 from ...plugins import (
     DatabasePlugin,
     InputPlugin,
+    InputPluginManager,
     MetadataParserPlugin,
     Notification,
     NotifierPlugin,
 )
-from ...vfs import FileSystem
+from ...vfs import DatabaseType, FileSystem
+from .fingerprint import FINGERPRINT_CHUNK_SIZE, fingerprint_file, needs_fingerprint
+from .parserpool import MetadataParserPool
+from .progress import RescanProgress, RescanQueue
+from .throttle import ScanThrottler
+from .watcher import FilesystemWatcher
 
 COMMIT_COUNTER = 10000
+QUEUE_FLUSH_INTERVAL = 10  # seconds a walker holds scanned directories back
+COMPACT_BATCH_DELAY = 1.0  # seconds between compaction batches
+FINGERPRINT_BATCH_SIZE = 1000  # fingerprints written to the vfs per session
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +61,28 @@ class FilesystemInputSchema(Schema):
     )
     paths = fields.Nested(PathSchema, many=True, default=list)
     notifier = RelatedPluginField(plugin_type=NotifierPlugin)
+    incremental_rescan = fields.Boolean(default=False)
+    watch_paths = fields.Boolean(default=False)
+    walker_threads = fields.Integer(default=4)
+    metadata_parser_threads = fields.Integer(default=4)
+    # database entries kept in memory between commits, 0 is unbounded
+    cache_size = fields.Integer(default=100000)
+    bloom_filter = fields.Boolean(default=False)
+    # rescans commit after this many megabytes of changes or seconds
+    commit_megabytes = fields.Integer(default=64)
+    commit_seconds = fields.Integer(default=60)
+    # hash the start and end of new files to find duplicates
+    fingerprint = fields.Boolean(default=False)
+    # operations and bytes per second rescans and fingerprinting may use, 0 is unlimited
+    scan_max_operations = fields.Integer(default=0)
+    scan_max_bytes = fields.Integer(default=0)
+    # lower limits used while the player service reports playback
+    player_service = RelatedPluginField(plugin_type=ServicePlugin, traits=["player"])
+    playback_scan_max_operations = fields.Integer(default=100)
+    playback_scan_max_bytes = fields.Integer(default=10 * 1024 * 1024)
+    # niceness added to the scan threads and their io priority class, best-effort or idle
+    scan_nice = fields.Integer(default=0)
+    scan_ioprio_class = fields.String(default="")
 
 
 class FilesystemInputPlugin(InputPlugin):
@@ -50,10 +91,17 @@ class FilesystemInputPlugin(InputPlugin):
     config_schema = FilesystemInputSchema
 
     is_rescanning = False
+    is_compacting = False
+    is_fingerprinting = False
+    fingerprint_seq = None
+    metadata_parser_pool = None
+    last_rescan_stats = None
+    last_rescan_progress = None
     rescan_done = None
     should_die = False
 
     vfs = None
+    watcher = None
     route_input_fs_list = None
 
     simpleadmin_templates = [
@@ -81,6 +129,12 @@ class FilesystemInputPlugin(InputPlugin):
                             "name": "db_automanaged_%(name)s",
                             "config": {"path": "db_automanaged_%(name)s"},
                         },
+                        {
+                            "plugin_type": "database",
+                            "plugin_name": "sqlite",
+                            "name": "db_automanaged_%(name)s",
+                            "config": {"path": "db_automanaged_%(name)s"},
+                        },
                         {
                             "plugin_type": "database",
                             "plugin_name": "shelf",
@@ -104,7 +158,13 @@ class FilesystemInputPlugin(InputPlugin):
     def __init__(self, config):
         self.db = config["db"]
         self.priority = config.get("priority", 10)
-        self.vfs = FileSystem(self.db)
+        self.vfs = FileSystem(
+            self.db,
+            cache_size=config.get("cache_size", 100000) or None,
+            bloom_filter=config.get("bloom_filter", False),
+            commit_bytes=config.get("commit_megabytes", 64) * 1024 * 1024,
+            commit_interval=config.get("commit_seconds", 60),
+        )
         self.last_update = datetime.now()
         self.vfs.add_event("new", self._new_item)
         self.vfs.add_event("file_route_needed", self._file_route_needed)
@@ -112,6 +172,26 @@ class FilesystemInputPlugin(InputPlugin):
         self.vfs.add_event("on_item", self._on_item)
         self.metadata_parsers = config.get("metadata_parsers", [])
         self.notifier = config.get("notifier")
+        self.incremental_rescan = config.get("incremental_rescan", False)
+        self.walker_threads = max(1, config.get("walker_threads", 4))
+        self.fingerprint = config.get("fingerprint", False)
+        self.session_lock = threading.Lock()
+        self.player_service = config.get("player_service")
+        self.throttler = ScanThrottler(
+            max_operations=config.get("scan_max_operations", 0),
+            max_bytes=config.get("scan_max_bytes", 0),
+            playback_max_operations=config.get("playback_scan_max_operations", 100),
+            playback_max_bytes=config.get("playback_scan_max_bytes", 10 * 1024 * 1024),
+            nice=config.get("scan_nice", 0),
+            ioprio_class=config.get("scan_ioprio_class"),
+            is_busy=self.player_service and self.player_service.is_playing,
+        )
+        if self.metadata_parsers:
+            self.metadata_parser_pool = MetadataParserPool(
+                self.vfs,
+                self.session_lock,
+                max(1, config.get("metadata_parser_threads", 4)),
+            )
 
         self.paths = []
         for path_template in config.get("paths", []):
@@ -126,6 +206,16 @@ class FilesystemInputPlugin(InputPlugin):
         router.register_handler(
             self.route_input_fs_list, self.thomas_list, False, True, False
         )
+        InputPluginManager.paged_list_routes.add(self.route_input_fs_list)
+
+        if config.get("watch_paths"):
+            if FilesystemWatcher.is_available():
+                self.watcher = FilesystemWatcher(self)
+                threadify(self.watcher.run)()
+            else:
+                logger.warning(
+                    "Unable to watch paths for changes, please install inotify_simple"
+                )
 
     @command(
         name="clear_and_rescan",
@@ -145,6 +235,46 @@ class FilesystemInputPlugin(InputPlugin):
         logger.info("External call for rescan")
         self.rescan()
 
+    @command(
+        name="compact",
+        display_name="Compact",
+        description="Remove files deleted a long time ago from the database",
+    )
+    def command_compact(self):
+        logger.info("External call for compact")
+        self.compact()
+
+    def cache_stats(self):
+        """Hit, miss and eviction counters of the database cache and the bloom filter"""
+        stats = self.vfs.db.stats()
+        stats["bloom_filter"] = self.vfs.bloom_stats()
+        return stats
+
+    def rescan_stats(self):
+        """How long the stages of the last rescan took"""
+        return self.last_rescan_stats
+
+    def rescan_progress(self):
+        """
+        Live counters of the running rescan, or the last one: directories and files
+        per second, queue depth and blocked time, vfs commits and finishing the buckets.
+        """
+        if self.last_rescan_progress is None:
+            return None
+        return self.last_rescan_progress.stats()
+
+    def throttle_stats(self):
+        """If scanning is backing off for playback and the current scan rate"""
+        return self.throttler.stats()
+
+    def changes_since(self, seq):
+        """
+        Paths added, removed and modified after the journal sequence number seq,
+        changes is None when everything must be listed again.
+        """
+        current_seq, changes = self.vfs.changes_since(seq)
+        return {"seq": current_seq, "changes": changes}
+
     def unload(self):
         logger.info("Asked to unload FS input handler")
         self.should_die = True
@@ -157,6 +287,7 @@ class FilesystemInputPlugin(InputPlugin):
 
         if self.route_input_fs_list:
             router.unregister_handler(self.route_input_fs_list)
+            InputPluginManager.paged_list_routes.discard(self.route_input_fs_list)
 
     def _file_route_needed(self, item, path):
         item.add_route(
@@ -191,32 +322,63 @@ class FilesystemInputPlugin(InputPlugin):
             item.add_route(streamer_plugin, False, False, True, priority=self.priority)
 
     def _new_item(self, key, db_type, metadata):
+        """
+        Sends new files to the metadata parser pool, this is called while the
+        session is finishing so the parsing itself happens in the workers.
+        """
+        if "_actual_path" not in metadata:
+            return
+
         filename = metadata["path"].split("/")[-1]
-        # logger.debug('New item %s, trying to match with metadata' % (metadata['path'], ))
-        for plugin in self.metadata_parsers:
-            if plugin.pattern.match(filename):
-                # logger.debug('Sending %s to metadataparser %s' % (metadata['path'], plugin.name))
-                try:
-                    plugin.handle(self.vfs, metadata["path"], metadata["_actual_path"])
-                except:
-                    logger.exception(
-                        f"Failed to handle {metadata['_actual_path']} with plugin {plugin!r}"
-                    )
+        parsers = [
+            plugin for plugin in self.metadata_parsers if plugin.pattern.match(filename)
+        ]
+        if parsers:
+            self.metadata_parser_pool.submit(
+                parsers, metadata["path"], metadata["_actual_path"]
+            )
 
     def close(self):
+        if self.metadata_parser_pool:
+            self.metadata_parser_pool.close()
+
         if self.vfs:
             self.vfs.close()
 
-    def list(self, path, depth, modified_since=None):
+    def list(self, path, depth, modified_since=None, offset=0, limit=None, after=None):
+        """
+        Lists path, offset or after and limit page through the items directly below it
+        without loading the rest of the directory.
+        """
         last_modified = datetime.fromtimestamp(self.vfs.last_modified(path), pytz.UTC)
 
         if modified_since and last_modified <= modified_since:
             raise NotModifiedException()
 
-        logger.info(f"Listing path {path!r} with depth {depth}")
-        listing = self.vfs.list_dir(path, depth)
+        logger.info(
+            f"Listing path {path!r} with depth {depth}, offset {offset}, after {after!r} and limit {limit}"
+        )
+        listing = self.vfs.list_dir(
+            path, depth, offset=offset, limit=limit, after=after
+        )
         return listing
 
+    def recently_added(self, since=0, limit=100):
+        """
+        Returns the streamable files added since the timestamp since, oldest first.
+        Uses the extension index so only the returned files are loaded.
+        """
+        files = heapq.merge(
+            *[
+                self.vfs.find_files("extension", extension, start=since)
+                for extension in settings.STREAMABLE_EXTENSIONS
+            ],
+            key=lambda metadata: metadata["date"],
+        )
+        return [
+            self.vfs.list_file(metadata["path"]) for metadata in islice(files, limit)
+        ]
+
     def stream(self, path):
         logger.info(f"Trying to stream {path!r}")
 
@@ -230,18 +392,21 @@ class FilesystemInputPlugin(InputPlugin):
             logger.info(f"Getting file at path {path!r}")
             return self.vfs.list_file(path)
 
-    def rescan(self, update_all_metadata=False):
-        threadify(self._rescan)(update_all_metadata)
+    def rescan(self, update_all_metadata=False, incremental=None):
+        threadify(self._rescan)(update_all_metadata, incremental)
         return "Rescanning"
 
-    def _rescan(self, update_all_metadata=False):
+    def _rescan(self, update_all_metadata=False, incremental=None):
         """
-        Rescans filesystem for files
+        Rescans filesystem for files, incremental overrides the configured scan mode
         """
         if self.is_rescanning:
             logger.warning("Already rescanning")
             return None
 
+        if self.metadata_parser_pool:
+            self.metadata_parser_pool.reset_stats()
+
         notification = Notification(
             f"admin.{self.plugin_name}.{self.name}.rescan",
             "info",
@@ -250,6 +415,7 @@ class FilesystemInputPlugin(InputPlugin):
             permission_type="is_admin",
         )
         notification_start_dt = datetime.now()
+        throttle_start_stats = self.throttler.stats()
         if self.notifier:
             self.notifier.notify(notification)
 
@@ -262,35 +428,170 @@ class FilesystemInputPlugin(InputPlugin):
             self.rescan_done = defer.Deferred()
 
             logger.info("Rescanning")
-            queue = Queue(20)
+            queue = RescanQueue(20)
+            progress = self.last_rescan_progress = RescanProgress(queue, self.vfs)
+
+            def report_progress(progress):
+                summary = progress.summary()
+                logger.info(f"Rescan progress: {summary}")
+                if self.notifier:
+                    self.notifier.notify(notification.copy(body=summary))
 
             class QueueCommand:
                 INSERT = 0
                 ENSURE_PREFIXES = 1
                 DONE = 2
 
+            if incremental is None:
+                incremental = self.incremental_rescan
+            incremental = incremental and not update_all_metadata
+            # the walkers read the last scan while the inserter writes through the cache
+            vfs_reader = self.vfs.reader()
+
+            def list_directory(full_path):
+                """
+                Lists a directory, reusing the stat results from scandir.
+                Returns dirs, files and the stat result of each dir.
+                """
+                dirs, files, dir_stats = [], [], {}
+                with os.scandir(full_path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir():
+                                dirs.append(entry.name)
+                                dir_stats[entry.name] = entry.stat()
+                                continue
+
+                            size = entry.stat().st_size
+                        except FileNotFoundError:
+                            logger.debug(f"We found broken link: {entry.path}")
+                            continue
+                        except OSError:
+                            logger.warning(f"Unable to stat {entry.path!r}, skipping")
+                            continue
+
+                        files.append((entry.name, size))
+
+                return dirs, files, dir_stats
+
+            def list_known_directory(virtual_path, known_state, state):
+                """
+                Returns the stored listing of a directory if it is unchanged since last scan.
+
+                Only the directory itself is compared, a file rewritten in place keeps
+                its name and does not change the mtime of the directory, so its new size
+                is not seen until a full rescan.
+                """
+                if (
+                    not known_state
+                    or known_state["mtime"] != state["mtime"]
+                    or known_state["inode"] != state["inode"]
+                ):
+                    return None
+
+                try:
+                    children = vfs_reader.list_children(virtual_path)
+                except PathNotFoundException:
+                    return None
+
+                if len(children) != known_state["children"]:
+                    return None
+
+                dirs, files = [], []
+                for db_type, metadata in children:
+                    name = metadata["path"].split("/")[-1]
+                    if db_type == DatabaseType.DIRECTORY:
+                        dirs.append(name)
+                    else:
+                        files.append((name, metadata["size"]))
+
+                return dirs, files
+
+            # operations of the last directory listed by any walker
+            last_listing_cost = [1]
+
+            def scan_directory(prefix, path, root, stat):
+                full_path = os.path.join(path, root)
+                if stat is None:
+                    stat = os.stat(full_path)
+
+                state = {"mtime": stat.st_mtime_ns, "inode": stat.st_ino}
+
+                listing, known_state = None, None
+                if incremental:
+                    virtual_path = "/".join(
+                        [x for x in [prefix] + root.split(os.sep) if x]
+                    )
+                    known_state = vfs_reader.get_directory_state(virtual_path)
+                    listing = list_known_directory(virtual_path, known_state, state)
+
+                if listing is None:
+                    # the listing is paid for before it is read, estimated from the
+                    # children at the last scan or the size of the last directory listed
+                    if known_state:
+                        estimate = 1 + known_state["children"]
+                    else:
+                        estimate = last_listing_cost[0]
+                    self.throttler.throttle(estimate)
+
+                    dirs, files, dir_stats = list_directory(full_path)
+                    state["children"] = len(dirs) + len(files)
+                    cost = last_listing_cost[0] = 1 + len(dirs) + len(files)
+                    if cost > estimate:
+                        self.throttler.throttle(cost - estimate)
+                else:
+                    dirs, files = listing
+                    dir_stats = {}
+                    state = None
+                    self.throttler.throttle()
+
+                subdirs = [(os.path.join(root, d), dir_stats.get(d)) for d in dirs]
+                return root, dirs, files, state, subdirs
+
             def walk_path(queue, prefix, path):
                 logger.info(f"Starting to scan {path!r} with prefix {prefix!r}")
                 list_queue = []
                 queue_size = 0
-
-                for r, dirs, files in os.walk(path, followlinks=True):
-                    useful_files = []
-                    for f in files:
-                        full_path = os.path.join(r, f)
-                        if not os.path.exists(full_path):
-                            logger.debug(f"We found broken link: {full_path}")
+                last_flush = time.monotonic()
+                skipped_directories = 0
+
+                max_running = walker_threads * 2
+                pending = [("", None)]
+                running = set()
+                while pending or running:
+                    while pending and len(running) < max_running:
+                        root, stat = pending.pop()
+                        running.add(
+                            executor.submit(scan_directory, prefix, path, root, stat)
+                        )
+
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            root, dirs, files, state, subdirs = future.result()
+                        except OSError as e:
+                            logger.warning(
+                                f"Unable to scan {e.filename!r}, skipping: {e}"
+                            )
                             continue
 
-                        useful_files.append((f, os.path.getsize(full_path)))
+                        if state is None:
+                            skipped_directories += 1
+
+                        progress.add_walked(1, len(files))
 
-                    list_queue.append((r[len(path) :].strip("/"), dirs, useful_files))
-                    queue_size += len(dirs) + len(files)
+                        list_queue.append((root, dirs, files, state))
+                        queue_size += len(dirs) + len(files)
+                        pending.extend(subdirs)
 
-                    if queue_size >= COMMIT_COUNTER:
+                    if queue_size >= COMMIT_COUNTER or (
+                        list_queue
+                        and time.monotonic() - last_flush >= QUEUE_FLUSH_INTERVAL
+                    ):
                         queue.put((QueueCommand.INSERT, path, prefix, list_queue))
                         list_queue = []
                         queue_size = 0
+                        last_flush = time.monotonic()
 
                     if self.should_die:
                         logger.info(f"Got the death in walker for {path}")
@@ -301,10 +602,14 @@ class FilesystemInputPlugin(InputPlugin):
 
                 queue.put((QueueCommand.DONE, path))
 
-                logger.info(f"Done scanning {path!r}")
+                logger.info(
+                    f"Done scanning {path!r}, reused the stored listing of {skipped_directories} unchanged directories"
+                )
 
             def insert_into_vfs(vfs, queue, path_count):
-                with vfs.session(True, always_trigger_new=update_all_metadata):
+                with self.session_lock, progress, vfs.session(
+                    True, always_trigger_new=update_all_metadata
+                ):
                     while path_count:
                         job = queue.get(True)
                         cmd = job[0]
@@ -313,7 +618,7 @@ class FilesystemInputPlugin(InputPlugin):
                             logger.debug("Got insertion job")
                             _, path, prefix, items = job
 
-                            for root, folders, files in items:
+                            for root, folders, files, state in items:
                                 virtual_path = [prefix] + root.split(os.sep)
 
                                 for item in folders:
@@ -335,6 +640,12 @@ class FilesystemInputPlugin(InputPlugin):
                                         {"_actual_path": actual_path},
                                     )
 
+                                if state:
+                                    vp = "/".join([x for x in virtual_path if x])
+                                    vfs.set_directory_state(vp, state)
+
+                                progress.add_inserted(len(folders), len(files))
+
                         elif cmd == QueueCommand.ENSURE_PREFIXES:
                             _, prefixes = job
 
@@ -354,6 +665,8 @@ class FilesystemInputPlugin(InputPlugin):
                             logger.info(f"Got the death in inserter for {path}")
                             break
 
+                    progress.set_stage("finishing")
+
                 self.last_update = datetime.now()
                 self.is_rescanning = False
                 reactor.callFromThread(self.rescan_done.callback, None)
@@ -365,14 +678,46 @@ class FilesystemInputPlugin(InputPlugin):
                 self.vfs, queue, len(self.paths)
             )
 
+            threadify(progress.report)(report_progress)
+
             prefixes = set(p[0] for p in self.paths if p[0])
             if prefixes:
                 queue.put((QueueCommand.ENSURE_PREFIXES, prefixes))
 
+            walker_threads = self.walker_threads
+            executor = ThreadPoolExecutor(
+                max_workers=walker_threads,
+                initializer=self.throttler.lower_thread_priority,
+            )
             for virtual_path, path in self.paths:
                 threadify(walk_path)(queue, virtual_path, path)
 
             t()
+            executor.shutdown(wait=False)
+
+            rescan_stats = {
+                "scan_seconds": (datetime.now() - notification_start_dt).total_seconds()
+            }
+            rescan_stats["progress"] = progress.stats()
+            throttle_stats = self.throttler.stats()
+            rescan_stats["throttle"] = dict(
+                (key, throttle_stats[key] - throttle_start_stats[key])
+                for key in ["operations", "bytes", "throttled_seconds"]
+            )
+            if rescan_stats["throttle"]["throttled_seconds"]:
+                log.log(
+                    90,
+                    f"Scanning was throttled for {rescan_stats['throttle']['throttled_seconds']:.1f}s over {rescan_stats['throttle']['operations']} operations",
+                )
+            if self.metadata_parser_pool:
+                parser_stats = self.metadata_parser_pool.wait()
+                if parser_stats:
+                    rescan_stats["metadata_parsers"] = parser_stats
+                    log.log(
+                        90,
+                        f"Metadata parsers handled {parser_stats['files']} files with {parser_stats['updates']} updates in {parser_stats['seconds']:.1f}s",
+                    )
+            self.last_rescan_stats = rescan_stats
 
             delta = datetime.now() - notification_start_dt
             if self.notifier:
@@ -383,5 +728,133 @@ class FilesystemInputPlugin(InputPlugin):
 
             log.log(100, f"A rescan finished after {delta}")
 
-    def thomas_list(self, item, path, depth=0, modified_since=None):
-        return self.list(path, depth, modified_since)
+        if self.fingerprint and not self.should_die:
+            self.fingerprint_files()
+
+        if not self.should_die:
+            self.compact()
+
+    def compact(self):
+        threadify(self._compact)()
+        return "Compacting"
+
+    def _compact(self):
+        """
+        Removes long deleted items from the database in batches, the session lock
+        is released between batches so rescans and watcher updates are not blocked.
+        """
+        if self.is_compacting:
+            logger.warning("Already compacting")
+            return
+
+        self.is_compacting = True
+        try:
+            batches = 0
+            while not self.should_die:
+                with self.session_lock:
+                    more = self.vfs.compact()
+                batches += 1
+                if not more:
+                    break
+                time.sleep(COMPACT_BATCH_DELAY)
+            logger.info(f"Done compacting database after {batches} batches")
+        except Exception:
+            logger.exception("Failed to compact database")
+        finally:
+            self.is_compacting = False
+
+    def fingerprint_files(self):
+        threadify(self._fingerprint_files)()
+        return "Fingerprinting"
+
+    def _get_fingerprint_candidates(self):
+        """
+        Returns the files added or changed since the last run according to the
+        vfs journal, all files are checked the first time or if the journal is too short.
+        """
+        seq, changes = self.vfs.changes_since(self.fingerprint_seq or 0)
+        if self.fingerprint_seq is None or changes is None:
+            return seq, self.vfs.iter_items(DatabaseType.FILE)
+
+        paths = set()
+        for entry in changes:
+            for change in entry["added"] + entry["modified"]:
+                if change["type"] == "file":
+                    paths.add(change["path"])
+
+        files = []
+        for path in paths:
+            try:
+                metadata = self.vfs.get_metadata(DatabaseType.FILE, path)
+            except PathNotFoundException:
+                continue
+
+            if not metadata.get("deleted", False):
+                files.append(metadata)
+
+        return seq, files
+
+    def _fingerprint_files(self):
+        """
+        Fingerprints new and changed files in a worker pool, files with a fingerprint
+        matching their size are never hashed again.
+        """
+        if self.is_fingerprinting:
+            logger.warning("Already fingerprinting")
+            return
+
+        self.is_fingerprinting = True
+        try:
+            with self.session_lock:
+                seq, files = self._get_fingerprint_candidates()
+                pending = [
+                    (metadata["path"], metadata["_actual_path"], metadata["size"])
+                    for metadata in files
+                    if "_actual_path" in metadata and needs_fingerprint(metadata)
+                ]
+            self.fingerprint_seq = seq
+
+            def fingerprint(job):
+                path, actual_path, size = job
+                self.throttler.throttle(1, min(size, FINGERPRINT_CHUNK_SIZE * 2))
+                try:
+                    return path, fingerprint_file(actual_path)
+                except OSError as e:
+                    logger.warning(f"Unable to fingerprint {actual_path!r}: {e}")
+                    return path, None
+
+            logger.info(f"Fingerprinting {len(pending)} files")
+            with ThreadPoolExecutor(
+                max_workers=self.walker_threads,
+                initializer=self.throttler.lower_thread_priority,
+            ) as executor:
+                for i in range(0, len(pending), FINGERPRINT_BATCH_SIZE):
+                    batch = pending[i : i + FINGERPRINT_BATCH_SIZE]
+                    fingerprints = list(executor.map(fingerprint, batch))
+                    with self.session_lock, self.vfs.session():
+                        for path, file_fingerprint in fingerprints:
+                            if file_fingerprint is None:
+                                continue
+
+                            try:
+                                self.vfs.update_metadata(
+                                    DatabaseType.FILE,
+                                    path,
+                                    {"fingerprint": file_fingerprint},
+                                )
+                            except PathNotFoundException:
+                                pass
+
+                    if self.should_die:
+                        return
+
+            logger.info("Done fingerprinting files")
+        except Exception:
+            logger.exception("Failed to fingerprint files")
+        finally:
+            self.is_fingerprinting = False
+
+    def thomas_list(
+        self, item, path, depth=0, modified_since=None, after=None, limit=None
+    ):
+        return self.list(path, depth, modified_since, after=after, limit=limit)
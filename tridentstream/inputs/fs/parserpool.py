@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from unplugged import threadify
+
+from ...exceptions import PathNotFoundException
+
+PARSER_BATCH_SIZE = 1000  # metadata updates applied per vfs session
+PARSER_QUEUE_FACTOR = 4  # files waiting to be parsed per worker
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataUpdateRecorder:
+    """
+    Stands in for the vfs when a metadata parser runs in a worker,
+    the update_metadata calls are recorded and applied later.
+    """
+
+    def __init__(self):
+        self.updates = []
+
+    def update_metadata(self, db_type, path, metadata):
+        self.updates.append((db_type, path, metadata))
+
+
+class MetadataParserPool:
+    """
+    Runs metadata parsers in a pool of workers, only the resulting metadata updates
+    are applied to the vfs, in batches by a single thread holding the session lock.
+
+    Submitting blocks when the workers are behind, so a scan cannot queue up
+    every new file in memory.
+    """
+
+    def __init__(self, vfs, session_lock, workers, batch_size=PARSER_BATCH_SIZE):
+        self.vfs = vfs
+        self.session_lock = session_lock
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.Semaphore(workers * PARSER_QUEUE_FACTOR)
+        self.condition = threading.Condition()
+
+        self.updates = []
+        self.pending = 0
+        self.applying = False
+        self.closed = False
+
+        self.stage_started = None
+        self.stage_files = 0
+        self.stage_updates = 0
+        self.last_stage = None
+
+        threadify(self._apply_updates)()
+
+    def submit(self, parsers, virtual_path, actual_path):
+        self.slots.acquire()
+        with self.condition:
+            if self.stage_started is None:
+                self.stage_started = time.monotonic()
+                self.stage_files = 0
+                self.stage_updates = 0
+            self.pending += 1
+
+        self.executor.submit(self._parse, parsers, virtual_path, actual_path)
+
+    def _parse(self, parsers, virtual_path, actual_path):
+        recorder = MetadataUpdateRecorder()
+        try:
+            for plugin in parsers:
+                try:
+                    plugin.handle(recorder, virtual_path, actual_path)
+                except Exception:
+                    logger.exception(
+                        f"Failed to handle {actual_path} with plugin {plugin!r}"
+                    )
+        finally:
+            self.slots.release()
+            with self.condition:
+                self.updates.extend(recorder.updates)
+                self.pending -= 1
+                self.stage_files += 1
+                self._check_stage_done()
+                self.condition.notify_all()
+
+    def _should_apply(self):
+        return self.closed or (
+            self.updates and (len(self.updates) >= self.batch_size or not self.pending)
+        )
+
+    def _apply_updates(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(self._should_apply)
+                if self.closed:
+                    return
+
+                self.applying = True
+                updates, self.updates = self.updates, []
+
+            try:
+                with self.session_lock, self.vfs.session():
+                    for db_type, path, metadata in updates:
+                        try:
+                            self.vfs.update_metadata(db_type, path, metadata)
+                        except PathNotFoundException:
+                            logger.debug(f"Path {path!r} is gone, skipping metadata")
+            except Exception:
+                logger.exception("Failed to apply metadata updates")
+            finally:
+                with self.condition:
+                    self.applying = False
+                    self.stage_updates += len(updates)
+                    self._check_stage_done()
+                    self.condition.notify_all()
+
+    def _check_stage_done(self):
+        if self.stage_started is None or self.pending or self.updates or self.applying:
+            return
+
+        self.last_stage = {
+            "files": self.stage_files,
+            "updates": self.stage_updates,
+            "seconds": time.monotonic() - self.stage_started,
+        }
+        self.stage_started = None
+
+    def reset_stats(self):
+        with self.condition:
+            self.last_stage = None
+
+    def wait(self):
+        """
+        Waits until every submitted file is parsed and its metadata applied.
+        Returns how many files and updates there were and how long it took.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.stage_started is None or self.closed)
+            return self.last_stage
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.executor.shutdown(wait=False)
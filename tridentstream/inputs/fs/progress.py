@@ -0,0 +1,120 @@
+import threading
+import time
+from queue import Queue
+
+PROGRESS_NOTIFICATION_INTERVAL = 60  # seconds between progress notifications
+
+
+class RescanQueue(Queue):
+    """A queue remembering how long putting and getting were blocked"""
+
+    def __init__(self, maxsize=0):
+        super(RescanQueue, self).__init__(maxsize)
+        self.blocked_put_seconds = 0.0
+        self.blocked_get_seconds = 0.0
+
+    def put(self, item, block=True, timeout=None):
+        started = time.monotonic()
+        super(RescanQueue, self).put(item, block, timeout)
+        with self.mutex:
+            self.blocked_put_seconds += time.monotonic() - started
+
+    def get(self, block=True, timeout=None):
+        started = time.monotonic()
+        item = super(RescanQueue, self).get(block, timeout)
+        with self.mutex:
+            self.blocked_get_seconds += time.monotonic() - started
+        return item
+
+
+class RescanProgress:
+    """
+    Live counters of a rescan, what the walkers found, what is inserted into
+    the vfs and the stage it is in, shared by the walker and inserter threads.
+    """
+
+    def __init__(self, queue, vfs):
+        self.queue = queue
+        self.vfs = vfs
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.stage = "scanning"
+        self.stage_seconds = {}
+        self.stage_started = self.started
+        self.done = threading.Event()
+        self.final_stats = None
+
+        self.directories = 0
+        self.files = 0
+        self.inserted_directories = 0
+        self.inserted_files = 0
+
+    def add_walked(self, directories, files):
+        with self.lock:
+            self.directories += directories
+            self.files += files
+
+    def add_inserted(self, directories, files):
+        with self.lock:
+            self.inserted_directories += directories
+            self.inserted_files += files
+
+    def set_stage(self, stage):
+        with self.lock:
+            now = time.monotonic()
+            self.stage_seconds[self.stage] = now - self.stage_started
+            self.stage = stage
+            self.stage_started = now
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        """
+        Marks the rescan as done, it must exit after the vfs session and before the
+        session lock is released as the vfs session stats belong to the next session after that.
+        """
+        self.set_stage("done")
+        self.final_stats = self.stats()
+        self.done.set()
+
+    def stats(self):
+        if self.final_stats is not None:
+            return self.final_stats
+
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            stats = {
+                "stage": self.stage,
+                "seconds": elapsed,
+                "stage_seconds": dict(self.stage_seconds),
+                "directories": self.directories,
+                "files": self.files,
+                "directories_per_second": self.directories / elapsed,
+                "files_per_second": self.files / elapsed,
+                "inserted_directories": self.inserted_directories,
+                "inserted_files": self.inserted_files,
+                "queue_depth": self.queue.qsize(),
+                "queue_put_blocked_seconds": self.queue.blocked_put_seconds,
+                "queue_get_blocked_seconds": self.queue.blocked_get_seconds,
+            }
+
+        session_stats = self.vfs.session_stats() or {}
+        for key in ["commits", "commit_seconds", "finish_buckets_seconds"]:
+            stats[key] = session_stats.get(key)
+        stats["slowest_buckets"] = session_stats.get("slowest_buckets", [])
+        return stats
+
+    def summary(self):
+        stats = self.stats()
+        return (
+            f"{stats['stage'].capitalize()}, found {stats['directories']} directories "
+            f"and {stats['files']} files ({stats['files_per_second']:.0f} files/s), "
+            f"inserted {stats['inserted_files']} files in {stats['commits']} commits, "
+            f"queue depth {stats['queue_depth']}"
+        )
+
+    def report(self, callback, interval=PROGRESS_NOTIFICATION_INTERVAL):
+        """Calls callback with the progress every interval until the rescan is done"""
+        while not self.done.wait(interval):
+            callback(self)
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..fingerprint import (
+    FINGERPRINT_CHUNK_SIZE,
+    fingerprint_file,
+    fingerprint_size,
+    needs_fingerprint,
+)
+
+
+class FingerprintTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temppath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temppath)
+
+    def write_file(self, name, data):
+        path = os.path.join(self.temppath, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_fingerprint_file(self):
+        data = os.urandom(FINGERPRINT_CHUNK_SIZE * 3)
+        fingerprint = fingerprint_file(self.write_file("a", data))
+
+        self.assertEqual(fingerprint_size(fingerprint), len(data))
+        self.assertEqual(fingerprint_file(self.write_file("b", data)), fingerprint)
+
+        middle_changed = bytearray(data)
+        middle_changed[FINGERPRINT_CHUNK_SIZE + 10] ^= 0xFF
+        self.assertEqual(
+            fingerprint_file(self.write_file("c", bytes(middle_changed))), fingerprint
+        )
+
+        end_changed = bytearray(data)
+        end_changed[-1] ^= 0xFF
+        self.assertNotEqual(
+            fingerprint_file(self.write_file("d", bytes(end_changed))), fingerprint
+        )
+
+        self.assertEqual(
+            fingerprint_size(fingerprint_file(self.write_file("e", b""))), 0
+        )
+
+    def test_needs_fingerprint(self):
+        fingerprint = fingerprint_file(self.write_file("a", b"data"))
+
+        self.assertTrue(needs_fingerprint({"size": 4}))
+        self.assertFalse(needs_fingerprint({"size": 4, "fingerprint": fingerprint}))
+        self.assertTrue(needs_fingerprint({"size": 5, "fingerprint": fingerprint}))
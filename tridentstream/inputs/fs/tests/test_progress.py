@@ -0,0 +1,66 @@
+import threading
+import unittest
+from unittest import mock
+
+from ..progress import RescanProgress, RescanQueue
+
+
+class RescanProgressTestCase(unittest.TestCase):
+    def setUp(self):
+        self.queue = RescanQueue(1)
+        self.vfs = mock.Mock()
+        self.vfs.session_stats.return_value = {
+            "commits": 2,
+            "commit_seconds": 1.5,
+            "finish_buckets_seconds": None,
+            "slowest_buckets": [],
+        }
+
+    def test_queue_blocked_time(self):
+        self.queue.put(1)
+        timer = threading.Timer(0.05, self.queue.get)
+        timer.start()
+        self.queue.put(2)
+        timer.join()
+
+        self.assertGreater(self.queue.blocked_put_seconds, 0.01)
+        self.assertEqual(self.queue.get(), 2)
+
+    def test_progress(self):
+        progress = RescanProgress(self.queue, self.vfs)
+        progress.add_walked(1, 10)
+        progress.add_walked(2, 5)
+        progress.add_inserted(2, 15)
+        self.queue.put(None)
+
+        stats = progress.stats()
+        self.assertEqual(stats["stage"], "scanning")
+        self.assertEqual((stats["directories"], stats["files"]), (3, 15))
+        self.assertEqual(stats["inserted_files"], 15)
+        self.assertEqual(stats["queue_depth"], 1)
+        self.assertEqual(stats["commits"], 2)
+        self.assertIn("found 3 directories and 15 files", progress.summary())
+
+        progress.set_stage("finishing")
+        with progress:
+            pass
+
+        self.vfs.session_stats.return_value = None
+        stats = progress.stats()
+        self.assertEqual(stats["stage"], "done")
+        self.assertEqual(sorted(stats["stage_seconds"]), ["finishing", "scanning"])
+        self.assertEqual(stats["commits"], 2)
+
+    def test_report(self):
+        progress = RescanProgress(self.queue, self.vfs)
+        reports = []
+
+        def callback(progress):
+            reports.append(progress.stats()["stage"])
+            if len(reports) == 2:
+                with progress:
+                    pass
+
+        progress.report(callback, interval=0.01)
+        self.assertEqual(reports, ["scanning", "scanning"])
+        self.assertEqual(progress.stats()["stage"], "done")
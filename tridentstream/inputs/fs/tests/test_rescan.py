@@ -0,0 +1,417 @@
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from ....bases.listing.listingbuilder import ListingBuilder
+from ....bases.listing.models import ListingItem
+from ....dbs.memory.handler import MemoryDatabasePlugin
+from ....plugins import InputPluginManager
+from ....vfs import DatabaseType
+from ..fingerprint import fingerprint_file
+from ..handler import FilesystemInputPlugin
+from ..watcher import FilesystemWatcher, INotify
+
+
+class FilesystemInputTestCase(TestCase):
+    def setUp(self):
+        self.temppath = tempfile.mkdtemp()
+        self.datapath = os.path.join(self.temppath, "data")
+
+        os.makedirs(os.path.join(self.datapath, "folder1", "subfolder1"))
+        os.makedirs(os.path.join(self.datapath, "folder2"))
+        self.write_file(os.path.join("folder1", "file1.mkv"), 10)
+        self.write_file(os.path.join("folder1", "subfolder1", "file2.mkv"), 20)
+        self.write_file(os.path.join("folder2", "file3.mkv"), 30)
+
+    def tearDown(self):
+        shutil.rmtree(self.temppath)
+
+    def write_file(self, path, size):
+        with open(os.path.join(self.datapath, path), "wb") as f:
+            f.write(b" " * size)
+
+    def get_plugin(self, **config):
+        config.setdefault("db", MemoryDatabasePlugin({}))
+        config.setdefault("paths", [{"path": self.datapath, "virtual_root": ""}])
+        return FilesystemInputPlugin(config)
+
+    def get_paths(self, fs):
+        def flatten(item):
+            for nested_item in item.nested_items or []:
+                yield nested_item["path"]
+                yield from flatten(nested_item)
+
+        return sorted(flatten(fs.list("", 10)))
+
+
+class FilesystemInputRescanTestCase(FilesystemInputTestCase):
+    def test_rescan(self):
+        fs = self.get_plugin()
+        fs._rescan()
+
+        self.assertEqual(
+            self.get_paths(fs),
+            [
+                "folder1",
+                "folder1/file1.mkv",
+                "folder1/subfolder1",
+                "folder1/subfolder1/file2.mkv",
+                "folder2",
+                "folder2/file3.mkv",
+            ],
+        )
+
+    def test_rescan_symlinks(self):
+        os.makedirs(os.path.join(self.temppath, "other", "folder4"))
+        with open(
+            os.path.join(self.temppath, "other", "folder4", "file5.mkv"), "wb"
+        ) as f:
+            f.write(b" " * 50)
+
+        os.symlink(
+            os.path.join(self.temppath, "other"), os.path.join(self.datapath, "linked")
+        )
+        os.symlink(
+            os.path.join(self.temppath, "missing"),
+            os.path.join(self.datapath, "folder2", "broken.mkv"),
+        )
+
+        fs = self.get_plugin(walker_threads=2)
+        fs._rescan()
+
+        paths = self.get_paths(fs)
+        self.assertIn("linked/folder4/file5.mkv", paths)
+        self.assertNotIn("folder2/broken.mkv", paths)
+        self.assertEqual(
+            fs.vfs.get_metadata(DatabaseType.FILE, "linked/folder4/file5.mkv")["size"],
+            50,
+        )
+
+    def test_incremental_rescan(self):
+        fs = self.get_plugin(incremental_rescan=True)
+        fs._rescan()
+
+        new_items = []
+        fs.vfs.add_event(
+            "new", lambda key, db_type, metadata: new_items.append(metadata["path"])
+        )
+
+        with mock.patch("os.scandir", wraps=os.scandir) as scandir:
+            fs._rescan()
+        self.assertEqual(scandir.call_count, 0)
+        self.assertEqual(new_items, [])
+        self.assertEqual(len(self.get_paths(fs)), 6)
+
+        self.write_file(os.path.join("folder1", "subfolder1", "file4.mkv"), 40)
+        shutil.rmtree(os.path.join(self.datapath, "folder2"))
+
+        fs._rescan()
+        self.assertEqual(new_items, ["folder1/subfolder1/file4.mkv"])
+        self.assertEqual(
+            self.get_paths(fs),
+            [
+                "folder1",
+                "folder1/file1.mkv",
+                "folder1/subfolder1",
+                "folder1/subfolder1/file2.mkv",
+                "folder1/subfolder1/file4.mkv",
+            ],
+        )
+
+    def test_list_paginated(self):
+        for i in range(5):
+            self.write_file(os.path.join("folder2", f"episode {i}.mkv"), 10)
+
+        fs = self.get_plugin()
+        fs._rescan()
+
+        listing = fs.list("folder2", 0, offset=2, limit=3)
+        self.assertEqual(
+            [item.id for item in listing.nested_items],
+            ["episode 2.mkv", "episode 3.mkv", "episode 4.mkv"],
+        )
+        self.assertTrue(all(item.streamable for item in listing.nested_items))
+
+        listing = fs.list("folder2", 0, offset=5)
+        self.assertEqual([item.id for item in listing.nested_items], ["file3.mkv"])
+
+    def test_recently_added(self):
+        self.write_file(os.path.join("folder2", "notes.txt"), 10)
+
+        fs = self.get_plugin()
+        fs._rescan()
+
+        self.assertEqual(
+            sorted(item["path"] for item in fs.recently_added()),
+            ["folder1/file1.mkv", "folder1/subfolder1/file2.mkv", "folder2/file3.mkv",],
+        )
+        self.assertEqual(len(fs.recently_added(limit=2)), 2)
+        self.assertEqual(fs.recently_added(since=time.time() + 10), [])
+
+    def test_rescan_progress(self):
+        fs = self.get_plugin()
+        self.assertIsNone(fs.rescan_progress())
+        fs._rescan()
+
+        progress = fs.rescan_progress()
+        self.assertEqual(progress["stage"], "done")
+        self.assertEqual(sorted(progress["stage_seconds"]), ["finishing", "scanning"])
+        self.assertEqual((progress["directories"], progress["files"]), (4, 3))
+        self.assertEqual(
+            (progress["inserted_directories"], progress["inserted_files"]), (3, 3)
+        )
+        self.assertEqual(progress["queue_depth"], 0)
+        self.assertGreaterEqual(progress["commits"], 1)
+        self.assertIsNotNone(progress["finish_buckets_seconds"])
+        self.assertEqual(fs.rescan_stats()["progress"], progress)
+
+    def test_throttled_rescan(self):
+        player_service = mock.Mock()
+        player_service.is_playing.return_value = True
+
+        fs = self.get_plugin(
+            scan_max_operations=1000,
+            player_service=player_service,
+            playback_scan_max_operations=100000,
+        )
+        fs._rescan()
+
+        self.assertEqual(len(self.get_paths(fs)), 6)
+        player_service.is_playing.assert_called()
+
+        stats = fs.throttle_stats()
+        self.assertTrue(stats["backing_off"])
+        self.assertEqual(stats["max_operations"], 100000)
+        self.assertGreater(stats["operations"], 0)
+        self.assertEqual(
+            fs.rescan_stats()["throttle"]["operations"], stats["operations"]
+        )
+
+    def test_throttled_before_listing(self):
+        fs = self.get_plugin(scan_max_operations=100000)
+        calls = []
+
+        def throttle(operations=1, nbytes=0):
+            calls.append(("throttle", operations))
+
+        def scandir(path):
+            calls.append(("scandir", path))
+            return scandir_original(path)
+
+        scandir_original = os.scandir
+        with mock.patch.object(fs.throttler, "throttle", side_effect=throttle):
+            with mock.patch("os.scandir", side_effect=scandir):
+                fs._rescan()
+
+        self.assertEqual(len([call for call in calls if call[0] == "scandir"]), 4)
+        for i, call in enumerate(calls):
+            if call[0] == "scandir":
+                self.assertEqual(calls[i - 1][0], "throttle")
+
+        # 4 directories with 6 entries between them
+        self.assertGreaterEqual(sum(c[1] for c in calls if c[0] == "throttle"), 10)
+
+    def test_fingerprint_duplicates(self):
+        self.write_file(os.path.join("folder2", "copy.mkv"), 10)
+
+        fs = self.get_plugin(fingerprint=True)
+        with mock.patch.object(fs, "fingerprint_files"):
+            fs._rescan()
+        fs._fingerprint_files()
+
+        file1 = fs.vfs.get_metadata(DatabaseType.FILE, "folder1/file1.mkv")
+        copy = fs.vfs.get_metadata(DatabaseType.FILE, "folder2/copy.mkv")
+        file3 = fs.vfs.get_metadata(DatabaseType.FILE, "folder2/file3.mkv")
+        self.assertEqual(file1["fingerprint"], copy["fingerprint"])
+        self.assertNotEqual(file1["fingerprint"], file3["fingerprint"])
+
+        items = {item.id: item for item in fs.list("folder1", 0).nested_items}
+        self.assertEqual(items["file1.mkv"]["fingerprint"], copy["fingerprint"])
+        self.assertNotIn("fingerprint", items["subfolder1"])
+
+        with mock.patch(
+            "tridentstream.inputs.fs.handler.fingerprint_file", wraps=fingerprint_file,
+        ) as fingerprint:
+            with mock.patch.object(fs, "fingerprint_files"):
+                fs._rescan()
+            fs._fingerprint_files()
+            self.assertEqual(fingerprint.call_count, 0)
+
+            self.write_file(os.path.join("folder1", "file1.mkv"), 15)
+            with mock.patch.object(fs, "fingerprint_files"):
+                fs._rescan()
+            fs._fingerprint_files()
+            self.assertEqual(fingerprint.call_count, 1)
+
+        file1 = fs.vfs.get_metadata(DatabaseType.FILE, "folder1/file1.mkv")
+        self.assertNotEqual(file1["fingerprint"], copy["fingerprint"])
+
+    def test_metadata_parsers(self):
+        class NfoParser:
+            pattern = re.compile(r"(?i).+\.nfo$")
+            threads = set()
+
+            def handle(self, vfs, virtual_path, actual_path):
+                self.threads.add(threading.current_thread())
+                with open(actual_path, "rb") as f:
+                    size = len(f.read())
+                parent_path = "/".join(virtual_path.split("/")[:-1])
+                vfs.update_metadata(
+                    DatabaseType.DIRECTORY, parent_path, {"metadata:nfo:size": size}
+                )
+
+        self.write_file(os.path.join("folder1", "movie.nfo"), 5)
+        self.write_file(os.path.join("folder2", "movie.nfo"), 7)
+
+        parser = NfoParser()
+        fs = self.get_plugin(metadata_parsers=[parser], metadata_parser_threads=2)
+        fs._rescan()
+
+        self.assertEqual(
+            fs.vfs.get_metadata(DatabaseType.DIRECTORY, "folder1")["metadata:nfo:size"],
+            5,
+        )
+        self.assertEqual(
+            fs.vfs.get_metadata(DatabaseType.DIRECTORY, "folder2")["metadata:nfo:size"],
+            7,
+        )
+        self.assertNotIn(threading.current_thread(), parser.threads)
+
+        stats = fs.rescan_stats()["metadata_parsers"]
+        self.assertEqual((stats["files"], stats["updates"]), (2, 2))
+
+        fs._rescan()
+        self.assertNotIn("metadata_parsers", fs.rescan_stats())
+        fs.close()
+
+
+# the router lists in threads and the test database locks the cache table
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class FilesystemInputListingBuildTestCase(FilesystemInputTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        # the trace log level is added when the server starts
+        patcher = mock.patch.object(logging.Logger, "trace", create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_named_plugin(self, name, path):
+        with mock.patch.object(FilesystemInputPlugin, "name", name):
+            fs = self.get_plugin(paths=[{"path": path, "virtual_root": ""}])
+        fs.name = name
+        self.addCleanup(fs.unload)
+        fs._rescan()
+        return fs
+
+    def test_paged_chunked_build(self):
+        datapath2 = os.path.join(self.temppath, "data2")
+        for folder in ["folder2", "folder3", "folder4"]:
+            os.makedirs(os.path.join(datapath2, folder))
+
+        fs1 = self.get_named_plugin("disk1", self.datapath)
+        fs2 = self.get_named_plugin("disk2", datapath2)
+
+        service = mock.Mock()
+        service.name = "movies"
+        service.get_item.side_effect = lambda config, path: (
+            InputPluginManager.get_item_multiple([(fs1, ""), (fs2, "")])
+        )
+        config = {
+            "edge_type": "folder",
+            "build_chunk_size": 2,
+            "level": {"listing_depth": 0, "metadata_handlers": []},
+        }
+
+        with mock.patch.object(
+            FilesystemInputPlugin,
+            "list",
+            autospec=True,
+            side_effect=FilesystemInputPlugin.list,
+        ) as fs_list:
+            ListingBuilder(service).get_listing(config, "section")
+
+        # depth -1 is the listing itself without its items
+        list_calls = [call for call in fs_list.call_args_list if call[0][2] >= 0]
+        self.assertTrue(list_calls)
+        for call in list_calls:
+            self.assertIn(call[1]["limit"], [0, 2])
+
+        listingitems = {
+            listingitem.path: listingitem
+            for listingitem in ListingItem.objects.filter(
+                app="movies", parent__path="section"
+            )
+        }
+        self.assertEqual(
+            sorted(listingitems),
+            [
+                "section/folder1",
+                "section/folder2",
+                "section/folder3",
+                "section/folder4",
+            ],
+        )
+        routes = listingitems["section/folder2"].config["original_item"]["routes"]
+        self.assertEqual(
+            sorted(route["handler"] for route in routes if route["can_list"]),
+            ["input_fs_list_disk1", "input_fs_list_disk2"],
+        )
+
+
+class FilesystemWatcherTestCase(FilesystemInputTestCase):
+    def setUp(self):
+        if not FilesystemWatcher.is_available():
+            raise unittest.SkipTest("inotify_simple not installed")
+
+        super().setUp()
+
+    def test_watch_changes(self):
+        fs = self.get_plugin()
+        fs._rescan()
+
+        watcher = FilesystemWatcher(fs)
+        watcher.inotify = INotify()
+        watcher.add_watches("", self.datapath, "")
+
+        self.write_file(os.path.join("folder1", "subfolder1", "file4.mkv"), 40)
+        os.makedirs(os.path.join(self.datapath, "folder3", "subfolder3"))
+        self.write_file(os.path.join("folder3", "subfolder3", "file5.mkv"), 50)
+        shutil.rmtree(os.path.join(self.datapath, "folder2"))
+
+        for event in watcher.inotify.read(timeout=100):
+            watcher.handle_event(event)
+        watcher.flush()
+
+        self.assertEqual(
+            self.get_paths(fs),
+            [
+                "folder1",
+                "folder1/file1.mkv",
+                "folder1/subfolder1",
+                "folder1/subfolder1/file2.mkv",
+                "folder1/subfolder1/file4.mkv",
+                "folder3",
+                "folder3/subfolder3",
+                "folder3/subfolder3/file5.mkv",
+            ],
+        )
+
+        self.write_file(os.path.join("folder3", "subfolder3", "file6.mkv"), 60)
+        for event in watcher.inotify.read(timeout=100):
+            watcher.handle_event(event)
+        watcher.flush()
+
+        self.assertIn("folder3/subfolder3/file6.mkv", self.get_paths(fs))
+        watcher.inotify.close()
@@ -0,0 +1,104 @@
+import unittest
+from unittest import mock
+
+from .. import throttle
+from ..throttle import BUSY_CHECK_INTERVAL, ScanThrottler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class ScanThrottlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(throttle, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unlimited(self):
+        throttler = ScanThrottler()
+        for _ in range(100):
+            throttler.throttle(10, 1024)
+
+        self.assertEqual(self.clock.slept, [])
+        stats = throttler.stats()
+        self.assertEqual((stats["operations"], stats["bytes"]), (1000, 102400))
+        self.assertEqual(stats["throttled_seconds"], 0)
+
+    def test_operation_and_byte_limits(self):
+        throttler = ScanThrottler(max_operations=10, max_bytes=1000)
+        throttler.throttle(5)
+        throttler.throttle(5)
+        self.assertEqual(self.clock.slept, [0.5])
+
+        throttler.throttle(1, 2000)
+        throttler.throttle(1, 1)
+        self.assertEqual(self.clock.slept, [0.5, 0.5, 1.5])
+
+        stats = throttler.stats()
+        self.assertEqual(stats["throttled_seconds"], 2.5)
+        self.assertEqual(stats["operations"], 12)
+        self.assertAlmostEqual(stats["operations_per_second"], 12 / 5)
+        self.assertFalse(stats["backing_off"])
+
+    def test_playback_backoff(self):
+        playing = [False]
+        throttler = ScanThrottler(
+            max_operations=100, playback_max_operations=1, is_busy=lambda: playing[0],
+        )
+        throttler.throttle(10)
+        self.assertEqual(throttler.stats()["max_operations"], 100)
+
+        playing[0] = True
+        self.clock.now += BUSY_CHECK_INTERVAL
+        throttler.throttle(2)
+        throttler.throttle(1)
+        self.assertEqual(self.clock.slept, [2.0])
+        self.assertTrue(throttler.stats()["backing_off"])
+        self.assertEqual(throttler.stats()["max_operations"], 1)
+
+        playing[0] = False
+        self.clock.now += BUSY_CHECK_INTERVAL
+        throttler.throttle(1)
+        self.assertEqual(self.clock.slept, [2.0])
+        self.assertFalse(throttler.stats()["backing_off"])
+
+    def test_busy_check_outside_lock(self):
+        locked = []
+
+        def is_busy():
+            locked.append(throttler.lock.locked())
+            raise ValueError("player is gone")
+
+        throttler = ScanThrottler(
+            max_operations=10, playback_max_operations=1, is_busy=is_busy
+        )
+        throttler.throttle(1)
+        self.assertEqual(locked, [False])
+        self.assertFalse(throttler.stats()["backing_off"])
+
+    def test_lower_thread_priority_failing(self):
+        throttler = ScanThrottler(nice=5, ioprio_class="idle")
+        with mock.patch.object(
+            throttle, "set_thread_nice", side_effect=OSError("denied")
+        ) as set_thread_nice, mock.patch.object(
+            throttle, "set_thread_ioprio", side_effect=OSError("denied")
+        ) as set_thread_ioprio:
+            throttler.lower_thread_priority()
+
+        set_thread_nice.assert_called_once_with(5)
+        set_thread_ioprio.assert_called_once_with("idle")
+
+    def test_unknown_ioprio_class(self):
+        throttler = ScanThrottler(ioprio_class="realtime")
+        self.assertIsNone(throttler.ioprio_class)
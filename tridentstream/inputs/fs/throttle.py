@@ -0,0 +1,184 @@
+import ctypes
+import errno
+import logging
+import os
+import platform
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+BUSY_CHECK_INTERVAL = 1.0  # seconds between asking if something is playing
+RATE_WINDOW = 5.0  # seconds the current scan rate is measured over
+
+IOPRIO_CLASSES = {"best-effort": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_LOWEST_LEVEL = 7
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "armv7l": 314,
+}
+
+
+def set_thread_nice(increment):
+    """
+    Adds to the niceness of the calling thread, on Linux
+    priorities are per thread when asked for the calling one.
+    """
+    if platform.system() != "Linux":
+        raise OSError(errno.ENOSYS, "Per thread priorities are not available")
+
+    os.setpriority(os.PRIO_PROCESS, 0, os.getpriority(os.PRIO_PROCESS, 0) + increment)
+
+
+def set_thread_ioprio(ioprio_class):
+    """Sets the io priority class of the calling thread, only possible on Linux"""
+    syscall = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if platform.system() != "Linux" or syscall is None:
+        raise OSError(errno.ENOSYS, "ioprio_set is not available")
+
+    level = IOPRIO_LOWEST_LEVEL if ioprio_class == "best-effort" else 0
+    ioprio = IOPRIO_CLASSES[ioprio_class] << IOPRIO_CLASS_SHIFT | level
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.syscall(syscall, IOPRIO_WHO_PROCESS, 0, ioprio) == -1:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+class ScanThrottler:
+    """
+    Paces the disk operations and bytes read by scans. While is_busy reports
+    something is playing, the playback limits are used instead so the streams
+    reading from the same disks are not starved. A limit of 0 is unlimited.
+
+    Only playback reported by is_busy makes scans back off, streams that are not
+    played through the player service, e.g. downloads, are not noticed.
+    """
+
+    def __init__(
+        self,
+        max_operations=0,
+        max_bytes=0,
+        playback_max_operations=0,
+        playback_max_bytes=0,
+        nice=0,
+        ioprio_class=None,
+        is_busy=None,
+    ):
+        self.limits = (max_operations, max_bytes)
+        self.playback_limits = (playback_max_operations, playback_max_bytes)
+        self.nice = nice
+        self.ioprio_class = ioprio_class or None
+        self.is_busy = is_busy
+
+        if self.ioprio_class and self.ioprio_class not in IOPRIO_CLASSES:
+            logger.warning(f"Unknown io priority class {self.ioprio_class!r}")
+            self.ioprio_class = None
+
+        self.lock = threading.Lock()
+        self.available_at = [0.0, 0.0]
+        self.busy = False
+        self.busy_checked = 0.0
+        self.history = deque()
+
+        self.operations = 0
+        self.bytes = 0
+        self.throttled_seconds = 0.0
+
+    def _check_busy(self):
+        """
+        Asks is_busy at most every BUSY_CHECK_INTERVAL, the call is made without
+        holding the lock so the other scan threads are not blocked by it.
+        """
+        if self.is_busy is None:
+            return
+
+        with self.lock:
+            if time.monotonic() - self.busy_checked < BUSY_CHECK_INTERVAL:
+                return
+            self.busy_checked = time.monotonic()
+
+        try:
+            busy = bool(self.is_busy())
+        except Exception:
+            logger.exception("Failed to check for playback")
+            busy = False
+
+        with self.lock:
+            if busy != self.busy:
+                if busy:
+                    logger.info("Playback started, backing off scanning")
+                else:
+                    logger.info("Playback stopped, scanning at full rate again")
+                self.busy = busy
+                self.available_at = [0.0, 0.0]
+
+    def current_limits(self):
+        return self.playback_limits if self.busy else self.limits
+
+    def throttle(self, operations=1, nbytes=0):
+        """
+        Accounts for operations and bytes about to be done, sleeps if that
+        would go over the current limits.
+        """
+        self._check_busy()
+        with self.lock:
+            now = time.monotonic()
+            delay = 0.0
+            for i, (amount, limit) in enumerate(
+                zip((operations, nbytes), self.current_limits())
+            ):
+                if not limit or not amount:
+                    continue
+                available_at = max(now, self.available_at[i])
+                delay = max(delay, available_at - now)
+                self.available_at[i] = available_at + amount / limit
+
+            self.operations += operations
+            self.bytes += nbytes
+            self.throttled_seconds += delay
+            self.history.append((now + delay, operations, nbytes))
+            while self.history and self.history[0][0] < now - RATE_WINDOW:
+                self.history.popleft()
+
+        if delay:
+            time.sleep(delay)
+
+    def lower_thread_priority(self):
+        """
+        Lowers the cpu and io priority of the calling thread,
+        meant as initializer of the scan thread pools.
+        """
+        if self.nice:
+            try:
+                set_thread_nice(self.nice)
+            except OSError as e:
+                logger.warning(f"Unable to set nice on scan thread: {e}")
+
+        if self.ioprio_class:
+            try:
+                set_thread_ioprio(self.ioprio_class)
+            except OSError as e:
+                logger.warning(f"Unable to set io priority on scan thread: {e}")
+
+    def stats(self):
+        """Throttle state, the scan rate over the last seconds and the totals"""
+        with self.lock:
+            now = time.monotonic()
+            recent = [entry for entry in self.history if entry[0] >= now - RATE_WINDOW]
+            max_operations, max_bytes = self.current_limits()
+            return {
+                "backing_off": self.busy,
+                "max_operations": max_operations,
+                "max_bytes": max_bytes,
+                "operations_per_second": sum(e[1] for e in recent) / RATE_WINDOW,
+                "bytes_per_second": sum(e[2] for e in recent) / RATE_WINDOW,
+                "operations": self.operations,
+                "bytes": self.bytes,
+                "throttled_seconds": self.throttled_seconds,
+            }
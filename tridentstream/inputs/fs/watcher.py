@@ -0,0 +1,186 @@
+import logging
+import os
+import time
+
+from ...exceptions import PathNotFoundException
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = flags = None
+
+logger = logging.getLogger(__name__)
+
+READ_TIMEOUT = 1000  # milliseconds to wait for new events before checking status
+SETTLE_TIME = 2  # seconds without new events before changes are written to the vfs
+MAX_PENDING_TIME = 10  # seconds a change can wait while events keep coming
+
+
+class FilesystemWatcher:
+    """
+    Watches the paths of a filesystem input with inotify and writes
+    changes to the vfs in short sessions.
+    """
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.watches = {}
+        self.pending = set()
+        self.first_pending_time = None
+        self.last_event_time = None
+
+    @staticmethod
+    def is_available():
+        return INotify is not None
+
+    @property
+    def watch_flags(self):
+        return (
+            flags.CREATE
+            | flags.CLOSE_WRITE
+            | flags.DELETE
+            | flags.MOVED_FROM
+            | flags.MOVED_TO
+            | flags.DELETE_SELF
+            | flags.ONLYDIR
+        )
+
+    def add_watch(self, prefix, path, root):
+        full_path = os.path.join(path, root)
+        try:
+            wd = self.inotify.add_watch(full_path, self.watch_flags)
+        except OSError:
+            logger.warning(
+                f"Unable to watch {full_path!r}, max_user_watches might be too low"
+            )
+            return
+
+        self.watches[wd] = (prefix, path, root)
+
+    def add_watches(self, prefix, path, root):
+        """Watch root and all directories below it"""
+        for r, dirs, files in os.walk(os.path.join(path, root), followlinks=True):
+            self.add_watch(prefix, path, r[len(path) :].strip(os.sep))
+
+    def remove_watches(self, path, root):
+        """Stop watching root and all directories below it"""
+        for wd, (_, watch_path, watch_root) in list(self.watches.items()):
+            if watch_path != path:
+                continue
+
+            if watch_root == root or watch_root.startswith(root + os.sep):
+                del self.watches[wd]
+                try:
+                    self.inotify.rm_watch(wd)
+                except OSError:
+                    pass
+
+    def handle_event(self, event):
+        if event.mask & flags.Q_OVERFLOW:
+            logger.warning("Inotify event queue overflowed, doing incremental rescan")
+            self.pending = set()
+            self.plugin.rescan(incremental=True)
+            return
+
+        if event.wd not in self.watches:
+            return
+
+        prefix, path, root = self.watches[event.wd]
+        if event.mask & (flags.DELETE_SELF | flags.IGNORED):
+            del self.watches[event.wd]
+            return
+
+        item_root = os.path.join(root, event.name)
+        if event.mask & flags.ISDIR and event.mask & flags.MOVED_FROM:
+            self.remove_watches(path, item_root)
+
+        self.pending.add((prefix, path, item_root))
+
+        self.last_event_time = time.monotonic()
+        if self.first_pending_time is None:
+            self.first_pending_time = self.last_event_time
+
+    def should_flush(self):
+        if not self.pending or self.plugin.is_rescanning:
+            return False
+
+        current_time = time.monotonic()
+        return (
+            current_time - self.last_event_time >= SETTLE_TIME
+            or current_time - self.first_pending_time >= MAX_PENDING_TIME
+        )
+
+    def add_tree(self, vfs, prefix, path, root):
+        """Add a new directory and everything below it to the vfs"""
+        for r, dirs, files in os.walk(os.path.join(path, root), followlinks=True):
+            r = r[len(path) :].strip(os.sep)
+            self.add_watch(prefix, path, r)
+
+            virtual_path = [prefix] + r.split(os.sep)
+            for d in dirs:
+                vp = "/".join([x for x in virtual_path + [d] if x])
+                vfs.add_dir(vp, int(time.time()))
+
+            for f in files:
+                full_path = os.path.join(path, r, f)
+                if not os.path.exists(full_path):
+                    continue
+
+                vp = "/".join([x for x in virtual_path + [f] if x])
+                vfs.add_file(
+                    vp,
+                    os.path.getsize(full_path),
+                    int(time.time()),
+                    {"_actual_path": full_path},
+                )
+
+    def flush(self):
+        """Write all pending changes to the vfs in one session"""
+        pending, self.pending = sorted(self.pending), set()
+        self.first_pending_time = self.last_event_time = None
+
+        logger.debug(f"Writing {len(pending)} changed paths to the vfs")
+
+        vfs = self.plugin.vfs
+        with self.plugin.session_lock, vfs.session():
+            for prefix, path, root in pending:
+                full_path = os.path.join(path, root)
+                vp = "/".join([x for x in [prefix] + root.split(os.sep) if x])
+
+                if os.path.isdir(full_path):
+                    vfs.add_dir(vp, int(time.time()))
+                    self.add_tree(vfs, prefix, path, root)
+                elif os.path.exists(full_path):
+                    vfs.add_file(
+                        vp,
+                        os.path.getsize(full_path),
+                        int(time.time()),
+                        {"_actual_path": full_path},
+                    )
+                else:
+                    try:
+                        vfs.remove_path(vp)
+                    except PathNotFoundException:
+                        pass
+
+    def run(self):
+        logger.info(f"Starting to watch paths for {self.plugin.name}")
+        self.inotify = INotify()
+        try:
+            for prefix, path in self.plugin.paths:
+                self.add_watches(prefix, path, "")
+
+            logger.info(f"Watching {len(self.watches)} directories")
+
+            while not self.plugin.should_die:
+                for event in self.inotify.read(timeout=READ_TIMEOUT):
+                    self.handle_event(event)
+
+                if self.should_flush():
+                    try:
+                        self.flush()
+                    except Exception:
+                        logger.exception("Failed to write watched changes to the vfs")
+        finally:
+            self.inotify.close()
+            logger.info(f"Stopped watching paths for {self.plugin.name}")
@@ -8,3 +8,4 @@ class AppConfig(DjangoAppConfig):
 
     def ready(self):
         from .handler import EmbeddedMetadataHandlerPlugin  # NOQA
+        from .parser import ContainerMetadataParserPlugin  # NOQA
@@ -0,0 +1,397 @@
+"""
+Reads technical metadata from Matroska and MP4 container headers in pure Python.
+
+Only the headers are read, through mmap, the first few MB for Matroska and
+the box headers plus the moov box for MP4, so probing a file is cheap no
+matter how big it is.
+"""
+import logging
+import mmap
+import struct
+
+logger = logging.getLogger(__name__)
+
+PROBE_SIZE = 4 * 1024 * 1024  # bytes read from the start of Matroska files
+MAX_ELEMENT_SIZE = 1024 * 1024  # bytes, largest element read through the seek head
+MAX_MOOV_SIZE = 32 * 1024 * 1024  # bytes
+
+EBML_HEADER = 0x1A45DFA3
+EBML_DOCTYPE = 0x4282
+MKV_SEGMENT = 0x18538067
+MKV_SEEKHEAD = 0x114D9B74
+MKV_SEEK = 0x4DBB
+MKV_SEEK_ID = 0x53AB
+MKV_SEEK_POSITION = 0x53AC
+MKV_INFO = 0x1549A966
+MKV_TIMECODE_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_TYPE = 0x83
+MKV_CODEC_ID = 0x86
+MKV_LANGUAGE = 0x22B59C
+MKV_VIDEO = 0xE0
+MKV_PIXEL_WIDTH = 0xB0
+MKV_PIXEL_HEIGHT = 0xBA
+MKV_AUDIO = 0xE1
+MKV_CHANNELS = 0x9F
+MKV_CLUSTER = 0x1F43B675
+
+MKV_TRACK_TYPES = {1: "video", 2: "audio", 17: "subtitle"}
+MP4_HANDLER_TYPES = {
+    "vide": "video",
+    "soun": "audio",
+    "subt": "subtitle",
+    "text": "subtitle",
+}
+
+CODEC_NAMES = {
+    "V_MPEG4/ISO/AVC": "H.264",
+    "V_MPEGH/ISO/HEVC": "H.265",
+    "V_AV1": "AV1",
+    "V_VP9": "VP9",
+    "V_VP8": "VP8",
+    "V_MPEG4/ISO/ASP": "MPEG-4",
+    "V_MPEG2": "MPEG-2",
+    "A_AAC": "AAC",
+    "A_AC3": "AC3",
+    "A_EAC3": "E-AC3",
+    "A_DTS": "DTS",
+    "A_TRUEHD": "TrueHD",
+    "A_FLAC": "FLAC",
+    "A_OPUS": "Opus",
+    "A_VORBIS": "Vorbis",
+    "A_MPEG/L3": "MP3",
+    "avc1": "H.264",
+    "avc3": "H.264",
+    "hvc1": "H.265",
+    "hev1": "H.265",
+    "av01": "AV1",
+    "vp09": "VP9",
+    "mp4v": "MPEG-4",
+    "mp4a": "AAC",
+    "ac-3": "AC3",
+    "ec-3": "E-AC3",
+    "dtsc": "DTS",
+    "Opus": "Opus",
+    "fLaC": "FLAC",
+    ".mp3": "MP3",
+}
+
+
+class ContainerParseException(Exception):
+    """The container headers are broken or truncated"""
+
+
+def codec_name(codec_id):
+    if codec_id in CODEC_NAMES:
+        return CODEC_NAMES[codec_id]
+
+    for prefix, name in CODEC_NAMES.items():
+        if codec_id.startswith(prefix + "/"):
+            return name
+
+    return codec_id.split("_", 1)[-1]
+
+
+def read_uint(data, pos, size):
+    return int.from_bytes(data[pos : pos + size], "big")
+
+
+def read_vint(data, pos, keep_marker=False):
+    """Reads an EBML variable size integer, returns the value and its length"""
+    if pos >= len(data):
+        raise ContainerParseException("Truncated variable size integer")
+
+    first = data[pos]
+    length = 9 - first.bit_length()
+    if length > 8:
+        raise ContainerParseException("Invalid variable size integer")
+
+    value = read_uint(data, pos, length)
+    if not keep_marker:
+        value &= (1 << (7 * length)) - 1
+        if value == (1 << (7 * length)) - 1:
+            value = None  # unknown size
+    return value, length
+
+
+def iter_elements(data, start, end):
+    """Yields the id, data position and size of the EBML elements in a range"""
+    pos = start
+    while pos < end:
+        element_id, id_length = read_vint(data, pos, keep_marker=True)
+        size, size_length = read_vint(data, pos + id_length)
+        pos += id_length + size_length
+        if size is None:
+            size = end - pos
+
+        yield element_id, pos, size
+        pos += size
+
+
+def read_element_value(data, pos, size, value_type):
+    value = data[pos : pos + size]
+    if value_type == "uint":
+        return int.from_bytes(value, "big")
+    elif value_type == "float":
+        return struct.unpack(">f" if size == 4 else ">d", value)[0]
+    return value.rstrip(b"\x00").decode("utf-8", "replace")
+
+
+def parse_matroska_info(data, pos, end, info):
+    timecode_scale, duration = 1000000, None
+    for element_id, element_pos, size in iter_elements(data, pos, end):
+        if element_id == MKV_TIMECODE_SCALE:
+            timecode_scale = read_element_value(data, element_pos, size, "uint")
+        elif element_id == MKV_DURATION and size in (4, 8):
+            duration = read_element_value(data, element_pos, size, "float")
+
+    if duration:
+        info["duration"] = duration * timecode_scale / 1e9
+
+
+def parse_matroska_tracks(data, pos, end, info):
+    for element_id, entry_pos, entry_size in iter_elements(data, pos, end):
+        if element_id != MKV_TRACK_ENTRY:
+            continue
+
+        track = {"language": "eng"}  # the default language in Matroska
+        track_type = None
+        for child_id, child_pos, size in iter_elements(
+            data, entry_pos, min(end, entry_pos + entry_size)
+        ):
+            if child_id == MKV_TRACK_TYPE:
+                track_type = read_element_value(data, child_pos, size, "uint")
+            elif child_id == MKV_CODEC_ID:
+                track["codec"] = codec_name(
+                    read_element_value(data, child_pos, size, "string")
+                )
+            elif child_id == MKV_LANGUAGE:
+                track["language"] = read_element_value(data, child_pos, size, "string")
+            elif child_id in (MKV_VIDEO, MKV_AUDIO):
+                for setting_id, setting_pos, setting_size in iter_elements(
+                    data, child_pos, min(end, child_pos + size)
+                ):
+                    if setting_id == MKV_PIXEL_WIDTH:
+                        key = "width"
+                    elif setting_id == MKV_PIXEL_HEIGHT:
+                        key = "height"
+                    elif setting_id == MKV_CHANNELS:
+                        key = "channels"
+                    else:
+                        continue
+                    track[key] = read_element_value(
+                        data, setting_pos, setting_size, "uint"
+                    )
+
+        if track_type in MKV_TRACK_TYPES:
+            info["tracks"].append(dict(track, type=MKV_TRACK_TYPES[track_type]))
+
+
+def parse_matroska(data):
+    window_end = min(len(data), PROBE_SIZE)
+    elements = iter_elements(data, 0, window_end)
+    element_id, pos, size = next(elements)
+    if element_id != EBML_HEADER:
+        raise ContainerParseException("Missing EBML header")
+
+    info = {"container": "mkv", "tracks": []}
+    for child_id, child_pos, child_size in iter_elements(data, pos, pos + size):
+        if child_id == EBML_DOCTYPE:
+            doctype = read_element_value(data, child_pos, child_size, "string")
+            if doctype == "webm":
+                info["container"] = "webm"
+
+    for element_id, segment_pos, segment_size in elements:
+        if element_id == MKV_SEGMENT:
+            break
+    else:
+        raise ContainerParseException("Missing segment")
+
+    parsers = {MKV_INFO: parse_matroska_info, MKV_TRACKS: parse_matroska_tracks}
+    seek_positions = {}
+    segment_end = min(window_end, segment_pos + segment_size)
+    try:
+        for element_id, pos, size in iter_elements(data, segment_pos, segment_end):
+            if element_id in parsers:
+                if pos + size > segment_end:
+                    continue  # truncated by the window, read through the seek head
+                parsers.pop(element_id)(data, pos, pos + size, info)
+            elif element_id == MKV_SEEKHEAD:
+                for seek_id, seek_pos, seek_size in iter_elements(
+                    data, pos, min(segment_end, pos + size)
+                ):
+                    if seek_id != MKV_SEEK:
+                        continue
+                    seek = dict(
+                        (
+                            child_id,
+                            read_element_value(data, child_pos, child_size, "uint"),
+                        )
+                        for child_id, child_pos, child_size in iter_elements(
+                            data, seek_pos, seek_pos + seek_size
+                        )
+                    )
+                    if MKV_SEEK_ID in seek and MKV_SEEK_POSITION in seek:
+                        seek_positions[seek[MKV_SEEK_ID]] = seek[MKV_SEEK_POSITION]
+            elif element_id == MKV_CLUSTER or not parsers:
+                break
+    except ContainerParseException:
+        if not seek_positions:
+            raise
+
+    # elements after the first clusters or beyond the window are found through the seek head
+    for element_id, parser in parsers.items():
+        if element_id not in seek_positions:
+            continue
+
+        element_id_found, pos, size = next(
+            iter_elements(data, segment_pos + seek_positions[element_id], len(data))
+        )
+        if element_id_found == element_id and size <= MAX_ELEMENT_SIZE:
+            parser(data, pos, min(len(data), pos + size), info)
+
+    return info
+
+
+def iter_boxes(data, start, end):
+    """Yields the type, data position and end of the MP4 boxes in a range"""
+    pos = start
+    while pos + 8 <= end:
+        size = read_uint(data, pos, 4)
+        box_type = bytes(data[pos + 4 : pos + 8]).decode("latin-1")
+        header_size = 8
+        if size == 1:
+            size = read_uint(data, pos + 8, 8)
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+
+        if size < header_size:
+            raise ContainerParseException(f"Invalid size of box {box_type!r}")
+
+        yield box_type, pos + header_size, pos + size
+        pos += size
+
+
+def find_box(data, start, end, *path):
+    for box_type, pos, box_end in iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return pos, min(box_end, end)
+            return find_box(data, pos, min(box_end, end), *path[1:])
+    return None
+
+
+def parse_mp4_track(data, pos, end):
+    track = {}
+    handler = find_box(data, pos, end, "mdia", "hdlr")
+    if handler:
+        track["type"] = MP4_HANDLER_TYPES.get(
+            bytes(data[handler[0] + 8 : handler[0] + 12]).decode("latin-1")
+        )
+
+    header = find_box(data, pos, end, "mdia", "mdhd")
+    if header:
+        version = data[header[0]]
+        language = read_uint(data, header[0] + (32 if version == 1 else 20), 2)
+        language = "".join(
+            chr(((language >> shift) & 0x1F) + 0x60) for shift in (10, 5, 0)
+        )
+        if language.isalpha() and language != "und":
+            track["language"] = language
+
+    sample_descriptions = find_box(data, pos, end, "mdia", "minf", "stbl", "stsd")
+    if sample_descriptions:
+        entry = sample_descriptions[0] + 8  # version, flags and entry count
+        track["codec"] = codec_name(
+            bytes(data[entry + 4 : entry + 8]).decode("latin-1")
+        )
+        if track.get("type") == "video":
+            track["width"] = read_uint(data, entry + 32, 2)
+            track["height"] = read_uint(data, entry + 34, 2)
+        elif track.get("type") == "audio":
+            track["channels"] = read_uint(data, entry + 24, 2)
+
+    return track
+
+
+def parse_mp4(data):
+    info = {"container": "mp4", "tracks": []}
+    moov = None
+    # only the box headers are read until the moov box, it is often at the end
+    for box_type, pos, box_end in iter_boxes(data, 0, len(data)):
+        if box_type == "ftyp":
+            if bytes(data[pos : pos + 4]) == b"qt  ":
+                info["container"] = "mov"
+        elif box_type == "moov":
+            if box_end > len(data):
+                raise ContainerParseException("Truncated moov box")
+            moov = (pos, box_end)
+            break
+
+    if moov is None:
+        raise ContainerParseException("Missing moov box")
+
+    if moov[1] - moov[0] > MAX_MOOV_SIZE:
+        raise ContainerParseException("The moov box is too big")
+
+    movie_header = find_box(data, moov[0], moov[1], "mvhd")
+    if movie_header:
+        pos = movie_header[0]
+        if data[pos] == 1:
+            timescale, duration = (
+                read_uint(data, pos + 20, 4),
+                read_uint(data, pos + 24, 8),
+            )
+        else:
+            timescale, duration = (
+                read_uint(data, pos + 12, 4),
+                read_uint(data, pos + 16, 4),
+            )
+        if timescale and duration not in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+            info["duration"] = duration / timescale
+
+    for box_type, pos, box_end in iter_boxes(data, moov[0], moov[1]):
+        if box_type == "trak":
+            track = parse_mp4_track(data, pos, min(box_end, moov[1]))
+            if track.get("type"):
+                info["tracks"].append(track)
+
+    return info
+
+
+def probe_file(path):
+    """
+    Returns the container, duration in seconds and tracks of a Matroska or MP4 file,
+    None if it is neither.
+    """
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return None
+
+    with data:
+        magic = bytes(data[:12])
+        try:
+            if magic[:4] == b"\x1a\x45\xdf\xa3":
+                return parse_matroska(data)
+            elif magic[4:8] == b"ftyp":
+                return parse_mp4(data)
+        except (ContainerParseException, IndexError, StopIteration, struct.error) as e:
+            logger.debug(f"Unable to parse container headers of {path!r}: {e}")
+
+    return None
+
+
+def resolution_name(width, height):
+    """Names the resolution the way releases do, wide and cropped video included"""
+    if width >= 3200 or height >= 1700:
+        return "2160p"
+    elif width >= 1800 or height >= 1000:
+        return "1080p"
+    elif width >= 1200 or height >= 700:
+        return "720p"
+    return f"{height}p"
@@ -11,8 +11,11 @@ class EmbeddedInfoFilter(filters.FilterSet):
     episode = filters.AllLookupsFilter(
         field_name="metadata__episodeinfo_episode", name="metadata__episodeinfo_episode"
     )
+    audio_language = filters.CharFilter(
+        field_name="metadata__mediainfo_audio_languages", lookup_expr="icontains"
+    )
 
     class Meta:
         model = ListingItemRelation
-        order_by = ["index", "season", "episode"]
+        order_by = ["index", "season", "episode", "audio_language"]
         fields = []
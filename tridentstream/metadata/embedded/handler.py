@@ -80,6 +80,7 @@ class EmbeddedMetadataHandlerPlugin(
             "scene": "mediainfo_scene",
             "audio": "mediainfo_audio",
             "dual_audio": "mediainfo_dual_audio",
+            "audio_languages": "mediainfo_audio_languages",
             "best": "mediainfo_best",
         },
         "metadata:episodeinfo": {
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:58
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metadata_embedded', '0002_auto_20200331_0828'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='embeddedinfo',
+            name='mediainfo_audio_languages',
+            field=jsonfield.fields.JSONField(default=list),
+        ),
+    ]
@@ -34,6 +34,7 @@ class EmbeddedInfo(models.Model):
     mediainfo_scene = models.BooleanField(default=False)
     mediainfo_dual_audio = models.BooleanField(default=False)
     mediainfo_audio = models.CharField(null=True, max_length=100)
+    mediainfo_audio_languages = JSONField(default=list)
     mediainfo_best = models.BooleanField(
         default=False
     )  # probably the best choice if you have to choose
@@ -0,0 +1,91 @@
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from unplugged import Schema, fields
+
+from ...plugins import MetadataParserPlugin
+from ...vfs import DatabaseType
+from .containers import probe_file, resolution_name
+
+
+class ContainerMetadataParserSchema(Schema):
+    processes = fields.Integer(
+        default=2
+    )  # probes run in these processes, 0 to probe in the scanning thread
+
+
+def container_metadata(info):
+    """
+    Turns probed container info into metadata the embedded metadata handler understands.
+    """
+    mediainfo = {"container": info["container"]}
+    metadata = {"metadata:mediainfo": mediainfo}
+
+    if info.get("duration"):
+        metadata["metadata"] = {"duration": int(round(info["duration"] / 60))}
+
+    video_tracks = [t for t in info["tracks"] if t["type"] == "video"]
+    if video_tracks:
+        video = video_tracks[0]
+        if video.get("codec"):
+            mediainfo["codec"] = video["codec"]
+        if video.get("width") and video.get("height"):
+            mediainfo["resolution"] = resolution_name(video["width"], video["height"])
+
+    audio_tracks = [t for t in info["tracks"] if t["type"] == "audio"]
+    if audio_tracks:
+        if audio_tracks[0].get("codec"):
+            mediainfo["audio"] = audio_tracks[0]["codec"]
+
+        languages = []
+        for track in audio_tracks:
+            language = track.get("language")
+            if language and language != "und" and language not in languages:
+                languages.append(language)
+
+        mediainfo["audio_languages"] = languages
+        mediainfo["dual_audio"] = len(languages) > 1
+
+    return metadata
+
+
+class ContainerMetadataParserPlugin(MetadataParserPlugin):
+    plugin_name = "container"
+    pattern = re.compile(r"(?i).+\.(mkv|webm|mp4|m4v|mov)$")
+    config_schema = ContainerMetadataParserSchema
+
+    executor = None
+
+    def __init__(self, config):
+        super(ContainerMetadataParserPlugin, self).__init__(config)
+        self.processes = max(0, config.get("processes", 2))
+        self.executor_lock = threading.Lock()
+
+    def get_executor(self):
+        with self.executor_lock:
+            if self.executor is None:
+                # forking a server with running threads can copy held locks into the workers
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self.executor
+
+    def handle(self, vfs, virtual_path, actual_path):
+        if self.processes:
+            info = self.get_executor().submit(probe_file, actual_path).result()
+        else:
+            info = probe_file(actual_path)
+
+        if info:
+            vfs.update_metadata(
+                DatabaseType.FILE, virtual_path, container_metadata(info)
+            )
+
+    def unload(self):
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
@@ -0,0 +1,382 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+from django.test import TestCase
+from django.utils.timezone import now
+from thomas import Item
+
+from ...bases.listing.listingbuilder import ListingBuild
+from ...bases.listing.models import ListingItem
+from ...vfs import DatabaseType
+from . import containers
+from .containers import probe_file
+from .filters import EmbeddedInfoFilter
+from .handler import EmbeddedMetadataHandlerPlugin
+from .models import ListingItemRelation
+from .parser import ContainerMetadataParserPlugin, container_metadata
+
+
+def ebml(element_id, *children):
+    payload = b"".join(children)
+    element_id = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return element_id + b"\x01" + len(payload).to_bytes(7, "big") + payload
+
+
+def ebml_uint(element_id, value):
+    return ebml(element_id, value.to_bytes(4, "big"))
+
+
+def ebml_string(element_id, value):
+    return ebml(element_id, value.encode("utf-8"))
+
+
+def mkv_track(track_type, codec, language=None, **settings):
+    children = [
+        ebml_uint(containers.MKV_TRACK_TYPE, track_type),
+        ebml_string(containers.MKV_CODEC_ID, codec),
+    ]
+    if language:
+        children.append(ebml_string(containers.MKV_LANGUAGE, language))
+    if track_type == 1:
+        children.append(
+            ebml(
+                containers.MKV_VIDEO,
+                ebml_uint(containers.MKV_PIXEL_WIDTH, settings["width"]),
+                ebml_uint(containers.MKV_PIXEL_HEIGHT, settings["height"]),
+            )
+        )
+    elif track_type == 2:
+        children.append(
+            ebml(
+                containers.MKV_AUDIO,
+                ebml_uint(containers.MKV_CHANNELS, settings.get("channels", 2)),
+            )
+        )
+    return ebml(containers.MKV_TRACK_ENTRY, *children)
+
+
+MKV_HEADER = ebml(
+    containers.EBML_HEADER, ebml_string(containers.EBML_DOCTYPE, "matroska")
+)
+MKV_INFO = ebml(
+    containers.MKV_INFO,
+    ebml_uint(containers.MKV_TIMECODE_SCALE, 1000000),
+    ebml(containers.MKV_DURATION, struct.pack(">d", 5400000.0)),
+)
+MKV_TRACKS = ebml(
+    containers.MKV_TRACKS,
+    mkv_track(1, "V_MPEGH/ISO/HEVC", width=1920, height=800),
+    mkv_track(2, "A_AAC", "jpn", channels=6),
+    mkv_track(2, "A_AC3"),
+    mkv_track(17, "S_TEXT/UTF8", "eng"),
+)
+MKV_CLUSTER = ebml(containers.MKV_CLUSTER, b"\x00" * 2000)
+
+
+def box(box_type, *children):
+    payload = b"".join(children)
+    return (len(payload) + 8).to_bytes(4, "big") + box_type + payload
+
+
+def mp4_language(language):
+    value = 0
+    for c in language:
+        value = value << 5 | (ord(c) - 0x60)
+    return value.to_bytes(2, "big")
+
+
+def mp4_track(handler_type, codec, language, sample_entry):
+    return box(
+        b"trak",
+        box(
+            b"mdia",
+            box(b"mdhd", b"\x00" * 20, mp4_language(language), b"\x00" * 2),
+            box(b"hdlr", b"\x00" * 8, handler_type, b"\x00" * 13),
+            box(
+                b"minf",
+                box(
+                    b"stbl",
+                    box(
+                        b"stsd",
+                        b"\x00" * 4,
+                        (1).to_bytes(4, "big"),
+                        box(codec, b"\x00" * 8, sample_entry),
+                    ),
+                ),
+            ),
+        ),
+    )
+
+
+def mp4_file(moov_first=False):
+    ftyp = box(b"ftyp", b"isom", b"\x00" * 4, b"isom")
+    mdat = box(b"mdat", b"\x00" * 5000)
+    moov = box(
+        b"moov",
+        box(
+            b"mvhd",
+            b"\x00" * 12,
+            (1000).to_bytes(4, "big"),
+            (1500000).to_bytes(4, "big"),
+            b"\x00" * 80,
+        ),
+        mp4_track(
+            b"vide",
+            b"avc1",
+            "und",
+            b"\x00" * 16 + (1280).to_bytes(2, "big") + (720).to_bytes(2, "big"),
+        ),
+        mp4_track(b"soun", b"mp4a", "eng", b"\x00" * 8 + (2).to_bytes(2, "big")),
+        mp4_track(b"soun", b"ac-3", "ger", b"\x00" * 8 + (6).to_bytes(2, "big")),
+    )
+    if moov_first:
+        return ftyp + moov + mdat
+    return ftyp + mdat + moov
+
+
+class ContainerProbeTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def write_file(self, name, data):
+        path = os.path.join(self.temp_path, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_matroska(self):
+        path = self.write_file(
+            "movie.mkv",
+            MKV_HEADER
+            + ebml(containers.MKV_SEGMENT, MKV_INFO, MKV_TRACKS, MKV_CLUSTER),
+        )
+
+        self.assertEqual(
+            probe_file(path),
+            {
+                "container": "mkv",
+                "duration": 5400.0,
+                "tracks": [
+                    {
+                        "type": "video",
+                        "codec": "H.265",
+                        "language": "eng",
+                        "width": 1920,
+                        "height": 800,
+                    },
+                    {
+                        "type": "audio",
+                        "codec": "AAC",
+                        "language": "jpn",
+                        "channels": 6,
+                    },
+                    {
+                        "type": "audio",
+                        "codec": "AC3",
+                        "language": "eng",
+                        "channels": 2,
+                    },
+                    {"type": "subtitle", "codec": "TEXT/UTF8", "language": "eng"},
+                ],
+            },
+        )
+
+    def test_matroska_tracks_through_seek_head(self):
+        seek_head_size = len(
+            ebml(
+                containers.MKV_SEEKHEAD,
+                ebml(
+                    containers.MKV_SEEK,
+                    ebml(containers.MKV_SEEK_ID, MKV_TRACKS[:4]),
+                    ebml_uint(containers.MKV_SEEK_POSITION, 0),
+                ),
+            )
+        )
+        seek_head = ebml(
+            containers.MKV_SEEKHEAD,
+            ebml(
+                containers.MKV_SEEK,
+                ebml(containers.MKV_SEEK_ID, MKV_TRACKS[:4]),
+                ebml_uint(
+                    containers.MKV_SEEK_POSITION,
+                    seek_head_size + len(MKV_INFO) + len(MKV_CLUSTER),
+                ),
+            ),
+        )
+        segment = seek_head + MKV_INFO + MKV_CLUSTER + MKV_TRACKS
+        unknown_size_segment = (
+            (containers.MKV_SEGMENT).to_bytes(4, "big") + b"\x01" + b"\xff" * 7
+        )
+        path = self.write_file("movie.mkv", MKV_HEADER + unknown_size_segment + segment)
+
+        with mock.patch.object(containers, "PROBE_SIZE", 1000):
+            info = probe_file(path)
+
+        self.assertEqual(info["duration"], 5400.0)
+        self.assertEqual(
+            [(t["type"], t["codec"]) for t in info["tracks"]],
+            [
+                ("video", "H.265"),
+                ("audio", "AAC"),
+                ("audio", "AC3"),
+                ("subtitle", "TEXT/UTF8"),
+            ],
+        )
+
+    def test_mp4_moov_at_end(self):
+        for moov_first in [False, True]:
+            path = self.write_file("movie.mp4", mp4_file(moov_first))
+            self.assertEqual(
+                probe_file(path),
+                {
+                    "container": "mp4",
+                    "duration": 1500.0,
+                    "tracks": [
+                        {
+                            "type": "video",
+                            "codec": "H.264",
+                            "width": 1280,
+                            "height": 720,
+                        },
+                        {
+                            "type": "audio",
+                            "language": "eng",
+                            "codec": "AAC",
+                            "channels": 2,
+                        },
+                        {
+                            "type": "audio",
+                            "language": "ger",
+                            "codec": "AC3",
+                            "channels": 6,
+                        },
+                    ],
+                },
+            )
+
+    def test_not_a_container(self):
+        self.assertIsNone(probe_file(self.write_file("empty.mkv", b"")))
+        self.assertIsNone(probe_file(self.write_file("text.mkv", b"not a video")))
+
+        truncated = MKV_HEADER + ebml(containers.MKV_SEGMENT, MKV_INFO, MKV_TRACKS)
+        info = probe_file(self.write_file("short.mkv", truncated[:-30]))
+        self.assertEqual((info["duration"], info["tracks"]), (5400.0, []))
+        self.assertIsNone(probe_file(self.write_file("short.mp4", mp4_file()[:-30])))
+
+
+class ContainerMetadataParserTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_container_metadata(self):
+        self.assertEqual(
+            container_metadata(
+                {
+                    "container": "mkv",
+                    "duration": 5430.0,
+                    "tracks": [
+                        {
+                            "type": "video",
+                            "codec": "H.265",
+                            "width": 1920,
+                            "height": 800,
+                        },
+                        {"type": "audio", "codec": "AAC", "language": "jpn"},
+                        {"type": "audio", "codec": "AC3", "language": "eng"},
+                        {"type": "audio", "codec": "AC3", "language": "eng"},
+                    ],
+                }
+            ),
+            {
+                "metadata": {"duration": 90},
+                "metadata:mediainfo": {
+                    "container": "mkv",
+                    "codec": "H.265",
+                    "resolution": "1080p",
+                    "audio": "AAC",
+                    "audio_languages": ["jpn", "eng"],
+                    "dual_audio": True,
+                },
+            },
+        )
+
+        self.assertEqual(
+            container_metadata({"container": "mp4", "tracks": []}),
+            {"metadata:mediainfo": {"container": "mp4"}},
+        )
+
+    def test_handle(self):
+        path = os.path.join(self.temp_path, "movie.mp4")
+        with open(path, "wb") as f:
+            f.write(mp4_file())
+
+        vfs = mock.Mock()
+        for processes in [0, 1]:
+            plugin = ContainerMetadataParserPlugin({"processes": processes})
+            self.assertTrue(plugin.pattern.match("movie.mp4"))
+            plugin.handle(vfs, "/movie.mp4", path)
+            plugin.unload()
+
+            vfs.update_metadata.assert_called_with(
+                DatabaseType.FILE,
+                "/movie.mp4",
+                {
+                    "metadata": {"duration": 25},
+                    "metadata:mediainfo": {
+                        "container": "mp4",
+                        "codec": "H.264",
+                        "resolution": "720p",
+                        "audio": "AAC",
+                        "audio_languages": ["eng", "ger"],
+                        "dual_audio": True,
+                    },
+                },
+            )
+
+
+class EmbeddedMetadataHandlerTest(TestCase):
+    def test_link_audio_languages(self):
+        root = ListingItem.objects.create(
+            app="movies", path="section", datetime=now(), is_root=True
+        )
+        listingitems = {}
+        item_creation_mapping = {}
+        for name, languages in [("dual", ["jpn", "eng"]), ("single", ["eng"])]:
+            path = f"section/{name}"
+            listingitems[path] = ListingItem.objects.create(
+                app="movies", path=path, datetime=now(), parent=root
+            )
+            item_creation_mapping[path] = Item(
+                id=name,
+                attributes={"metadata:mediainfo": {"audio_languages": languages}},
+            )
+
+        listing_build = ListingBuild()
+        listing_build.listing_item_root = root
+        listing_build.item_creation_mapping = item_creation_mapping
+        listing_build.listingitem_mapping = listingitems
+
+        plugin = EmbeddedMetadataHandlerPlugin({})
+        plugin.link_metadata_listingitems(listing_build)
+
+        relation = ListingItemRelation.objects.get(
+            listingitem=listingitems["section/dual"]
+        )
+        self.assertEqual(relation.metadata.mediainfo_audio_languages, ["jpn", "eng"])
+
+        relations = EmbeddedInfoFilter(
+            {"audio_language": "jpn"}, queryset=ListingItemRelation.objects.all()
+        ).qs
+        self.assertEqual(
+            [r.listingitem.path for r in relations], ["section/dual"],
+        )
@@ -1,7 +1,6 @@
 import logging
 
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
 from rest_framework import serializers
 
 from ...bases.metadata.linkingmetadata import LinkingMetadataHandlerPlugin
@@ -39,7 +38,6 @@ class FirstSeenMetadataHandlerPlugin(LinkingMetadataHandlerPlugin):
     metadata_embed_method = "relate"
 
     def link_metadata_listingitems(self, listing_build, fetch_metadata=True):
-        listing_item_root = listing_build.listing_item_root
         linkable_metadata = listing_build.linkable_metadata
 
         logger.info(f"Linking with metadata:{linkable_metadata!r}")
@@ -47,8 +45,7 @@ class FirstSeenMetadataHandlerPlugin(LinkingMetadataHandlerPlugin):
             content_type = ContentType.objects.get_for_model(p.model)
 
             base_qs = p.listing_item_relation_model.objects.filter(
-                Q(listingitem__parent=listing_item_root)
-                | Q(listingitem=listing_item_root)
+                listing_build.listingitem_q("listingitem__")
             )
             existing_items = self.metadata_link_model.objects.filter(
                 content_type=content_type, object_id__in=base_qs.values("metadata_id")
@@ -1,6 +1,6 @@
 from .bittorrentclient import BittorrentClientPlugin  # NOQA
 from .config import ConfigPlugin  # NOQA
-from .db import DatabaseCacheLayer, DatabasePlugin  # NOQA
+from .db import DatabaseCacheLayer, DatabasePlugin, DatabaseSchema  # NOQA
 from .history import HistoryPlugin  # NOQA
 from .imagecache import ImageCachePlugin  # NOQA
 from .indexer import IndexerPlugin, PathIndexer  # NOQA
@@ -1,14 +1,79 @@
 import os
+import sys
 from abc import abstractmethod
-from collections import MutableMapping
+from bisect import bisect_left, bisect_right
+from collections import MutableMapping, OrderedDict
 
 from django.conf import settings
-from unplugged import PluginBase
+from unplugged import PluginBase, Schema, fields
+
+from ..dbcodecs import ValueCodec
+
+
+def scan_start(prefix, start):
+    """The first key a scan with prefix and start can return"""
+    if start is None:
+        return prefix
+    return max(prefix, start)
+
+
+def in_scan_range(key, prefix, end):
+    """Checks a key, not smaller than scan_start, is part of a scan"""
+    return key.startswith(prefix) and (end is None or key < end)
+
+
+class SortedKeyIndex:
+    """
+    The keys of a database kept in order, for databases that cannot iterate their keys in order.
+    """
+
+    def __init__(self, keys=()):
+        self._keys = sorted(keys)
+
+    def add(self, key):
+        i = bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            self._keys.insert(i, key)
+
+    def discard(self, key):
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+    def clear(self):
+        del self._keys[:]
+
+    def scan(self, prefix="", start=None, end=None):
+        """
+        Yields the keys of a scan in order, keys can be added and removed while scanning.
+        """
+        keys = self._keys
+        i = bisect_left(keys, scan_start(prefix, start))
+        while i < len(keys):
+            key = keys[i]
+            if not in_scan_range(key, prefix, end):
+                break
+
+            yield key
+            i = bisect_right(keys, key)
+
+
+class DatabaseSchema(Schema):
+    codec = fields.String(default="pickle")
 
 
 class DatabasePlugin(PluginBase, MutableMapping):
     plugin_type = "database"
 
+    codec = ValueCodec()
+
+    # keys are strings of characters below 256, e.g. the binary vfs keys,
+    # and are stored as one byte per character
+    key_encoding = "latin-1"
+
+    # databases that cannot iterate their keys in order maintain a SortedKeyIndex to scan
+    key_index = None
+
     @abstractmethod
     def sync(self):
         """
@@ -21,6 +86,70 @@ class DatabasePlugin(PluginBase, MutableMapping):
         Close the database
         """
 
+    def get_many(self, keys):
+        """
+        Returns a dict with the values of the keys found in the database.
+        """
+        result = {}
+        for key in keys:
+            try:
+                result[key] = self[key]
+            except KeyError:
+                pass
+
+        return result
+
+    def put_many(self, items):
+        """
+        Store all key/value pairs in a dict in one operation, when the database supports it.
+        """
+        for key, value in items.items():
+            self[key] = value
+
+    def delete_many(self, keys):
+        """
+        Delete all keys in one operation, when the database supports it. Missing keys are ignored.
+        """
+        for key in keys:
+            try:
+                del self[key]
+            except KeyError:
+                pass
+
+    def write_many(self, items, delete_keys):
+        """
+        Store items and delete keys together, in one transaction when the database supports it.
+        """
+        if items:
+            self.put_many(items)
+
+        if delete_keys:
+            self.delete_many(delete_keys)
+
+    def scan(self, prefix="", start=None, end=None):
+        """
+        Yields (key, value) ordered by key for the keys starting with prefix,
+        from start and up to, but not including, end.
+        """
+        if self.key_index is None:
+            raise NotImplementedError(f"{self!r} does not support ordered scans")
+
+        for key in self.key_index.scan(prefix, start, end):
+            try:
+                value = self[key]
+            except KeyError:  # removed while scanning
+                continue
+            yield key, value
+
+    def setup_codec(self, config, path):
+        """
+        Use the codec from the config to encode values, values are always decoded
+        with the codec they were written with.
+        """
+        self.codec = ValueCodec(
+            config.get("codec", "pickle"), os.path.join(path, "values.zstd-dict")
+        )
+
     def get_database_path(self, path):
         """Turn a relative into an absolute path and make sure it exists"""
         if not os.path.isabs(path):
@@ -33,62 +162,190 @@ class DatabasePlugin(PluginBase, MutableMapping):
 
 
 class DatabaseCacheLayer(MutableMapping):
-    """Caches the communication with the actual database plugin"""
+    """
+    Caches the communication with the actual database plugin.
 
-    def __init__(self, db):
+    Changes are kept until sync. Without max_size everything read is cached until sync,
+    with max_size the least recently used unchanged entries are evicted
+    when there are more than max_size of them and they survive sync.
+
+    The memory used by the changes is estimated from the shallow size of the
+    keys and values, nested values are not followed.
+    """
+
+    def __init__(self, db, max_size=None):
         self._db = db
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
         self._clear()
 
+    @property
+    def backend(self):
+        """
+        The database plugin itself, reads from it only see flushed changes and
+        do not touch the cache, so other threads can read while the cache is written.
+        """
+        return self._db
+
     def _clear(self):
-        self._cache_tainted = set()
-        self._cache = {}
+        self._cache = OrderedDict()
+        self._dirty = {}
         self._cache_delete = set()
+        self.dirty_bytes = 0
+
+    def _add_to_cache(self, key, value):
+        self._cache[key] = value
+        if self.max_size is not None:
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
 
     def __getitem__(self, key):
         if key in self._cache_delete:
             raise KeyError(key)
 
-        if key not in self._cache:
-            self._cache[key] = self._db[key]
+        if key in self._dirty:
+            self.hits += 1
+            return self._dirty[key]
+
+        if key in self._cache:
+            self.hits += 1
+            if self.max_size is not None:
+                self._cache.move_to_end(key)
+            return self._cache[key]
 
-        return self._cache[key]
+        self.misses += 1
+        value = self._db[key]
+        self._add_to_cache(key, value)
+        return value
 
     def __setitem__(self, key, value):
-        self._cache_delete.discard(key)
-        self._cache_tainted.add(key)
-        self._cache[key] = value
+        if key in self._dirty:
+            self.dirty_bytes -= sys.getsizeof(self._dirty[key])
+        elif key in self._cache_delete:
+            self._cache_delete.remove(key)
+        else:
+            self.dirty_bytes += sys.getsizeof(key)
+        self.dirty_bytes += sys.getsizeof(value)
 
-    def __delitem__(self, key):
-        if key in self._cache:
-            del self._cache[key]
+        self._cache.pop(key, None)
+        self._dirty[key] = value
 
-        self._cache_tainted.discard(key)
+    def __delitem__(self, key):
+        self._cache.pop(key, None)
+        if key in self._dirty:
+            self.dirty_bytes -= sys.getsizeof(self._dirty.pop(key))
+        elif key not in self._cache_delete:
+            self.dirty_bytes += sys.getsizeof(key)
         self._cache_delete.add(key)
 
     def __iter__(self):
-        return self._db.__iter__()
+        dirty_seen = set()
+        for key in self._db:
+            if key in self._cache_delete:
+                continue
+
+            if key in self._dirty:
+                dirty_seen.add(key)
+            yield key
+
+        for key in list(self._dirty):
+            if key not in dirty_seen:
+                yield key
+
+    def scan(self, prefix="", start=None, end=None):
+        """
+        Scans the database with the uncommitted changes merged in.
+        """
+        lower = scan_start(prefix, start)
+        dirty = sorted(
+            (key, value)
+            for key, value in self._dirty.items()
+            if key >= lower and in_scan_range(key, prefix, end)
+        )
+        deleted = set(self._cache_delete)
+
+        i = 0
+        for key, value in self._db.scan(prefix, start, end):
+            while i < len(dirty) and dirty[i][0] < key:
+                yield dirty[i]
+                i += 1
+
+            if i < len(dirty) and dirty[i][0] == key:
+                yield dirty[i]
+                i += 1
+            elif key not in deleted:
+                yield key, value
+
+        yield from dirty[i:]
+
+    def get_many(self, keys):
+        result, missing_keys = {}, []
+        for key in keys:
+            if key in self._cache_delete:
+                continue
+
+            if key in self._dirty:
+                result[key] = self._dirty[key]
+            elif key in self._cache:
+                result[key] = self._cache[key]
+            else:
+                missing_keys.append(key)
+
+        self.hits += len(result)
+        if missing_keys:
+            self.misses += len(missing_keys)
+            found = self._db.get_many(missing_keys)
+            for key, value in found.items():
+                self._add_to_cache(key, value)
+            result.update(found)
+
+        return result
+
+    def put_many(self, items):
+        for key, value in items.items():
+            self[key] = value
+
+    def delete_many(self, keys):
+        for key in keys:
+            del self[key]
 
     def keys(self):
-        keys = self._db.keys()
-        keys += [k for k in self._cache.keys() if k not in set(keys)]
-        return keys
+        return [key for key in self]
 
     def __len__(self):
         return self._db.__len__()
 
     def __contains__(self, key):
         return key not in self._cache_delete and (
-            key in self._cache or self._db.__contains__(key)
+            key in self._dirty or key in self._cache or self._db.__contains__(key)
         )
 
-    def _flush_cache(self):
-        for k in self._cache_tainted:
-            self._db[k] = self._cache[k]
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "cached": len(self._cache),
+            "dirty": len(self._dirty),
+            "dirty_bytes": self.dirty_bytes,
+            "max_size": self.max_size,
+        }
 
-        for k in self._cache_delete:
-            del self._db[k]
+    def _flush_cache(self):
+        if self._dirty or self._cache_delete:
+            self._db.write_many(self._dirty, self._cache_delete)
 
-        self._clear()
+        if self.max_size is None:
+            self._clear()
+        else:
+            dirty, self._dirty, self._cache_delete = self._dirty, {}, set()
+            self.dirty_bytes = 0
+            for key, value in dirty.items():
+                self._add_to_cache(key, value)
 
     def sync(self):
         self._flush_cache()
@@ -37,6 +37,10 @@ def _listing_cache_key(prefix, plugin, path, depth):
 
 
 class InputPluginManager:
+    # list routes whose handlers also take after and limit and then list a page of
+    # the items directly below the path, ordered by the utf-8 bytes of their names
+    paged_list_routes = set()
+
     @staticmethod
     def get_item_multiple(
         plugin_path_pairs,
@@ -8,6 +8,8 @@ from .ws import PlayerConsumer
 
 logger = logging.getLogger(__name__)
 
+IDLE_PLAYER_STATES = ["stopped", "paused"]
+
 
 def inject_into_scope(func, extra_scope):
     @functools.wraps(func)
@@ -42,6 +44,16 @@ class PlayerServicePlugin(ServicePlugin):
 
         return self.player_coordinators[user]
 
+    def is_playing(self):
+        """
+        Checks if a player of any user is playing something right now.
+        """
+        for player_coordinator in list(self.player_coordinators.values()):
+            for player in list(player_coordinator.players.values()):
+                if player.state not in IDLE_PLAYER_STATES:
+                    return True
+        return False
+
     def play(self, payload, viewstate, player_id):
         logger.debug(f"Sending play to player_id:{player_id} user:{viewstate.user!r}")
         player_coordinator = self.get_player_coordinator(viewstate.user)
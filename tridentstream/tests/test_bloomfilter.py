@@ -0,0 +1,34 @@
+import unittest
+
+from ..bloomfilter import BloomFilter
+
+
+class BloomFilterTestCase(unittest.TestCase):
+    def test_no_false_negatives(self):
+        bloom_filter = BloomFilter(capacity=100)
+        keys = [f"\x00key {i}" for i in range(1000)]
+        for key in keys:
+            bloom_filter.add(key)
+
+        self.assertGreater(len(bloom_filter), 980)
+        self.assertGreater(len(bloom_filter.filters), 1)
+        self.assertTrue(all(key in bloom_filter for key in keys))
+
+    def test_false_positive_rate(self):
+        bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom_filter.add(f"\x00key {i}")
+
+        false_positives = sum(f"\x01key {i}" in bloom_filter for i in range(10000))
+        self.assertLess(false_positives / 10000, 0.03)
+        self.assertLess(bloom_filter.expected_false_positive_rate(), 0.02)
+
+    def test_serialize(self):
+        bloom_filter = BloomFilter(capacity=10)
+        for i in range(50):
+            bloom_filter.add(f"\x00key {i}")
+
+        items = len(bloom_filter)
+        bloom_filter = BloomFilter.deserialize(bloom_filter.serialize())
+        self.assertEqual(len(bloom_filter), items)
+        self.assertTrue(all(f"\x00key {i}" in bloom_filter for i in range(50)))
@@ -0,0 +1,89 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from .. import dbcodecs
+from ..dbcodecs import (
+    MARKER_MSGPACK,
+    MARKER_MSGPACK_ZLIB,
+    MARKER_MSGPACK_ZSTD,
+    ValueCodec,
+)
+
+
+@unittest.skipIf(dbcodecs.msgpack is None, "msgpack not installed")
+class ValueCodecTestCase(unittest.TestCase):
+    value = {
+        "path": "some folder/some file.mkv",
+        "date": 1500000000,
+        "modified": 1500000010,
+        "size": 123456789,
+        "_actual_path": "/mnt/storage/some folder/some file.mkv",
+        "metadata:something": {"tuple": (1, 2), "set": {"a", "b"}, "none": None},
+        "when": datetime(2020, 1, 2, 3, 4, 5),
+    }
+
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.dictionary_path = os.path.join(self.temp_path, "values.zstd-dict")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_roundtrip(self):
+        for name in dbcodecs.CODECS:
+            if name == "msgpack-zstd" and dbcodecs.zstandard is None:
+                continue
+
+            codec = ValueCodec(name, self.dictionary_path)
+            for value in [self.value, set([1, 2]), b"\x00\xff", "text", 5, None]:
+                self.assertEqual(codec.decode(codec.encode(value)), value, name)
+
+    def test_markers(self):
+        self.assertEqual(ValueCodec("msgpack").encode(self.value)[:1], MARKER_MSGPACK)
+        self.assertEqual(
+            ValueCodec("msgpack-zlib").encode(self.value)[:1], MARKER_MSGPACK_ZLIB
+        )
+        self.assertEqual(ValueCodec("msgpack-zlib").encode(1)[:1], MARKER_MSGPACK)
+
+    def test_decode_any_codec(self):
+        codec = ValueCodec("pickle")
+        self.assertEqual(codec.decode(pickle.dumps(self.value)), self.value)
+        self.assertEqual(
+            codec.decode(ValueCodec("msgpack-zlib").encode(self.value)), self.value
+        )
+        self.assertEqual(
+            ValueCodec("msgpack").decode(codec.encode(self.value)), self.value
+        )
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, ValueCodec, "json")
+
+    @unittest.skipIf(dbcodecs.zstandard is None, "zstandard not installed")
+    def test_zstd_dictionary(self):
+        values = []
+        for i in range(200):
+            value = dict(self.value)
+            value["path"] = f"some folder {i % 13}/episode {i}.mkv"
+            value["_actual_path"] = f"/mnt/storage/{value['path']}"
+            value["size"] = i * 1000
+            values.append(value)
+
+        codec = ValueCodec("msgpack-zstd", self.dictionary_path)
+        with mock.patch.object(dbcodecs, "ZSTD_TRAINING_SAMPLES", len(values)):
+            encoded = [codec.encode(value) for value in values]
+
+        self.assertTrue(all(data[:1] == MARKER_MSGPACK for data in encoded))
+        self.assertIsNotNone(codec.dictionary)
+        self.assertTrue(os.path.isfile(self.dictionary_path))
+
+        data = codec.encode(values[0])
+        self.assertEqual(data[:1], MARKER_MSGPACK_ZSTD)
+        self.assertLess(len(data), len(encoded[0]))
+
+        codec = ValueCodec("msgpack", self.dictionary_path)
+        self.assertEqual(codec.decode(data), values[0])
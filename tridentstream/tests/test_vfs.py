@@ -1,17 +1,35 @@
 import time
 import unittest
+from unittest import mock
 
 from freezegun import freeze_time
 
+from ..exceptions import PathNotFoundException
 from ..testutils import debugdict
-from ..vfs import GC_DELETED_FILES, DatabaseType, FileSystem
+from ..vfs import (
+    AGGREGATES_KEY,
+    BINARY_KEY_LENGTH,
+    BLOOM_FILTER_KEY,
+    CHILD_INDEX_KEY,
+    FILE_INDEX_KEY,
+    GC_DELETED_FILES,
+    HEX_KEY_LENGTH,
+    KEY_FORMAT_BINARY,
+    KEY_FORMAT_HEX,
+    KEY_FORMAT_KEY,
+    TOMBSTONES_INDEXED_KEY,
+    AlreadyInSessionException,
+    DatabaseType,
+    FileSystem,
+)
 
 
 class VirtualFileSystemTestCase(unittest.TestCase):
     maxDiff = None
+    filesystem_options = {}
 
     def setUp(self):
-        self.fs = FileSystem(debugdict())
+        self.fs = FileSystem(debugdict(), **self.filesystem_options)
 
         self.events_called = {"new": [], "deleted": [], "db_closed": []}
 
@@ -39,7 +57,14 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         listing = self.fs.list_dir("", depth=1).serialize()
         expected_listing = {
             "id": "",
-            "attributes": {"date": 0, "path": "", "modified": 30},
+            "attributes": {
+                "file_count": 2,
+                "total_size": 40,
+                "newest_modified": 30,
+                "date": 0,
+                "path": "",
+                "modified": 30,
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -47,6 +72,9 @@ class VirtualFileSystemTestCase(unittest.TestCase):
                 {
                     "id": "important stuff",
                     "attributes": {
+                        "file_count": 1,
+                        "total_size": 20,
+                        "newest_modified": 30,
                         "modified": 30,
                         "date": 20,
                         "path": "important stuff",
@@ -95,7 +123,14 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         listing = self.fs.list_dir("", depth=1).serialize()
         expected_listing = {
             "id": "",
-            "attributes": {"date": 0, "path": "", "modified": 500},
+            "attributes": {
+                "file_count": 0,
+                "total_size": 0,
+                "newest_modified": 30,
+                "date": 0,
+                "path": "",
+                "modified": 500,
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -115,6 +150,9 @@ class VirtualFileSystemTestCase(unittest.TestCase):
                 {
                     "id": "important stuff",
                     "attributes": {
+                        "file_count": 0,
+                        "total_size": 0,
+                        "newest_modified": 30,
                         "modified": 500,
                         "date": 20,
                         "path": "important stuff",
@@ -137,7 +175,14 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         listing = self.fs.list_dir("", depth=0).serialize()
         expected_listing = {
             "id": "",
-            "attributes": {"date": 0, "path": "", "modified": 30},
+            "attributes": {
+                "file_count": 1,
+                "total_size": 20,
+                "newest_modified": 20,
+                "date": 0,
+                "path": "",
+                "modified": 30,
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -145,6 +190,9 @@ class VirtualFileSystemTestCase(unittest.TestCase):
                 {
                     "id": "important stuff",
                     "attributes": {
+                        "file_count": 1,
+                        "total_size": 20,
+                        "newest_modified": 20,
                         "modified": 30,
                         "date": 10,
                         "path": "important stuff",
@@ -164,7 +212,14 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         listing = self.fs.list_dir("", depth=0).serialize()
         expected_listing = {
             "id": "",
-            "attributes": {"date": 0, "path": "", "modified": 40},
+            "attributes": {
+                "file_count": 1,
+                "total_size": 20,
+                "newest_modified": 20,
+                "date": 0,
+                "path": "",
+                "modified": 40,
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -172,6 +227,9 @@ class VirtualFileSystemTestCase(unittest.TestCase):
                 {
                     "id": "important stuff",
                     "attributes": {
+                        "file_count": 1,
+                        "total_size": 20,
+                        "newest_modified": 20,
                         "modified": 40,
                         "date": 10,
                         "path": "important stuff",
@@ -193,7 +251,14 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         listing = self.fs.list_dir("", depth=0).serialize()
         expected_listing = {
             "id": "",
-            "attributes": {"date": 0, "path": "", "modified": 50},
+            "attributes": {
+                "file_count": 2,
+                "total_size": 40,
+                "newest_modified": 50,
+                "date": 0,
+                "path": "",
+                "modified": 50,
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -201,6 +266,9 @@ class VirtualFileSystemTestCase(unittest.TestCase):
                 {
                     "id": "important stuff",
                     "attributes": {
+                        "file_count": 2,
+                        "total_size": 40,
+                        "newest_modified": 50,
                         "modified": 50,
                         "date": 10,
                         "path": "important stuff",
@@ -237,7 +305,14 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         listing = self.fs.list_dir("", depth=0).serialize()
         expected_listing = {
             "id": "",
-            "attributes": {"date": 0, "path": "", "modified": 60},
+            "attributes": {
+                "file_count": 2,
+                "total_size": 40,
+                "newest_modified": 60,
+                "date": 0,
+                "path": "",
+                "modified": 60,
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -245,6 +320,9 @@ class VirtualFileSystemTestCase(unittest.TestCase):
                 {
                     "id": "important stuff",
                     "attributes": {
+                        "file_count": 2,
+                        "total_size": 40,
+                        "newest_modified": 60,
                         "modified": 60,
                         "date": 10,
                         "path": "important stuff",
@@ -286,6 +364,9 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         expected_listing = {
             "id": "metadata folder",
             "attributes": {
+                "file_count": 1,
+                "total_size": 20,
+                "newest_modified": 20,
                 "date": 10,
                 "path": "metadata folder",
                 "1": 2,
@@ -359,6 +440,9 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         expected_listing = {
             "id": "metadata folder",
             "attributes": {
+                "file_count": 1,
+                "total_size": 20,
+                "newest_modified": 20,
                 "1": 3,
                 "date": 10,
                 "list": [1, 2, 4],
@@ -409,6 +493,9 @@ class VirtualFileSystemTestCase(unittest.TestCase):
             "new": "value2",
             "path": "metadata folder",
             "test": "metadata2",
+            "file_count": 1,
+            "total_size": 20,
+            "newest_modified": 20,
         }
         self.assertEqual(metadata, expected_metadata)
 
@@ -420,7 +507,14 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         listing = self.fs.list_dir("folder", depth=0).serialize()
         expected_listing = {
             "id": "folder",
-            "attributes": {"modified": 20, "date": 10, "path": "folder"},
+            "attributes": {
+                "file_count": 1,
+                "total_size": 20,
+                "newest_modified": 20,
+                "modified": 20,
+                "date": 10,
+                "path": "folder",
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -455,7 +549,14 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         listing = self.fs.list_dir("folder", depth=0).serialize()
         expected_listing = {
             "id": "folder",
-            "attributes": {"modified": 500, "date": 10, "path": "folder"},
+            "attributes": {
+                "file_count": 0,
+                "total_size": 0,
+                "newest_modified": 20,
+                "modified": 500,
+                "date": 10,
+                "path": "folder",
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -466,7 +567,14 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         listing = self.fs.list_dir("folder", depth=0, show_deleted=True).serialize()
         expected_listing = {
             "id": "folder",
-            "attributes": {"modified": 500, "date": 10, "path": "folder"},
+            "attributes": {
+                "file_count": 0,
+                "total_size": 0,
+                "newest_modified": 20,
+                "modified": 500,
+                "date": 10,
+                "path": "folder",
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -496,7 +604,14 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         listing = self.fs.list_dir("folder", depth=0).serialize()
         expected_listing = {
             "id": "folder",
-            "attributes": {"modified": 600, "date": 10, "path": "folder"},
+            "attributes": {
+                "file_count": 1,
+                "total_size": 20,
+                "newest_modified": 600,
+                "modified": 600,
+                "date": 10,
+                "path": "folder",
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -527,7 +642,14 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         listing = self.fs.list_dir("folder", depth=0, show_deleted=True).serialize()
         expected_listing = {
             "id": "folder",
-            "attributes": {"modified": 600, "date": 10, "path": "folder"},
+            "attributes": {
+                "file_count": 0,
+                "total_size": 0,
+                "newest_modified": 600,
+                "modified": 600,
+                "date": 10,
+                "path": "folder",
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -553,10 +675,23 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         with self.fs.session(True, current_time=500 + GC_DELETED_FILES + 100):
             self.fs.add_dir("folder", 10)
 
+        listing = self.fs.list_dir("folder", depth=0, show_deleted=True).serialize()
+        self.assertEqual(len(listing["nested_items"]), 1)
+
+        while self.fs.compact(current_time=500 + GC_DELETED_FILES + 100):
+            pass
+
         listing = self.fs.list_dir("folder", depth=0, show_deleted=True).serialize()
         expected_listing = {
             "id": "folder",
-            "attributes": {"modified": 600, "date": 10, "path": "folder"},
+            "attributes": {
+                "file_count": 0,
+                "total_size": 0,
+                "newest_modified": 600,
+                "modified": 600,
+                "date": 10,
+                "path": "folder",
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -592,7 +727,14 @@ class VirtualFileSystemTestCase(unittest.TestCase):
             [m for (_, _, m) in self.events_called["new"]], key=lambda x: x["path"]
         )
         expected_events = [
-            {"date": 10, "modified": 20, "path": "folder"},
+            {
+                "date": 10,
+                "modified": 20,
+                "path": "folder",
+                "file_count": 1,
+                "total_size": 20,
+                "newest_modified": 20,
+            },
             {"date": 20, "modified": 20, "path": "folder/file", "size": 20},
         ]
         self.assertEqual(events, expected_events)
@@ -666,7 +808,13 @@ class VirtualFileSystemTestCase(unittest.TestCase):
         listing = self.fs.list_dir("", depth=0).serialize(include_routes=True)
         expected_listing = {
             "id": "",
-            "attributes": {"date": 0, "path": ""},
+            "attributes": {
+                "file_count": 1,
+                "total_size": 0,
+                "newest_modified": 0,
+                "date": 0,
+                "path": "",
+            },
             "readable": False,
             "streamable": False,
             "expandable": False,
@@ -767,3 +915,570 @@ class VirtualFileSystemTestCase(unittest.TestCase):
 
         metadata = self.fs.get_metadata(DatabaseType.DIRECTORY, "folder")
         self.assertEqual(metadata.get("this"), "works")
+
+    def test_remove_path(self):
+        with self.fs.session(current_time=500):
+            self.fs.add_dir("parent", 10)
+            self.fs.add_dir("parent/folder", 10)
+            self.fs.add_file("parent/folder/file", 20, 20)
+            self.fs.add_file("parent/other file", 20, 20)
+
+        self.events_called["new"] = []
+
+        with self.fs.session(current_time=600):
+            self.fs.remove_path("parent/folder")
+
+        events = sorted(m["path"] for (_, _, m) in self.events_called["deleted"])
+        self.assertEqual(events, ["parent/folder", "parent/folder/file"])
+        self.assertEqual(len(self.events_called["new"]), 0)
+
+        listing = self.fs.list_dir("parent", depth=1).serialize()
+        self.assertEqual(
+            [item["id"] for item in listing["nested_items"]], ["other file"]
+        )
+        self.assertEqual(listing["attributes"]["modified"], 600)
+
+        with self.fs.session(current_time=700):
+            self.fs.add_dir("parent/folder", 700)
+
+        events = sorted(m["path"] for (_, _, m) in self.events_called["new"])
+        self.assertEqual(events, ["parent/folder"])
+
+    def test_migrate_key_format(self):
+        db = debugdict()
+        fs = FileSystem(db, key_format=KEY_FORMAT_HEX)
+        with fs.session(True, current_time=500):
+            fs.add_dir("folder", 10)
+            fs.add_file("folder/file", 20, 20)
+            fs.add_file("other file", 20, 30)
+
+        with fs.session(True, current_time=600):
+            fs.add_dir("folder", 10)
+            fs.add_file("other file", 20, 30)
+
+        self.assertEqual(fs.key_format, KEY_FORMAT_HEX)
+        expected_listing = fs.list_dir("", depth=2, show_deleted=True).serialize()
+        self.assertTrue(
+            any(len(key) == HEX_KEY_LENGTH for key in db if key[0] == DatabaseType.FILE)
+        )
+
+        del db[KEY_FORMAT_KEY]  # databases from before the key format was stored
+        fs = FileSystem(db)
+        self.assertEqual(fs.key_format, KEY_FORMAT_BINARY)
+        self.assertEqual(
+            fs.list_dir("", depth=2, show_deleted=True).serialize(), expected_listing
+        )
+        self.assertFalse(any(len(key) == HEX_KEY_LENGTH for key in db))
+
+        for key, value in db.items():
+            if key[0] in (DatabaseType.BUCKET, DatabaseType.FILELIST):
+                self.assertIsInstance(value, bytes)
+                self.assertEqual(len(value) % BINARY_KEY_LENGTH, 0)
+
+        events_called = {"new": [], "deleted": []}
+        fs.add_event("new", lambda **kwargs: events_called["new"].append(kwargs))
+        fs.add_event(
+            "deleted", lambda **kwargs: events_called["deleted"].append(kwargs)
+        )
+        with fs.session(True, current_time=700):
+            fs.add_dir("folder", 10)
+            fs.add_file("other file", 20, 30)
+
+        self.assertEqual(events_called, {"new": [], "deleted": []})
+
+    def test_iter_items(self):
+        with self.fs.session(True, current_time=500):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file", 20, 20)
+            self.fs.add_file("other file", 20, 30)
+
+        with self.fs.session(True, current_time=600):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file", 20, 20)
+
+        self.assertEqual(
+            [m["path"] for m in self.fs.iter_items(DatabaseType.FILE)], ["folder/file"]
+        )
+        self.assertEqual(
+            sorted(
+                m["path"]
+                for m in self.fs.iter_items(DatabaseType.FILE, show_deleted=True)
+            ),
+            ["folder/file", "other file"],
+        )
+        self.assertEqual(
+            sorted(m["path"] for m in self.fs.iter_items(DatabaseType.DIRECTORY)),
+            ["", "folder"],
+        )
+
+    def test_reader(self):
+        with self.fs.session(True, current_time=500):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file", 20, 20)
+            self.fs.set_directory_state("folder", {"mtime": 10, "children": 1})
+
+        reader = self.fs.reader()
+        with self.fs.session(current_time=600):
+            self.fs.add_file("folder/other file", 30, 30)
+            self.fs.set_directory_state("folder", {"mtime": 20, "children": 2})
+
+            cache_stats = self.fs.db.stats()
+            self.assertEqual(
+                reader.get_directory_state("folder"), {"mtime": 10, "children": 1}
+            )
+            self.assertEqual(
+                [
+                    (db_type, metadata["path"])
+                    for db_type, metadata in reader.list_children("folder")
+                ],
+                [(DatabaseType.FILE, "folder/file")],
+            )
+            self.assertEqual(
+                (self.fs.db.stats()["hits"], self.fs.db.stats()["misses"]),
+                (cache_stats["hits"], cache_stats["misses"]),
+            )
+
+        self.assertEqual(
+            reader.get_directory_state("folder"), {"mtime": 20, "children": 2}
+        )
+        self.assertEqual(len(reader.list_children("folder")), 2)
+        self.assertRaises(PathNotFoundException, reader.list_children, "missing")
+
+    def test_compact(self):
+        with self.fs.session(True, current_time=500):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file 1", 20, 20)
+            self.fs.add_file("folder/file 2", 20, 20)
+            self.fs.add_dir("folder/subfolder", 10)
+            self.fs.add_file("folder/subfolder/file", 20, 20)
+            self.fs.add_file("other file", 20, 30)
+
+        with self.fs.session(True, current_time=600):
+            self.fs.add_file("other file", 20, 30)
+
+        with self.fs.session(True, current_time=700):
+            self.fs.add_file("other file", 20, 30)
+            self.fs.add_dir("new folder", 10)
+
+        key_count = len(self.fs.db)
+        self.assertFalse(self.fs.compact(current_time=600 + GC_DELETED_FILES - 100))
+        self.assertEqual(len(self.fs.db), key_count)
+
+        def deleted_count():
+            return sum(
+                1
+                for db_type in (DatabaseType.FILE, DatabaseType.DIRECTORY)
+                for m in self.fs.iter_items(db_type, show_deleted=True)
+                if "deleted" in m
+            )
+
+        self.assertEqual(deleted_count(), 5)
+        self.assertTrue(
+            self.fs.compact(current_time=600 + GC_DELETED_FILES + 100, batch_size=2)
+        )
+        self.assertEqual(deleted_count(), 3)
+
+        while self.fs.compact(current_time=600 + GC_DELETED_FILES + 100, batch_size=2):
+            pass
+
+        self.assertEqual(
+            sorted(
+                m["path"]
+                for m in self.fs.iter_items(DatabaseType.FILE, show_deleted=True)
+            ),
+            ["other file"],
+        )
+        self.assertEqual(
+            sorted(
+                m["path"]
+                for m in self.fs.iter_items(DatabaseType.DIRECTORY, show_deleted=True)
+            ),
+            ["", "new folder"],
+        )
+        listing = self.fs.list_dir("", depth=0, show_deleted=True).serialize()
+        self.assertEqual(
+            sorted(item["id"] for item in listing["nested_items"]),
+            ["new folder", "other file"],
+        )
+        self.assertFalse(any(key[0] == DatabaseType.TOMBSTONE for key in self.fs.db))
+
+    def test_compact_without_tombstones(self):
+        with self.fs.session(True, current_time=500):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file", 20, 20)
+
+        with self.fs.session(True, current_time=600):
+            pass
+
+        for key in list(self.fs.db):
+            if key[0] == DatabaseType.TOMBSTONE:
+                del self.fs.db[key]
+        del self.fs.db[TOMBSTONES_INDEXED_KEY]  # databases from before tombstones
+
+        with self.fs.session(True, current_time=700):
+            self.assertRaises(AlreadyInSessionException, self.fs.compact)
+
+        while self.fs.compact(current_time=600 + GC_DELETED_FILES + 100):
+            pass
+
+        self.assertEqual(
+            [
+                m["path"]
+                for m in self.fs.iter_items(DatabaseType.FILE, show_deleted=True)
+            ],
+            [],
+        )
+
+    def test_iter_dir(self):
+        with self.fs.session(True, current_time=500):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/b", 20, 30)
+            self.fs.add_file("folder/c", 20, 10)
+            self.fs.add_file("folder/a", 20, 20)
+            self.fs.add_dir("folder/d", 40)
+            self.fs.add_file("folder/d/e", 20, 20)
+            self.fs.add_file("folder/\xe6\xf8\xe5", 20, 50)
+
+        def ids(items):
+            return [item.id for item in items]
+
+        self.assertEqual(
+            ids(self.fs.iter_dir("folder")), ["a", "b", "c", "d", "\xe6\xf8\xe5"]
+        )
+        self.assertEqual(ids(self.fs.iter_dir("folder", 1, 2)), ["b", "c"])
+        self.assertEqual(ids(self.fs.iter_dir("folder", 4, 10)), ["\xe6\xf8\xe5"])
+        self.assertEqual(
+            ids(self.fs.iter_dir("folder", sort_key="date")),
+            ["c", "a", "b", "d", "\xe6\xf8\xe5"],
+        )
+        self.assertEqual(ids(self.fs.iter_dir("")), ["folder"])
+        self.assertEqual(ids(self.fs.iter_dir("folder/d")), ["e"])
+        self.assertRaises(ValueError, list, self.fs.iter_dir("folder", sort_key="size"))
+        self.assertRaises(PathNotFoundException, list, self.fs.iter_dir("missing"))
+
+        items = list(self.fs.iter_dir("folder", 2, 2))
+        self.assertTrue(items[0].readable)
+        self.assertTrue(items[1].expandable)
+        self.assertEqual(items[1]["path"], "folder/d")
+
+        listing = self.fs.list_dir("folder", depth=1, offset=3, limit=1).serialize()
+        self.assertEqual([item["id"] for item in listing["nested_items"]], ["d"])
+        self.assertEqual(
+            [item["id"] for item in listing["nested_items"][0]["nested_items"]], ["e"]
+        )
+
+        with self.fs.session(True, current_time=600):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/a", 20, 20)
+            self.fs.add_file("folder/c", 20, 10)
+
+        self.assertEqual(ids(self.fs.iter_dir("folder")), ["a", "c"])
+
+        with self.fs.session(current_time=700):
+            self.fs.add_file("folder/b", 20, 30)
+            self.fs.update_metadata(DatabaseType.FILE, "folder/c", {"date": 40})
+
+        self.assertEqual(ids(self.fs.iter_dir("folder")), ["a", "b", "c"])
+        self.assertEqual(
+            ids(self.fs.iter_dir("folder", sort_key="date")), ["a", "b", "c"]
+        )
+
+    def test_build_child_index(self):
+        with self.fs.session(True, current_time=500):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/b", 20, 30)
+            self.fs.add_file("folder/a", 20, 20)
+            self.fs.add_file("other file", 20, 20)
+
+        with self.fs.session(True, current_time=600):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/b", 20, 30)
+            self.fs.add_file("folder/a", 20, 20)
+
+        db = self.fs.db._db
+        for key in list(db):
+            if key[0] == DatabaseType.CHILD:
+                del db[key]
+        del db[CHILD_INDEX_KEY]  # databases from before the child index
+
+        fs = FileSystem(db)
+        self.assertEqual([item.id for item in fs.iter_dir("folder")], ["a", "b"])
+        self.assertEqual([item.id for item in fs.iter_dir("")], ["folder"])
+
+    def test_find_files(self):
+        with self.fs.session(True, current_time=500):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/a.mkv", 300, 30)
+            self.fs.add_file("folder/b.MKV", 100, 10)
+            self.fs.add_file("folder/c.mp4", 200, 20)
+            self.fs.add_file("d.mkv", 400, 40)
+            self.fs.add_file("e", 500, 50)
+
+        def paths(files):
+            return [m["path"] for m in files]
+
+        self.assertEqual(
+            paths(self.fs.find_files("extension", "mkv")),
+            ["folder/b.MKV", "folder/a.mkv", "d.mkv"],
+        )
+        self.assertEqual(
+            paths(self.fs.find_files("extension", "mkv", start=20, end=40)),
+            ["folder/a.mkv"],
+        )
+        self.assertEqual(paths(self.fs.find_files("extension", "")), ["e"])
+        self.assertEqual(
+            paths(self.fs.find_files("size", start=200, end=401)),
+            ["folder/c.mp4", "folder/a.mkv", "d.mkv"],
+        )
+        self.assertEqual(paths(self.fs.find_files("date", start=40)), ["d.mkv", "e"])
+        self.assertRaises(ValueError, list, self.fs.find_files("name"))
+        self.assertRaises(ValueError, list, self.fs.find_files("size", "mkv"))
+
+        with self.fs.session(True, current_time=600):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/a.mkv", 350, 30)
+            self.fs.add_file("folder/c.mp4", 200, 20)
+            self.fs.add_file("e", 500, 50)
+
+        self.assertEqual(
+            paths(self.fs.find_files("extension", "mkv")), ["folder/a.mkv"]
+        )
+        self.assertEqual(
+            paths(self.fs.find_files("size", start=300)), ["folder/a.mkv", "e"]
+        )
+
+        with self.fs.session(current_time=700):
+            self.fs.add_file("d.mkv", 400, 40)
+            self.fs.update_metadata(DatabaseType.FILE, "e", {"date": 5})
+
+        self.assertEqual(
+            paths(self.fs.find_files("date")),
+            ["e", "folder/c.mp4", "folder/a.mkv", "d.mkv"],
+        )
+
+        with self.fs.session(current_time=800):
+            self.fs.update_metadata(DatabaseType.FILE, "e", {"fingerprint": "abc"})
+            self.fs.update_metadata(DatabaseType.FILE, "d.mkv", {"fingerprint": "abc"})
+
+        self.assertEqual(
+            paths(self.fs.find_files("fingerprint", "abc")), ["e", "d.mkv"]
+        )
+        self.assertEqual(paths(self.fs.find_files("fingerprint", "ab")), [])
+
+        with self.fs.session(current_time=900):
+            self.fs.update_metadata(DatabaseType.FILE, "e", {"fingerprint": "abd"})
+
+        self.assertEqual(paths(self.fs.find_files("fingerprint", "abc")), ["d.mkv"])
+
+        db = self.fs.db._db
+        for key in list(db):
+            if key[0] == DatabaseType.INDEX:
+                del db[key]
+        del db[FILE_INDEX_KEY]  # databases from before the file indexes
+
+        fs = FileSystem(db)
+        self.assertEqual(
+            paths(fs.find_files("extension", "mkv")), ["folder/a.mkv", "d.mkv"]
+        )
+
+    def test_aggregates(self):
+        def aggregates(path):
+            m = self.fs.get_metadata(DatabaseType.DIRECTORY, path)
+            return m.get("file_count"), m.get("total_size"), m.get("newest_modified")
+
+        with self.fs.session(True, current_time=500):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file 1", 20, 20)
+            self.fs.add_dir("folder/subfolder", 10)
+            self.fs.add_file("folder/subfolder/file 2", 30, 40)
+            self.fs.add_file("other file", 50, 30)
+            self.fs.add_dir("empty folder", 10)
+
+        self.assertEqual(aggregates(""), (3, 100, 40))
+        self.assertEqual(aggregates("folder"), (2, 50, 40))
+        self.assertEqual(aggregates("folder/subfolder"), (1, 30, 40))
+        self.assertEqual(aggregates("empty folder"), (None, None, None))
+
+        with self.fs.session(True, current_time=600):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file 1", 25, 60)
+            self.fs.add_file("other file", 50, 30)
+
+        self.assertEqual(aggregates(""), (2, 75, 60))
+        self.assertEqual(aggregates("folder"), (1, 25, 60))
+        self.assertEqual(aggregates("folder/subfolder"), (0, 0, 40))
+
+        with self.fs.session(current_time=700):
+            self.fs.add_dir("folder/subfolder", 10)
+            self.fs.add_file("folder/subfolder/file 2", 30, 40)
+            self.fs.update_metadata(DatabaseType.FILE, "other file", {"size": 10})
+
+        self.assertEqual(aggregates(""), (3, 65, 60))
+        self.assertEqual(aggregates("folder/subfolder"), (1, 30, 40))
+
+        db = self.fs.db._db
+        for key in list(db):
+            if key[0] == DatabaseType.DIRECTORY:
+                m = db[key]
+                m["file_count"] = 1000
+                db[key] = m
+        del db[AGGREGATES_KEY]  # databases from before aggregates
+
+        self.fs = FileSystem(db)
+        self.assertEqual(aggregates(""), (3, 65, 60))
+        self.assertEqual(aggregates("folder"), (2, 55, 60))
+        self.assertEqual(aggregates("empty folder"), (None, None, None))
+
+    def test_journal(self):
+        self.assertEqual(self.fs.changes_since(0), (0, []))
+
+        with self.fs.session(True, current_time=500):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file", 20, 20)
+            self.fs.add_file("other file", 20, 30)
+
+        with self.fs.session(True, current_time=600):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file", 40, 20)
+
+        with self.fs.session(True, current_time=700):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file", 40, 20)
+
+        seq, entries = self.fs.changes_since(0)
+        self.assertEqual(seq, 2)
+        self.assertEqual([entry["seq"] for entry in entries], [1, 2])
+        self.assertEqual(
+            sorted(change["path"] for change in entries[0]["added"]),
+            ["folder", "folder/file", "other file"],
+        )
+        self.assertEqual(entries[0]["modified"], [])
+        self.assertEqual(
+            entries[1]["removed"], [{"type": "file", "path": "other file"}]
+        )
+        self.assertEqual(
+            entries[1]["modified"], [{"type": "file", "path": "folder/file"}]
+        )
+
+        self.assertEqual(self.fs.changes_since(2), (2, []))
+        self.assertEqual(self.fs.changes_since(3), (2, None))
+
+        with mock.patch("tridentstream.vfs.JOURNAL_MAX_CHANGES", 1):
+            with self.fs.session(current_time=800):
+                self.fs.add_file("file 1", 20, 20)
+                self.fs.add_file("file 2", 20, 20)
+                self.fs.add_file("file 3", 20, 20)
+
+        self.assertEqual(self.fs.changes_since(2), (3, None))
+        self.assertEqual(self.fs.changes_since(3), (3, []))
+
+    def test_session_stats(self):
+        self.assertIsNone(self.fs.session_stats())
+
+        self.fs.commit_bytes = 1
+        with self.fs.session(True):
+            self.fs.add_dir("folder", 10)
+            for i in range(3):
+                self.fs.add_file(f"folder/file {i}", 20, 20)
+            self.assertEqual(self.fs.session_stats()["commits"], 4)
+
+        stats = self.fs.session_stats()
+        self.assertEqual(stats["commits"], 5)
+        self.assertGreaterEqual(stats["commit_seconds"], 0)
+        self.assertGreaterEqual(stats["finish_buckets_seconds"], 0)
+        self.assertEqual(len(stats["slowest_buckets"]), 5)
+        self.assertEqual(len(stats["slowest_buckets"][0]["bucket"]), 2)
+
+    def test_commit_interval(self):
+        with mock.patch("tridentstream.vfs.time.monotonic", return_value=100):
+            with self.fs.session():
+                self.fs.add_dir("folder", 10)
+                self.assertEqual(self.fs.session_stats()["commits"], 0)
+
+                with mock.patch(
+                    "tridentstream.vfs.time.monotonic",
+                    return_value=100 + self.fs.commit_interval,
+                ):
+                    self.fs.add_file("folder/file", 20, 20)
+                self.assertEqual(self.fs.session_stats()["commits"], 1)
+
+        self.assertEqual(self.fs.session_stats()["commits"], 2)
+
+    def test_finish_untouched_buckets(self):
+        with self.fs.session(True):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file", 20, 20)
+
+        written = []
+        original_setitem = self.fs.db.__class__.__setitem__
+
+        def setitem(db, key, value):
+            written.append(key)
+            original_setitem(db, key, value)
+
+        with mock.patch.object(self.fs.db.__class__, "__setitem__", setitem):
+            with self.fs.session():
+                self.fs.add_file("folder/other file", 20, 20)
+
+        written_buckets = [
+            key
+            for key in written
+            if key[:1] in (DatabaseType.BUCKET, DatabaseType.NEW_BUCKET)
+        ]
+        self.assertLessEqual(len(written_buckets), 4)
+        listing = self.fs.list_dir("folder").serialize()
+        self.assertEqual(
+            sorted(item["id"] for item in listing["nested_items"]),
+            ["file", "other file"],
+        )
+
+
+class VirtualFileSystemBloomFilterTestCase(VirtualFileSystemTestCase):
+    filesystem_options = {"bloom_filter": True}
+
+    def test_bloom_filter(self):
+        with self.fs.session(current_time=500):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file", 20, 20)
+
+        stats = self.fs.bloom_stats()
+        self.assertEqual(stats["items"], 3)
+        self.assertEqual(stats["negatives"], 2)
+        self.assertIn(BLOOM_FILTER_KEY, self.fs.db)
+
+        self.assertRaises(PathNotFoundException, self.fs.last_modified, "missing")
+        self.assertEqual(self.fs.bloom_stats()["negatives"], 4)
+
+        db = self.fs.db._db
+        fs = FileSystem(db, bloom_filter=True)
+        self.assertEqual(len(fs.bloom_filter), 3)
+        self.assertEqual(fs.last_modified("folder/file"), 20)
+
+        del db[BLOOM_FILTER_KEY]  # a session that never finished
+        fs = FileSystem(db, bloom_filter=True)
+        self.assertEqual(len(fs.bloom_filter), 3)
+        self.assertEqual(fs.last_modified("folder/file"), 20)
+
+        FileSystem(db)
+        self.assertNotIn(BLOOM_FILTER_KEY, db)
+
+    def test_bloom_filter_stored_when_changed(self):
+        with self.fs.session(current_time=500):
+            self.fs.add_dir("folder", 10)
+            self.fs.add_file("folder/file", 20, 20)
+
+        with mock.patch.object(
+            self.fs.bloom_filter, "serialize", wraps=self.fs.bloom_filter.serialize
+        ) as serialize:
+            with self.fs.session(current_time=600):
+                self.fs.add_file("folder/file", 20, 20)
+            serialize.assert_not_called()
+            self.assertIn(BLOOM_FILTER_KEY, self.fs.db)
+
+            with self.fs.session(current_time=700):
+                self.fs.add_file("folder/other file", 30, 30)
+                self.assertNotIn(BLOOM_FILTER_KEY, self.fs.db)
+            serialize.assert_called_once_with()
+
+        fs = FileSystem(self.fs.db._db, bloom_filter=True)
+        self.assertEqual(len(fs.bloom_filter), 4)
@@ -1,5 +1,7 @@
 import logging
 
+from .plugins.db import in_scan_range, scan_start
+
 logger = logging.getLogger(__name__)
 
 
@@ -12,3 +14,23 @@ class debugdict(dict):
 
     def close(self):
         self.closed = True
+
+    def get_many(self, keys):
+        return {key: self[key] for key in keys if key in self}
+
+    def put_many(self, items):
+        self.update(items)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.pop(key, None)
+
+    def write_many(self, items, delete_keys):
+        self.put_many(items)
+        self.delete_many(delete_keys)
+
+    def scan(self, prefix="", start=None, end=None):
+        lower = scan_start(prefix, start)
+        for key in sorted(self):
+            if key >= lower and in_scan_range(key, prefix, end):
+                yield key, self[key]
@@ -1,15 +1,36 @@
+import hashlib
+import logging
+import os
 import time
 from collections import defaultdict
+from itertools import islice
 
 from thomas import Item, router
 
+from .bloomfilter import BloomFilter
 from .exceptions import PathNotFoundException
 from .plugins import DatabaseCacheLayer
 from .utils import hash_string
 
-COMMIT_COUNTER = 10000  # listing entries before adding to work queue
+COMMIT_COUNTER = 10000  # entries written per batch by migrations and index builds
+COMMIT_BYTES = (
+    64 * 1024 * 1024
+)  # estimated bytes of uncommitted changes before a commit
+COMMIT_INTERVAL = 60  # seconds between commits in long sessions
+BUCKET_ENTRY_SIZE = 100  # estimated bytes of an uncommitted bucket entry
 BUCKET_SIZE = 1  # bytes,
 GC_DELETED_FILES = 60 * 60 * 24 * 30  # seconds
+COMPACT_BATCH_SIZE = 1000  # deleted items removed per compaction batch
+JOURNAL_SIZE = 1000  # journal entries kept
+SLOWEST_BUCKETS = 5  # buckets listed in the session stats
+JOURNAL_MAX_CHANGES = 100000  # changes in a session before it is journaled as a reset
+
+KEY_FORMAT_HEX = 1  # type + 40 character hex sha1, memberships stored as pickled sets
+KEY_FORMAT_BINARY = 2  # type + 20 byte sha1 digest, memberships stored as packed keys
+HEX_KEY_LENGTH = 41
+BINARY_KEY_LENGTH = 21
+
+logger = logging.getLogger(__name__)
 
 
 class AlreadyInSessionException(Exception):
@@ -27,6 +48,12 @@ class DatabaseType:
     FILELIST = "\x03"
     NEW_BUCKET = "\x04"
     DELETED_BUCKET = "\x05"
+    DIRECTORY_STATE = "\x06"
+    SETTING = "\x07"
+    JOURNAL = "\x08"
+    TOMBSTONE = "\x09"
+    CHILD = "\x0a"
+    INDEX = "\x0b"
 
     _mapping = {"\x00": "file", "\x01": "folder"}
 
@@ -42,8 +69,149 @@ def cleanup_path(path):
         return path.strip("/")
 
 
-def keyify(key_type, path):
-    return "%s%s" % (key_type, hash_string(cleanup_path(path)))
+KEY_FORMAT_KEY = "%skey_format" % (DatabaseType.SETTING,)
+BLOOM_FILTER_KEY = "%sbloom_filter" % (DatabaseType.SETTING,)
+JOURNAL_SEQ_KEY = "%sjournal_seq" % (DatabaseType.SETTING,)
+TOMBSTONES_INDEXED_KEY = "%stombstones_indexed" % (DatabaseType.SETTING,)
+TOMBSTONE_TIME_LENGTH = 12
+CHILD_INDEX_KEY = "%schild_index" % (DatabaseType.SETTING,)
+AGGREGATES_KEY = "%saggregates" % (DatabaseType.SETTING,)
+
+FILE_INDEX_KEY = "%sfile_index" % (DatabaseType.SETTING,)
+
+SORT_KEYS = {"name": "n", "date": "d"}  # sort key to child index type
+FILE_INDEXES = {
+    "extension": DatabaseType.INDEX + "e",  # extension, then added date
+    "size": DatabaseType.INDEX + "s",
+    "date": DatabaseType.INDEX + "d",  # added date
+    "fingerprint": DatabaseType.INDEX + "f",  # fingerprint, then added date
+}
+
+
+def journal_key(seq):
+    return "%s%016d" % (DatabaseType.JOURNAL, seq)
+
+
+def tombstone_key(deleted, key):
+    """Tombstones are ordered by the time the item was deleted"""
+    return "%s%0*d%s" % (DatabaseType.TOMBSTONE, TOMBSTONE_TIME_LENGTH, deleted, key)
+
+
+def parse_tombstone_key(tombstone):
+    """Returns the time the item was deleted and the key of the item"""
+    return (
+        int(tombstone[1 : 1 + TOMBSTONE_TIME_LENGTH]),
+        tombstone[1 + TOMBSTONE_TIME_LENGTH :],
+    )
+
+
+def encode_index_value(value):
+    """Strings in index keys are utf-8, that way they sort by code point"""
+    return value.encode("utf-8", "surrogateescape").decode("latin-1")
+
+
+def keyify(key_type, path, key_format=KEY_FORMAT_HEX):
+    path = cleanup_path(path)
+    if key_format == KEY_FORMAT_BINARY:
+        digest = hashlib.sha1(path.encode("utf-8")).digest()
+        return "%s%s" % (key_type, digest.decode("latin-1"))
+
+    return "%s%s" % (key_type, hash_string(path))
+
+
+def pack_keys(keys):
+    """Turns a set of binary keys into a sorted byte string"""
+    return "".join(sorted(keys)).encode("latin-1")
+
+
+def unpack_keys(data):
+    """Turns a byte string created by pack_keys into a set of binary keys"""
+    data = data.decode("latin-1")
+    return {
+        data[i : i + BINARY_KEY_LENGTH] for i in range(0, len(data), BINARY_KEY_LENGTH)
+    }
+
+
+def hex_key_to_binary(key):
+    if len(key) != HEX_KEY_LENGTH:
+        return key
+
+    return "%s%s" % (key[0], bytes.fromhex(key[1:]).decode("latin-1"))
+
+
+def migrate_key_format(db, batch_size=COMMIT_COUNTER):
+    """
+    Rewrites a database using hex keys to binary keys in place.
+
+    Items are moved before the buckets, so an interrupted migration can just be started again.
+    """
+    item_types = (
+        DatabaseType.FILE,
+        DatabaseType.DIRECTORY,
+        DatabaseType.FILELIST,
+        DatabaseType.DIRECTORY_STATE,
+    )
+    tombstone_length = 1 + TOMBSTONE_TIME_LENGTH + HEX_KEY_LENGTH
+    old_keys = [
+        key
+        for key in db
+        if (len(key) == HEX_KEY_LENGTH and key[0] in item_types)
+        or (len(key) == tombstone_length and key[0] == DatabaseType.TOMBSTONE)
+    ]
+    logger.info(f"Migrating {len(old_keys)} keys to the binary key format")
+
+    for i in range(0, len(old_keys), batch_size):
+        keys = old_keys[i : i + batch_size]
+        items = {}
+        for key, value in db.get_many(keys).items():
+            if key[0] == DatabaseType.FILELIST:
+                value = pack_keys(hex_key_to_binary(k) for k in value)
+
+            if key[0] == DatabaseType.TOMBSTONE:
+                deleted, item_key = parse_tombstone_key(key)
+                items[tombstone_key(deleted, hex_key_to_binary(item_key))] = value
+            else:
+                items[hex_key_to_binary(key)] = value
+
+        db.write_many(items, keys)
+
+    for bucket_type in (
+        DatabaseType.BUCKET,
+        DatabaseType.NEW_BUCKET,
+        DatabaseType.DELETED_BUCKET,
+    ):
+        bucket_keys = ["%s%s" % (bucket_type, bucket) for bucket in generate_buckets()]
+        buckets = defaultdict(set)
+        for value in db.get_many(bucket_keys).values():
+            if isinstance(value, bytes):
+                value = unpack_keys(value)
+
+            for key in value:
+                key = hex_key_to_binary(key)
+                buckets[key[1 : 1 + BUCKET_SIZE]].add(key)
+
+        db.put_many(
+            {
+                "%s%s" % (bucket_type, bucket): pack_keys(buckets[bucket])
+                for bucket in generate_buckets()
+            }
+        )
+
+    if BLOOM_FILTER_KEY in db:
+        del db[BLOOM_FILTER_KEY]
+
+    # indexes end with or are keyed by item keys, they are rebuilt on open
+    for index_type, index_setting_key in (
+        (DatabaseType.CHILD, CHILD_INDEX_KEY),
+        (DatabaseType.INDEX, FILE_INDEX_KEY),
+    ):
+        db.delete_many([key for key, _ in db.scan(index_type)])
+        if index_setting_key in db:
+            del db[index_setting_key]
+
+    db[KEY_FORMAT_KEY] = KEY_FORMAT_BINARY
+    db.sync()
+    logger.info("Done migrating to the binary key format")
 
 
 def merge_set_dicts(result, merge_with):
@@ -60,6 +228,16 @@ def generate_buckets(bucket_depth=BUCKET_SIZE):
             yield i
 
 
+def indexed_fields(metadata):
+    """The metadata the child and file indexes are built from"""
+    return {
+        "path": metadata["path"],
+        "date": metadata.get("date", 0),
+        "size": metadata.get("size", 0),
+        "fingerprint": metadata.get("fingerprint"),
+    }
+
+
 def compare_dicts(src, dst):
     """Checks if all keys in src matches the values in dst"""
     for k, v in src.items():
@@ -74,9 +252,28 @@ class FileSystem:
     _delete_missing_items = False
     _always_trigger_new = False
     _current_time = None
-
-    def __init__(self, db):
-        self.db = DatabaseCacheLayer(db)
+    _removed_hashes = None
+    _session_buckets = None
+    _journal = None
+    bloom_filter = None
+    _bloom_filter_changed = False
+    bloom_negatives = 0
+    bloom_false_positives = 0
+    _session_stats = None
+
+    def __init__(
+        self,
+        db,
+        key_format=KEY_FORMAT_BINARY,
+        cache_size=None,
+        bloom_filter=False,
+        commit_bytes=COMMIT_BYTES,
+        commit_interval=COMMIT_INTERVAL,
+    ):
+        self.key_format = self.prepare_key_format(db, key_format)
+        self.db = DatabaseCacheLayer(db, max_size=cache_size)
+        self.commit_bytes = commit_bytes
+        self.commit_interval = commit_interval
         self.events = {
             "new": [],
             "deleted": [],
@@ -89,6 +286,12 @@ class FileSystem:
         self.initialize_database()
         self.reset_session()
 
+        if bloom_filter:
+            self.load_bloom_filter()
+        elif BLOOM_FILTER_KEY in self.db:
+            # a filter left behind would miss items added while it is disabled
+            del self.db[BLOOM_FILTER_KEY]
+
     def add_event(self, event, f):
         self.events[event].append(f)
 
@@ -99,25 +302,258 @@ class FileSystem:
     def close(self):
         self._trigger_event("db_closed")
 
+    def prepare_key_format(self, db, key_format):
+        """
+        Finds the key format used by the database, new databases use key_format
+        and databases using hex keys are migrated when binary keys are wanted.
+        """
+        stored_key_format = db.get(KEY_FORMAT_KEY)
+        if stored_key_format is None:
+            if keyify(DatabaseType.DIRECTORY, "", KEY_FORMAT_HEX) in db:
+                stored_key_format = KEY_FORMAT_HEX
+            else:
+                stored_key_format = key_format
+            db[KEY_FORMAT_KEY] = stored_key_format
+
+        if stored_key_format == KEY_FORMAT_HEX and key_format == KEY_FORMAT_BINARY:
+            migrate_key_format(db)
+            stored_key_format = KEY_FORMAT_BINARY
+
+        return stored_key_format
+
+    def load_bloom_filter(self):
+        """
+        Loads the bloom filter of item keys, it is rebuilt from the database
+        if it is missing, e.g. because a session did not finish.
+        """
+        data = self.db.get(BLOOM_FILTER_KEY)
+        if data is not None:
+            self.bloom_filter = BloomFilter.deserialize(data)
+            return
+
+        logger.info("Building bloom filter of all items in the database")
+        self.bloom_filter = BloomFilter()
+        for key in self.db.keys():
+            if key[0] in (DatabaseType.FILE, DatabaseType.DIRECTORY):
+                self.bloom_filter.add(key)
+        logger.info(f"Added {len(self.bloom_filter)} items to bloom filter")
+
+    def _add_to_bloom_filter(self, key):
+        """
+        Adds an item key to the bloom filter, the stored filter is removed when the first
+        key is added in a session, items are written before it is stored again.
+        """
+        items = len(self.bloom_filter)
+        self.bloom_filter.add(key)
+        if len(self.bloom_filter) != items and not self._bloom_filter_changed:
+            self._bloom_filter_changed = True
+            if BLOOM_FILTER_KEY in self.db:
+                del self.db[BLOOM_FILTER_KEY]
+
+    def bloom_stats(self):
+        if self.bloom_filter is None:
+            return {"enabled": False}
+
+        lookups = self.bloom_negatives + self.bloom_false_positives
+        return {
+            "enabled": True,
+            "items": len(self.bloom_filter),
+            "size": self.bloom_filter.size,
+            "negatives": self.bloom_negatives,
+            "false_positives": self.bloom_false_positives,
+            "false_positive_rate": lookups and self.bloom_false_positives / lookups,
+            "expected_false_positive_rate": self.bloom_filter.expected_false_positive_rate(),
+        }
+
+    def _get_item(self, key):
+        """
+        Returns the metadata of a file or directory, the bloom filter is checked first
+        to avoid looking up items that do not exist.
+        """
+        if self.bloom_filter is None:
+            return self.db.get(key)
+
+        if key not in self.bloom_filter:
+            self.bloom_negatives += 1
+            return None
+
+        m = self.db.get(key)
+        if m is None:
+            self.bloom_false_positives += 1
+        return m
+
+    def _item_exists(self, key):
+        return self._get_item(key) is not None
+
+    def keyify(self, key_type, path):
+        return keyify(key_type, path, self.key_format)
+
+    def _pack_keys(self, keys):
+        if self.key_format == KEY_FORMAT_BINARY:
+            return pack_keys(keys)
+        return set(keys)
+
+    def _unpack_keys(self, data):
+        if self.key_format == KEY_FORMAT_BINARY:
+            return unpack_keys(data)
+        return data
+
     def initialize_database(self):
         for bucket in generate_buckets():
             key = "%s%s" % (DatabaseType.BUCKET, bucket)
             if key not in self.db:
-                self.db[key] = set()
+                self.db[key] = self._pack_keys(set())
 
             key = "%s%s" % (DatabaseType.DELETED_BUCKET, bucket)
             if key not in self.db:
-                self.db[key] = set()
+                self.db[key] = self._pack_keys(set())
 
             key = "%s%s" % (DatabaseType.NEW_BUCKET, bucket)
-            self.db[key] = set()
+            self.db[key] = self._pack_keys(set())
 
-        key = keyify(DatabaseType.DIRECTORY, "")
+        key = self.keyify(DatabaseType.DIRECTORY, "")
         if key not in self.db:
             self.db[key] = {"path": "", "date": 0}
 
-            filelist_key = keyify(DatabaseType.FILELIST, "")
-            self.db[filelist_key] = set()
+            filelist_key = self.keyify(DatabaseType.FILELIST, "")
+            self.db[filelist_key] = self._pack_keys(set())
+
+            # nothing is deleted yet, so there are no tombstones to create
+            self.db[TOMBSTONES_INDEXED_KEY] = len(list(generate_buckets()))
+            self.db[CHILD_INDEX_KEY] = True
+            self.db[FILE_INDEX_KEY] = True
+            self.db[AGGREGATES_KEY] = True
+
+        if CHILD_INDEX_KEY not in self.db:
+            self.build_index(
+                CHILD_INDEX_KEY,
+                self._child_index_keys,
+                (DatabaseType.FILE, DatabaseType.DIRECTORY),
+            )
+
+        if FILE_INDEX_KEY not in self.db:
+            self.build_index(
+                FILE_INDEX_KEY, self._file_index_keys, (DatabaseType.FILE,)
+            )
+
+        if AGGREGATES_KEY not in self.db:
+            self.build_aggregates()
+
+    def build_aggregates(self):
+        """
+        Sums up the files below every directory, for databases from before
+        directories had aggregates.
+        """
+        logger.info("Building the aggregates of all directories")
+        self.reset_keys()
+        for _, m in self.db.scan(DatabaseType.FILE):
+            if not m.get("deleted", False):
+                self.add_parent_path_aggregate(
+                    m["path"], 1, m.get("size", 0), m.get("modified", 0)
+                )
+
+        for key, m in self.db.scan(DatabaseType.DIRECTORY):
+            for k in ("file_count", "total_size", "newest_modified"):
+                m.pop(k, None)
+            self.db[key] = m
+
+        self.commit_keys()
+        self.reset_keys()
+        self.db[AGGREGATES_KEY] = True
+        self.db.sync()
+
+    def build_index(self, index_setting_key, get_index_keys, db_types):
+        """
+        Indexes the items in the database, for databases from before
+        the index existed.
+        """
+        logger.info(f"Building the {index_setting_key[1:]} of all items")
+        items = {}
+        for db_type in db_types:
+            for key, m in self.db.scan(db_type):
+                if m.get("deleted", False):
+                    continue
+
+                for index_key in get_index_keys(key, m):
+                    items[index_key] = key
+
+                if len(items) >= COMMIT_COUNTER:
+                    self.db.put_many(items)
+                    self.db.sync()
+                    items = {}
+
+        self.db.put_many(items)
+        self.db[index_setting_key] = True
+        self.db.sync()
+
+    def _child_index_prefix(self, path, sort_key):
+        return "%s%s%s" % (
+            DatabaseType.CHILD,
+            self.keyify(DatabaseType.DIRECTORY, path)[1:],
+            SORT_KEYS[sort_key],
+        )
+
+    def _child_index_keys(self, key, metadata):
+        """
+        Returns the keys of an item in the sorted child indexes of its parent directory.
+        Names are stored as utf-8 so they sort the same way as the listing does.
+        """
+        path = metadata["path"]
+        if not path:
+            return []
+
+        parent_path, _, name = path.rpartition("/")
+        name = "%s\x00%s" % (encode_index_value(name), key[0])
+        return [
+            self._child_index_prefix(parent_path, "name") + name,
+            self._child_index_prefix(parent_path, "date")
+            + "%012d" % metadata.get("date", 0)
+            + name,
+        ]
+
+    def _file_index_keys(self, key, metadata):
+        """
+        Returns the keys of a file in the extension, size and date indexes.
+        """
+        if key[0] != DatabaseType.FILE:
+            return []
+
+        extension = os.path.splitext(metadata["path"])[1].lstrip(".").lower()
+        date = "%012d" % metadata.get("date", 0)
+        index_keys = [
+            "%s%s\x00%s%s"
+            % (FILE_INDEXES["extension"], encode_index_value(extension), date, key),
+            "%s%016d%s" % (FILE_INDEXES["size"], metadata.get("size", 0), key),
+            "%s%s%s" % (FILE_INDEXES["date"], date, key),
+        ]
+        if metadata.get("fingerprint"):
+            index_keys.append(
+                "%s%s\x00%s%s"
+                % (FILE_INDEXES["fingerprint"], metadata["fingerprint"], date, key)
+            )
+        return index_keys
+
+    def _index_keys(self, key, metadata):
+        return self._child_index_keys(key, metadata) + self._file_index_keys(
+            key, metadata
+        )
+
+    def _index_item(self, key, metadata, old_metadata=None):
+        """
+        Adds an item to the child and file indexes, replacing the entries from old_metadata.
+        """
+        index_keys = self._index_keys(key, metadata)
+        if old_metadata:
+            for index_key in self._index_keys(key, old_metadata):
+                if index_key not in index_keys:
+                    del self.db[index_key]
+
+        for index_key in index_keys:
+            self.db[index_key] = key
+
+    def _unindex_item(self, key, metadata):
+        for index_key in self._index_keys(key, metadata):
+            del self.db[index_key]
 
     def reset_session(self):
         """
@@ -133,11 +569,33 @@ class FileSystem:
         """
         After a scan is done, this commits the new bucket session as the current bucket session.
         """
+        started = time.monotonic()
 
         self.commit_buckets()
         self.commit_keys()
         self.db.sync()
 
+        if self._session_stats is not None:
+            self._session_stats["commits"] += 1
+            self._session_stats["commit_seconds"] += time.monotonic() - started
+
+    def session_stats(self):
+        """
+        Commits and how long they took in the current or last session,
+        and how long finishing the buckets took with the slowest buckets.
+        """
+        if self._session_stats is None:
+            return None
+
+        stats = dict(self._session_stats)
+        stats["slowest_buckets"] = [
+            {"bucket": bucket.encode("latin-1").hex(), "seconds": seconds}
+            for seconds, bucket in sorted(stats.pop("bucket_seconds"), reverse=True)[
+                :SLOWEST_BUCKETS
+            ]
+        ]
+        return stats
+
     def session(self, complete=False, always_trigger_new=False, current_time=None):
         self._delete_missing_items = complete
         self._always_trigger_new = always_trigger_new
@@ -155,25 +613,63 @@ class FileSystem:
             or int(time.time())
         )
         self._in_session = True
+        self._session_stats = {
+            "commits": 0,
+            "commit_seconds": 0.0,
+            "finish_buckets_seconds": None,
+            "bucket_seconds": [],
+        }
+        self._removed_hashes = defaultdict(set)
+        self._session_buckets = set()
+        self._journal = {"added": [], "removed": [], "modified": set(), "changes": 0}
         self.reset_session()
 
+        if self.bloom_filter is not None:
+            # a filter that is not stored yet, e.g. just rebuilt, is stored when the session is done
+            self._bloom_filter_changed = BLOOM_FILTER_KEY not in self.db
+
     def __exit__(self, type, value, traceback):
         self.commit_session()
         self.finish_buckets()
+        self.write_journal()
+        if self._bloom_filter_changed:
+            self.db[BLOOM_FILTER_KEY] = self.bloom_filter.serialize()
+            self.db.sync()
+            self._bloom_filter_changed = False
         self._delete_missing_items = False
         self._always_trigger_new = False
         self._current_time = None
+        self._removed_hashes = None
+        self._session_buckets = None
+        self._journal = None
         self._in_session = False
 
     def finish_buckets(self):
+        """
+        Compares the buckets of the session with the current buckets to find new and
+        deleted items. Only a complete session has to look at every bucket,
+        otherwise the buckets untouched by the session are left alone.
+        """
         deleted_paths = []
-        for bucket in generate_buckets():
+        bucket_seconds = []
+        started = time.monotonic()
+        if self._delete_missing_items or self._session_buckets is None:
+            buckets = generate_buckets()
+        else:
+            buckets = sorted(self._session_buckets | set(self._removed_hashes or {}))
+
+        for bucket in buckets:
+            bucket_started = time.monotonic()
             new_key = "%s%s" % (DatabaseType.NEW_BUCKET, bucket)
             cur_key = "%s%s" % (DatabaseType.BUCKET, bucket)
             zombie_key = "%s%s" % (DatabaseType.DELETED_BUCKET, bucket)
-            new_hashes = self.db[new_key]
-            cur_hashes = self.db[cur_key] if not self._always_trigger_new else set()
-            zombie_hashes = self.db[zombie_key]
+            new_hashes = self._unpack_keys(self.db[new_key])
+            stored_cur_hashes = self._unpack_keys(self.db[cur_key])
+            if self._always_trigger_new:
+                cur_hashes = set()
+            else:
+                cur_hashes = stored_cur_hashes
+            zombie_hashes = self._unpack_keys(self.db[zombie_key])
 
             for key in new_hashes - cur_hashes:
                 m = self.db[key]
@@ -181,42 +677,48 @@ class FileSystem:
                     "new", key=key, db_type=DatabaseType.to_str(key[0]), metadata=m
                 )
                 self.db[key] = m
+                self._record_change("added", key, m)
 
             if self._delete_missing_items:
                 deleted_hashes = cur_hashes - new_hashes
+            else:
+                removed_hashes = (self._removed_hashes or {}).get(bucket, set())
+                deleted_hashes = (removed_hashes & cur_hashes) - new_hashes
+
+            for key in deleted_hashes:
+                m = self.db[key]
+                m["deleted"] = self._current_time
+                self._trigger_event(
+                    "deleted",
+                    key=key,
+                    db_type=DatabaseType.to_str(key[0]),
+                    metadata=m,
+                )
+                self.db[key] = m
+                self.db[tombstone_key(self._current_time, key)] = True
+                self._unindex_item(key, m)
+                if key[0] == DatabaseType.FILE:
+                    self.add_parent_path_aggregate(m["path"], -1, -m.get("size", 0), 0)
+                deleted_paths.append(m["path"])
+                self._record_change("removed", key, m)
 
-                for key in deleted_hashes:
-                    m = self.db[key]
-                    m["deleted"] = self._current_time
-                    self._trigger_event(
-                        "deleted",
-                        key=key,
-                        db_type=DatabaseType.to_str(key[0]),
-                        metadata=m,
-                    )
-                    self.db[key] = m
-                    deleted_paths.append(m["path"])
-
-                self.db[cur_key] = new_hashes
-
-                zombie_remove_keys = set()
-                for key in zombie_hashes:
-                    m = self.db[key]
-                    if (
-                        "deleted" in m
-                        and m["deleted"] < self._current_time - GC_DELETED_FILES
-                    ):
-                        self._remove_key(key, m)
-                        zombie_remove_keys.add(key)
-                zombie_hashes -= zombie_remove_keys
-
-                self.db[zombie_key] = (cur_hashes - new_hashes) | (
+            if self._delete_missing_items:
+                updated_cur_hashes = new_hashes
+                updated_zombie_hashes = (cur_hashes - new_hashes) | (
                     zombie_hashes - new_hashes
                 )
             else:
-                self.db[cur_key] = new_hashes | cur_hashes
-
-            self.db[new_key] = set()
+                updated_cur_hashes = (new_hashes | cur_hashes) - deleted_hashes
+                updated_zombie_hashes = zombie_hashes | deleted_hashes
+
+            # unchanged buckets are not written again
+            if updated_cur_hashes != stored_cur_hashes:
+                self.db[cur_key] = self._pack_keys(updated_cur_hashes)
+            if updated_zombie_hashes != zombie_hashes:
+                self.db[zombie_key] = self._pack_keys(updated_zombie_hashes)
+            if new_hashes:
+                self.db[new_key] = self._pack_keys(set())
+            bucket_seconds.append((time.monotonic() - bucket_started, bucket))
 
         last_touched_path = None
         for path in sorted(deleted_paths):
@@ -226,46 +728,205 @@ class FileSystem:
             self.add_parent_path_touched(path, self._current_time)
             last_touched_path = path
 
-        if last_touched_path is not None:
+        if last_touched_path is not None or self._aggregates:
             self.commit_keys()
 
         self.db.sync()
 
-    def _remove_key(self, key, metadata):
-        del self.db[key]
-        if key[0] == DatabaseType.DIRECTORY:
-            filelist_key = DatabaseType.FILELIST + key[1:]
-            del self.db[filelist_key]
+        if self._session_stats is not None:
+            self._session_stats["finish_buckets_seconds"] = time.monotonic() - started
+            self._session_stats["bucket_seconds"] = bucket_seconds
 
-        p = "/".join(metadata["path"].split("/")[:-1])
-        parent_filelist_key = keyify(DatabaseType.FILELIST, p)
+    def _record_change(self, change_type, key, metadata=None):
+        journal = self._journal
+        if journal is None or journal["changes"] > JOURNAL_MAX_CHANGES:
+            return
 
-        if parent_filelist_key in self.db:
-            self.db[parent_filelist_key].remove(key)
-            self.db[parent_filelist_key] = self.db[parent_filelist_key]
+        journal["changes"] += 1
+        if change_type == "modified":
+            journal["modified"].add(key)
+        else:
+            journal[change_type].append(
+                {"type": DatabaseType.to_str(key[0]), "path": metadata["path"]}
+            )
+
+    def write_journal(self):
+        """
+        Appends the changes of the session to the journal with the next sequence number.
+        """
+        journal = self._journal
+        if journal["changes"] > JOURNAL_MAX_CHANGES:
+            entry = {"reset": True}
+        else:
+            added = set((change["type"], change["path"]) for change in journal["added"])
+            modified = []
+            for key in sorted(journal["modified"]):
+                m = self.db.get(key)
+                if m is None or "deleted" in m:
+                    continue
+
+                change = {"type": DatabaseType.to_str(key[0]), "path": m["path"]}
+                if (change["type"], change["path"]) not in added:
+                    modified.append(change)
+
+            if not journal["added"] and not journal["removed"] and not modified:
+                return
+
+            entry = {
+                "added": journal["added"],
+                "removed": journal["removed"],
+                "modified": modified,
+            }
+
+        seq = self.db.get(JOURNAL_SEQ_KEY, 0) + 1
+        entry.update({"seq": seq, "time": self._current_time})
+        self.db[journal_key(seq)] = entry
+        self.db[JOURNAL_SEQ_KEY] = seq
+
+        old_key = journal_key(seq - JOURNAL_SIZE)
+        if old_key in self.db:
+            del self.db[old_key]
+
+        self.db.sync()
+
+    def changes_since(self, seq):
+        """
+        Returns the current journal sequence number and the journal entries after seq.
+        Entries is None when the journal does not go back to seq, everything must be read again then.
+        """
+        current_seq = self.db.get(JOURNAL_SEQ_KEY, 0)
+        if seq > current_seq or seq < current_seq - JOURNAL_SIZE:
+            return current_seq, None
+
+        entries = [
+            entry
+            for _, entry in self.db.scan(
+                DatabaseType.JOURNAL, start=journal_key(seq + 1)
+            )
+        ]
+        if len(entries) != current_seq - seq or any(e.get("reset") for e in entries):
+            return current_seq, None
+
+        return current_seq, entries
+
+    def _index_tombstones(self, bucket):
+        """
+        Creates tombstones for the deleted items in a bucket, for databases
+        from before deleted items got a tombstone.
+        """
+        zombie_key = "%s%s" % (DatabaseType.DELETED_BUCKET, bucket)
+        zombie_hashes = self._unpack_keys(self.db[zombie_key])
+        for key, m in self.db.get_many(zombie_hashes).items():
+            if "deleted" in m:
+                self.db[tombstone_key(m["deleted"], key)] = True
+
+    def compact(self, current_time=None, batch_size=COMPACT_BATCH_SIZE):
+        """
+        Removes one batch of the items deleted more than GC_DELETED_FILES ago, oldest first.
+        Returns True when there might be more to remove, the batch is committed
+        so compaction can be stopped and resumed between batches.
+
+        Cannot run while in session.
+        """
+        if self._in_session:
+            raise AlreadyInSessionException()
+
+        buckets = list(generate_buckets())
+        indexed = self.db.get(TOMBSTONES_INDEXED_KEY, 0)
+        if indexed < len(buckets):
+            self._index_tombstones(buckets[indexed])
+            self.db[TOMBSTONES_INDEXED_KEY] = indexed + 1
+            self.db.sync()
+            return True
+
+        cutoff = (current_time or int(time.time())) - GC_DELETED_FILES
+        tombstones = [
+            tombstone
+            for tombstone, _ in islice(
+                self.db.scan(DatabaseType.TOMBSTONE, end=tombstone_key(cutoff, "")),
+                batch_size,
+            )
+        ]
+        if not tombstones:
+            return False
+
+        parsed_tombstones = [parse_tombstone_key(t) for t in tombstones]
+        items = self.db.get_many(key for _, key in parsed_tombstones)
+
+        filelists = defaultdict(set)
+        zombies = defaultdict(set)
+        for tombstone, (deleted, key) in zip(tombstones, parsed_tombstones):
+            del self.db[tombstone]
+
+            m = items.get(key)
+            if m is None or m.get("deleted") != deleted:
+                continue  # the item came back or was deleted again later
+
+            del self.db[key]
+            if key[0] == DatabaseType.DIRECTORY:
+                for key_type in (DatabaseType.FILELIST, DatabaseType.DIRECTORY_STATE):
+                    if key_type + key[1:] in self.db:
+                        del self.db[key_type + key[1:]]
+
+            parent_path = "/".join(m["path"].split("/")[:-1])
+            filelists[self.keyify(DatabaseType.FILELIST, parent_path)].add(key)
+            zombies[key[1 : 1 + BUCKET_SIZE]].add(key)
+
+        for filelist_key, keys in filelists.items():
+            if filelist_key in self.db:
+                self.db[filelist_key] = self._pack_keys(
+                    self._unpack_keys(self.db[filelist_key]) - keys
+                )
+
+        for bucket, keys in zombies.items():
+            zombie_key = "%s%s" % (DatabaseType.DELETED_BUCKET, bucket)
+            self.db[zombie_key] = self._pack_keys(
+                self._unpack_keys(self.db[zombie_key]) - keys
+            )
+
+        self.db.sync()
+        logger.debug(f"Removed {sum(len(k) for k in zombies.values())} deleted items")
+
+        return len(tombstones) == batch_size
 
     def reset_keys(self):
         self._touched_keys = defaultdict(int)
         self._filelists = defaultdict(set)
+        self._aggregates = defaultdict(lambda: [0, 0, 0])
 
     def reset_buckets(self):
         self._buckets = defaultdict(set)
         self._uncommitted_changes = 0
+        self._last_commit = time.monotonic()
 
     def commit_keys(self):
+        changes = {}
+
+        touched = self.db.get_many(set(self._touched_keys) | set(self._aggregates))
         for key, modified in self._touched_keys.items():
-            m = self.db[key]
+            m = touched[key]
             if m.get("modified", 0) < modified:
                 m["modified"] = modified
-                self.db[key] = m
+                changes[key] = m
 
+        for key, (file_count, total_size, newest_modified) in self._aggregates.items():
+            m = touched[key]
+            m["file_count"] = m.get("file_count", 0) + file_count
+            m["total_size"] = m.get("total_size", 0) + total_size
+            m["newest_modified"] = max(m.get("newest_modified", 0), newest_modified)
+            changes[key] = m
+        self._aggregates.clear()  # unlike modified times, these are not idempotent
+
+        filelists = self.db.get_many(self._filelists.keys())
         for key, hashes in self._filelists.items():
-            self.db[key] |= hashes
+            changes[key] = self._pack_keys(self._unpack_keys(filelists[key]) | hashes)
+
+        self.db.put_many(changes)
 
     def commit_buckets(self):
         for bucket, hashes in self._buckets.items():
             key = "%s%s" % (DatabaseType.NEW_BUCKET, bucket)
-            self.db[key] = self.db[key] | hashes
+            self.db[key] = self._pack_keys(self._unpack_keys(self.db[key]) | hashes)
 
         self.reset_buckets()
 
@@ -276,6 +937,7 @@ class FileSystem:
         bucket = h[1 : 1 + BUCKET_SIZE]
 
         self._buckets[bucket].add(h)
+        self._session_buckets.add(bucket)
         self._uncommitted_changes += 1
 
     def add_parent_path_touched(self, path, modified_time):
@@ -285,36 +947,70 @@ class FileSystem:
 
         split_path.pop()
         while True:
-            key = keyify(DatabaseType.DIRECTORY, "/".join(split_path))
+            key = self.keyify(DatabaseType.DIRECTORY, "/".join(split_path))
             self._touched_keys[key] = max(self._touched_keys[key], modified_time)
             if not split_path:
                 break
             split_path.pop()
 
+    def add_parent_path_aggregate(self, path, file_count, total_size, modified_time):
+        """
+        Adds to the file count and total size of every directory above path.
+        The newest modified time only grows, it is not lowered when files are deleted.
+        """
+        split_path = [x for x in path.split("/") if x]
+        while split_path:
+            split_path.pop()
+            key = self.keyify(DatabaseType.DIRECTORY, "/".join(split_path))
+            aggregate = self._aggregates[key]
+            aggregate[0] += file_count
+            aggregate[1] += total_size
+            aggregate[2] = max(aggregate[2], modified_time)
+
     def add_hash_to_parent_dir(self, path, h):
         split_path = [x for x in path.split("/") if x]
         split_path.pop()
 
-        parent_key = keyify(DatabaseType.FILELIST, "/".join(split_path))
+        parent_key = self.keyify(DatabaseType.FILELIST, "/".join(split_path))
         self._filelists[parent_key].add(h)
 
     def check_for_commit(self):
-        if self._uncommitted_changes >= COMMIT_COUNTER:
+        """
+        Commits when the uncommitted changes take up too much memory or the last
+        commit is too long ago, small sessions are committed once when they end.
+        """
+        if not self._uncommitted_changes:
+            return
+
+        uncommitted_bytes = (
+            self.db.dirty_bytes + self._uncommitted_changes * BUCKET_ENTRY_SIZE
+        )
+        if (
+            uncommitted_bytes >= self.commit_bytes
+            or time.monotonic() - self._last_commit >= self.commit_interval
+        ):
             self.commit_session()
             self.reset_session()
 
     def _add_item(self, key_type, path, add_time, metadata=None):
-        key = keyify(key_type, path)
+        key = self.keyify(key_type, path)
         is_modified = False
 
-        m = self.db.get(key)
+        m = self._get_item(key)
+        is_existing = bool(m)
+        old_metadata = None
+        if is_existing and "deleted" not in m:
+            old_metadata = indexed_fields(m)
+
         if not m:
             m = {"path": path, "date": add_time, "modified": add_time}
             is_modified = True
+            if self.bloom_filter is not None:
+                self._add_to_bloom_filter(key)
 
             if key_type == DatabaseType.DIRECTORY:
-                filelist_key = keyify(DatabaseType.FILELIST, path)
-                self.db[filelist_key] = set()
+                filelist_key = self.keyify(DatabaseType.FILELIST, path)
+                self.db[filelist_key] = self._pack_keys(set())
 
         if metadata and not compare_dicts(metadata, m):
             m.update(metadata)
@@ -331,6 +1027,18 @@ class FileSystem:
             self.add_hash_to_parent_dir(path, key)
 
             self.db[key] = m
+            if old_metadata is None or indexed_fields(m) != old_metadata:
+                self._index_item(key, m, old_metadata)
+
+            if key_type == DatabaseType.FILE:
+                if old_metadata is None:
+                    self.add_parent_path_aggregate(path, 1, m["size"], add_time)
+                else:
+                    size_change = m["size"] - old_metadata["size"]
+                    self.add_parent_path_aggregate(path, 0, size_change, add_time)
+
+            if is_existing:
+                self._record_change("modified", key)
 
         self.add_hash_to_bucket(key)
 
@@ -349,13 +1057,37 @@ class FileSystem:
         metadata = metadata or {}
         self._add_item(DatabaseType.DIRECTORY, path, add_time, metadata)
 
+    def remove_path(self, path):
+        """
+        Marks a file or directory, including everything below it, as deleted
+        when the session finishes. Used when a session is not complete.
+        """
+        assert self._in_session, "Not in session"
+
+        path = cleanup_path(path)
+        key = self.keyify(DatabaseType.DIRECTORY, path)
+        if not self._item_exists(key):
+            key = self.keyify(DatabaseType.FILE, path)
+            if not self._item_exists(key):
+                raise PathNotFoundException()
+
+        keys = [key]
+        while keys:
+            key = keys.pop()
+            self._removed_hashes[key[1 : 1 + BUCKET_SIZE]].add(key)
+
+            if key[0] == DatabaseType.DIRECTORY:
+                filelist_key = DatabaseType.FILELIST + key[1:]
+                if filelist_key in self.db:
+                    keys.extend(self._unpack_keys(self.db[filelist_key]))
+
     def last_modified(self, path):
         path = cleanup_path(path)
 
-        key = keyify(DatabaseType.DIRECTORY, path)
-        if key not in self.db:
-            key = keyify(DatabaseType.FILE, path)
-            if key not in self.db:
+        key = self.keyify(DatabaseType.DIRECTORY, path)
+        if not self._item_exists(key):
+            key = self.keyify(DatabaseType.FILE, path)
+            if not self._item_exists(key):
                 raise PathNotFoundException()
         metadata = self.db[key]
 
@@ -364,8 +1096,8 @@ class FileSystem:
     def update_metadata(self, db_type, path, metadata):
         assert self._in_session, "Not in session"
 
-        key = keyify(db_type, path)
-        m = self.db.get(key, None)
+        key = self.keyify(db_type, path)
+        m = self._get_item(key)
         if m is None:
             raise PathNotFoundException()
 
@@ -375,22 +1107,105 @@ class FileSystem:
                 modified = True
 
         if modified:
+            old_metadata = indexed_fields(m)
             m.update(metadata)
             self.db[key] = m
 
+            size_change = m.get("size", 0) - old_metadata["size"]
+            if "deleted" not in m and indexed_fields(m) != old_metadata:
+                self._index_item(key, m, old_metadata)
+
+            if db_type == DatabaseType.FILE and "deleted" not in m and size_change:
+                self.add_parent_path_aggregate(path, 0, size_change, 0)
+            self._record_change("modified", key)
+
             if "modified" not in metadata:
                 self.add_parent_path_touched(path, self._current_time)
 
     def get_metadata(self, db_type, path):
-        m = self.db.get(keyify(db_type, path), None)
+        m = self._get_item(self.keyify(db_type, path))
         if m is None:
             raise PathNotFoundException()
         return m
 
+    def get_directory_state(self, path):
+        """
+        Returns the state recorded for a directory during the last scan, if any.
+        """
+        return self.db.get(self.keyify(DatabaseType.DIRECTORY_STATE, path), None)
+
+    def set_directory_state(self, path, state):
+        """
+        Records the state of a directory, e.g. mtime and inode, as seen by a scan.
+        """
+        assert self._in_session, "Not in session"
+
+        self.db[self.keyify(DatabaseType.DIRECTORY_STATE, path)] = state
+
+    def list_children(self, path):
+        """
+        Returns (db_type, metadata) for every item directly below path that is not deleted.
+        """
+        filelist_key = self.keyify(DatabaseType.FILELIST, path)
+        if filelist_key not in self.db:
+            raise PathNotFoundException()
+
+        children = []
+        for key in self._unpack_keys(self.db[filelist_key]):
+            metadata = self.db[key]
+            if metadata.get("deleted", False):
+                continue
+
+            children.append((key[0], metadata))
+
+        return children
+
+    def iter_items(self, db_type, show_deleted=False):
+        """
+        Yields the metadata of all items of db_type, e.g. all files, without
+        loading the whole database.
+        """
+        for _, metadata in self.db.scan(db_type):
+            if not show_deleted and metadata.get("deleted", False):
+                continue
+
+            yield metadata
+
+    def find_files(self, index, value=None, start=None, end=None):
+        """
+        Yields the metadata of the files in an index, in index order, without
+        walking the directories. Deleted files are not in the indexes.
+
+        The extension and fingerprint indexes take a value and are ordered by added date,
+        start and end (exclusive) are an added date for those and the date
+        index and a size for the size index.
+        """
+        if index not in FILE_INDEXES:
+            raise ValueError(
+                f"Unknown index {index!r}, must be one of {list(FILE_INDEXES)}"
+            )
+
+        prefix = FILE_INDEXES[index]
+        if index == "extension":
+            prefix += "%s\x00" % (encode_index_value(value.lower()),)
+        elif index == "fingerprint":
+            prefix += "%s\x00" % (value,)
+        elif value is not None:
+            raise ValueError(f"The {index} index does not take a value")
+
+        value_format = "%016d" if index == "size" else "%012d"
+        if start is not None:
+            start = prefix + value_format % start
+        if end is not None:
+            end = prefix + value_format % end
+
+        for _, key in self.db.scan(prefix, start, end):
+            yield self.db[key]
+
     def _list_dir(self, parent_folder, path, depth, show_deleted):
-        filelist_key = keyify(DatabaseType.FILELIST, path)
+        filelist_key = self.keyify(DatabaseType.FILELIST, path)
 
-        for key in self.db[filelist_key]:
+        for key in self._unpack_keys(self.db[filelist_key]):
             item_type = key[0]
             metadata = self.db[key].copy()
 
@@ -416,18 +1231,89 @@ class FileSystem:
 
         parent_folder.nested_items.sort(key=lambda x: x.id)
 
-    def list_dir(self, path, depth=0, show_deleted=False):
+    def iter_dir(
+        self, path, offset=0, limit=None, sort_key="name", depth=0, after=None
+    ):
+        """
+        Yields the items directly below path in sort_key order, starting at offset.
+        Only the yielded items are loaded, so huge directories can be paged
+        through in bounded memory. Deleted items are not in the index.
+
+        With after, ordered by name, only the items with a name after it are yielded,
+        names are ordered by their utf-8 bytes.
+        """
+        if sort_key not in SORT_KEYS:
+            raise ValueError(
+                f"Unknown sort key {sort_key!r}, must be one of {list(SORT_KEYS)}"
+            )
+
+        if after is not None and sort_key != "name":
+            raise ValueError("after can only be used when ordered by name")
+
         path = cleanup_path(path)
+        if not self._item_exists(self.keyify(DatabaseType.DIRECTORY, path)):
+            raise PathNotFoundException()
 
-        key = keyify(DatabaseType.DIRECTORY, path)
-        if key not in self.db:
+        prefix = self._child_index_prefix(path, sort_key)
+        start = None
+        if after is not None:
+            # skips the entries of after, its name is followed by \x00 and the type
+            start = prefix + encode_index_value(after) + "\x01"
+
+        stop = None if limit is None else offset + limit
+        entries = islice(self.db.scan(prefix, start=start), offset, stop)
+        for _, key in entries:
+            metadata = self.db[key].copy()
+
+            item_path = metadata["path"]
+            item = Item(id=item_path.split("/")[-1], attributes=metadata, router=router)
+
+            if key[0] == DatabaseType.DIRECTORY:
+                if depth:
+                    item.initiate_nested_items()
+                    self._list_dir(item, item_path, depth - 1, False)
+                else:
+                    item.expandable = True
+                    self._trigger_event("list_route_needed", item=item, path=item_path)
+            else:
+                item.readable = True
+                self._trigger_event("file_route_needed", item=item, path=item_path)
+
+            self._trigger_event("on_item", item=item, path=item_path)
+
+            yield item
+
+    def list_dir(
+        self,
+        path,
+        depth=0,
+        show_deleted=False,
+        offset=0,
+        limit=None,
+        sort_key="name",
+        after=None,
+    ):
+        """
+        Lists a directory, a page of the directly nested items is listed
+        with iter_dir when offset, limit or after is set.
+        """
+        path = cleanup_path(path)
+
+        key = self.keyify(DatabaseType.DIRECTORY, path)
+        if not self._item_exists(key):
             raise PathNotFoundException()
         metadata = self.db[key].copy()
 
         item_path = metadata["path"]
         item = Item(id=metadata["path"].split("/")[-1], attributes=metadata)
 
-        if depth >= 0:
+        if depth >= 0 and (offset or limit is not None or after is not None):
+            item.initiate_nested_items()
+            for nested_item in self.iter_dir(
+                path, offset, limit, sort_key, depth, after
+            ):
+                item.add_item(nested_item)
+        elif depth >= 0:
             item.initiate_nested_items()
             self._list_dir(item, path, depth, show_deleted)
         else:
@@ -441,8 +1327,8 @@ class FileSystem:
     def list_file(self, path):
         path = cleanup_path(path)
 
-        key = keyify(DatabaseType.FILE, path)
-        if key not in self.db:
+        key = self.keyify(DatabaseType.FILE, path)
+        if not self._item_exists(key):
             raise PathNotFoundException()
         metadata = self.db[key].copy()
 
@@ -454,3 +1340,25 @@ class FileSystem:
         self._trigger_event("on_item", item=item, path=item_path)
 
         return item
+
+    def reader(self):
+        """
+        Returns a reader of the committed directory states and listings that can
+        be used from other threads while a session writes.
+        """
+        return FileSystemReader(self)
+
+
+class FileSystemReader:
+    """
+    Reads the directory states and listings committed to the database plugin of a FileSystem,
+    the cache layer is not used as it is not safe to share between threads.
+    """
+
+    def __init__(self, fs):
+        self.db = fs.db.backend
+        self.keyify = fs.keyify
+        self._unpack_keys = fs._unpack_keys
+
+    get_directory_state = FileSystem.get_directory_state
+    list_children = FileSystem.list_children